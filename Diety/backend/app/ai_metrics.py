@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+
+@dataclass
+class AICall:
+    model: str | None
+    endpoint: str
+    backend: str
+    # Tempo speso su backend falliti o saltati prima del tentativo registrato.
+    failover_ms: float
+    http_ms: float
+    total_duration_ms: float | None = None
+    load_duration_ms: float | None = None
+    prompt_eval_count: int | None = None
+    eval_count: int | None = None
+    eval_duration_ms: float | None = None
+    # Valorizzato per le chiamate fallite (errore HTTP, timeout, nessun backend disponibile).
+    error: str | None = None
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        if not self.eval_count or not self.eval_duration_ms:
+            return None
+        return self.eval_count / (self.eval_duration_ms / 1000)
+
+
+_calls: ContextVar[list[AICall] | None] = ContextVar("ai_calls", default=None)
+
+
+def _ns_to_ms(value: object) -> float | None:
+    if not isinstance(value, (int, float)):
+        return None
+    return round(value / 1_000_000, 3)
+
+
+def _count(value: object) -> int | None:
+    return int(value) if isinstance(value, (int, float)) else None
+
+
+def call_from_response(
+    raw: dict,
+    model: str | None,
+    endpoint: str,
+    backend: str,
+    failover_ms: float,
+    http_ms: float,
+) -> AICall:
+    # Ollama restituisce le durate in nanosecondi.
+    return AICall(
+        model=model,
+        endpoint=endpoint,
+        backend=backend,
+        failover_ms=round(failover_ms, 3),
+        http_ms=round(http_ms, 3),
+        total_duration_ms=_ns_to_ms(raw.get("total_duration")),
+        load_duration_ms=_ns_to_ms(raw.get("load_duration")),
+        prompt_eval_count=_count(raw.get("prompt_eval_count")),
+        eval_count=_count(raw.get("eval_count")),
+        eval_duration_ms=_ns_to_ms(raw.get("eval_duration")),
+    )
+
+
+@contextmanager
+def track_ai_calls():
+    calls: list[AICall] = []
+    token = _calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _calls.reset(token)
+
+
+def record_ai_call(call: AICall) -> None:
+    calls = _calls.get()
+    if calls is not None:
+        calls.append(call)
+
+
+def drain_ai_calls() -> list[AICall]:
+    calls = _calls.get()
+    if not calls:
+        return []
+    drained = list(calls)
+    calls.clear()
+    return drained
+
+
+def _sum(values: list) -> float | int | None:
+    present = [value for value in values if value is not None]
+    return sum(present) if present else None
+
+
+def interaction_columns(calls: list[AICall]) -> dict:
+    # Una interazione puo' includere piu' chiamate (cicli di revisione, fallback testuale): si sommano.
+    if not calls:
+        return {}
+    return {
+        "call_count": len(calls),
+        "failover_ms": _sum([call.failover_ms for call in calls]),
+        "http_ms": _sum([call.http_ms for call in calls]),
+        "total_duration_ms": _sum([call.total_duration_ms for call in calls]),
+        "load_duration_ms": _sum([call.load_duration_ms for call in calls]),
+        "prompt_eval_count": _sum([call.prompt_eval_count for call in calls]),
+        "eval_count": _sum([call.eval_count for call in calls]),
+        "eval_duration_ms": _sum([call.eval_duration_ms for call in calls]),
+    }
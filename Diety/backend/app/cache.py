@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+from .metrics import record_cache
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024, name: str | None = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        value = self._lookup(key)
+        if self.name:
+            record_cache(self.name, value is not None)
+        return value
+
+    def peek(self, key: Hashable) -> Any | None:
+        # Lettura senza metriche: per sapere in anticipo se servira' una chiamata AI.
+        return self._lookup(key)
+
+    def _lookup(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
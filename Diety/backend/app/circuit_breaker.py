@@ -0,0 +1,112 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass
+class Permit:
+    # Epoca half-open in cui e' stato preso lo slot di sonda; None se la chiamata non e' una sonda.
+    probe_epoch: int | None
+    done: bool = False
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float | None = None,
+        open_seconds: float = 30,
+        half_open_calls: int = 1,
+    ):
+        self.window = max(window, 1)
+        self.min_calls = max(min_calls, 1)
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(half_open_calls, 1)
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        # Cambia a ogni apertura e a ogni passaggio a half-open: i permessi di un'epoca precedente non liberano
+        # gli slot delle sonde attuali.
+        self.epoch = 0
+        self.outcomes: deque[bool] = deque(maxlen=self.window)
+
+    def _refresh_state(self) -> None:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            self.epoch += 1
+
+    def can_attempt(self) -> bool:
+        self._refresh_state()
+        if self.state == OPEN:
+            return False
+        if self.state == HALF_OPEN:
+            return self.probes_in_flight < self.half_open_calls
+        return True
+
+    def try_acquire(self) -> Permit | None:
+        # Ogni permesso va chiuso con release() (nessun esito) oppure record(): conta solo la prima chiamata.
+        if not self.can_attempt():
+            return None
+        if self.state == HALF_OPEN:
+            self.probes_in_flight += 1
+            return Permit(self.epoch)
+        return Permit(None)
+
+    def _finish(self, permit: Permit | None) -> bool:
+        if permit is None:
+            # Senza permesso (uso diretto): libera uno slot di sonda se in half-open.
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+            return True
+        if permit.done:
+            return False
+        permit.done = True
+        if permit.probe_epoch is not None and permit.probe_epoch == self.epoch and self.state == HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+        return True
+
+    def release(self, permit: Permit | None = None) -> None:
+        self._finish(permit)
+
+    def record(self, success: bool, duration: float | None = None, permit: Permit | None = None) -> None:
+        if not self._finish(permit):
+            return
+        slow = (
+            self.slow_call_seconds is not None
+            and duration is not None
+            and duration >= self.slow_call_seconds
+        )
+        healthy = success and not slow
+
+        if self.state == HALF_OPEN:
+            if healthy:
+                self.state = CLOSED
+                self.outcomes.clear()
+            else:
+                self._open()
+            return
+
+        self.outcomes.append(healthy)
+        if len(self.outcomes) < self.min_calls:
+            return
+        failures = sum(1 for outcome in self.outcomes if not outcome)
+        if failures / len(self.outcomes) >= self.failure_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.probes_in_flight = 0
+        self.epoch += 1
+        self.outcomes.clear()
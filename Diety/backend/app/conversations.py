@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .jobs import enqueue_job
+from .models import ChatConversation, ChatTurn, User
+
+
+CHAT_ROLES = {"user", "assistant"}
+
+
+def estimate_tokens(text: str | None) -> int:
+    # Stima grossolana (~4 caratteri per token): basta per tenere il prompt entro il budget.
+    return len(text or "") // 4 + 1
+
+
+def get_conversation(db: Session, user: User, conversation_id: int) -> ChatConversation | None:
+    return (
+        db.query(ChatConversation)
+        .filter(ChatConversation.id == conversation_id, ChatConversation.user_id == user.id)
+        .first()
+    )
+
+
+def create_conversation(db: Session, user: User, title: str, history: list[dict] | None = None) -> ChatConversation:
+    conversation = ChatConversation(user_id=user.id, title=title[:120] or "Nuova chat")
+    db.add(conversation)
+    db.flush()
+    # Storico inviato dal client (chat salvate in locale prima della persistenza lato server).
+    for item in history or []:
+        if item.get("role") in CHAT_ROLES and item.get("content"):
+            db.add(ChatTurn(conversation_id=conversation.id, role=item["role"], content=item["content"]))
+    db.commit()
+    db.refresh(conversation)
+    return conversation
+
+
+def add_turn(db: Session, conversation: ChatConversation, role: str, content: str) -> ChatTurn:
+    turn = ChatTurn(conversation_id=conversation.id, role=role, content=content)
+    db.add(turn)
+    conversation.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(turn)
+    return turn
+
+
+def _unsummarized_turns(db: Session, conversation: ChatConversation) -> list[ChatTurn]:
+    return (
+        db.query(ChatTurn)
+        .filter(
+            ChatTurn.conversation_id == conversation.id,
+            ChatTurn.id > conversation.summarized_until_id,
+        )
+        .order_by(ChatTurn.id.asc())
+        .all()
+    )
+
+
+def build_chat_window(db: Session, conversation: ChatConversation, message: str) -> dict:
+    budget = settings.chat_context_token_budget - estimate_tokens(message) - estimate_tokens(conversation.summary)
+    recent: list[dict] = []
+    # Dal turno piu' recente all'indietro finche' c'e' budget; i turni esclusi sono coperti dal riassunto
+    # oppure lo saranno al prossimo giro del worker.
+    for turn in reversed(_unsummarized_turns(db, conversation)):
+        cost = estimate_tokens(turn.content)
+        if recent and cost > budget:
+            break
+        recent.append({"role": turn.role, "content": turn.content})
+        budget -= cost
+    recent.reverse()
+    return {"summary": conversation.summary, "history": recent}
+
+
+def schedule_summary_if_needed(db: Session, conversation: ChatConversation) -> None:
+    pending = len(_unsummarized_turns(db, conversation)) - settings.chat_recent_turns
+    if pending < settings.chat_summary_trigger_turns:
+        return
+    enqueue_job(
+        db,
+        "chat_summary",
+        {"conversation_id": conversation.id},
+        user_id=conversation.user_id,
+        dedup_key=f"chat_summary:{conversation.id}",
+    )
+
+
+def turns_to_summarize(db: Session, conversation: ChatConversation) -> list[ChatTurn]:
+    turns = _unsummarized_turns(db, conversation)
+    keep = max(settings.chat_recent_turns, 0)
+    return turns[:-keep] if keep else turns
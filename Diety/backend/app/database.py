@@ -1,19 +1,140 @@
+import logging
+import time
 from collections.abc import Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.engine import URL, Engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from .config import settings
+from .metrics import db_pool_events, db_session_duration, db_sessions, register_pool_metrics
+from .profiling import instrument_engine
+from .query_monitor import monitor_engine
 
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+logger = logging.getLogger(__name__)
+
+
+def _engine_options(url: URL) -> dict:
+    pool_options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if url.get_backend_name() == "sqlite":
+        connect_args = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # Database in memoria: una sola connessione condivisa, altrimenti ogni connessione ne vede uno vuoto.
+            return {"connect_args": connect_args, "poolclass": StaticPool}
+        # SQLite su file: QueuePool con le stesse opzioni degli altri database (timeout, recycle, pre-ping).
+        return {"connect_args": connect_args, **pool_options}
+    return pool_options
+
+
+database_url = make_url(settings.database_url)
+engine = create_engine(database_url, **_engine_options(database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+register_pool_metrics(engine)
+instrument_engine(engine)
+monitor_engine(engine)
+
+
+def _count_pool_event(name: str):
+    def listener(*args) -> None:
+        db_pool_events.inc(event=name)
+
+    return listener
+
+
+for _pool_event in ("connect", "checkout", "checkin", "close", "invalidate", "soft_invalidate"):
+    event.listen(engine, _pool_event, _count_pool_event(_pool_event))
+
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record) -> None:
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL: i lettori non bloccano lo scrittore; synchronous=NORMAL e' sicuro con WAL e molto piu' veloce.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kb)}")
+    cursor.close()
+
+
+def create_rate_limit_engine() -> Engine:
+    # Pool separato per i bucket di RATE_LIMIT_BACKEND=database: il controllo avviene mentre la sessione della
+    # richiesta tiene gia' una connessione, e con il pool principale pieno ogni richiesta aspetterebbe la propria.
+    options = _engine_options(database_url)
+    if "poolclass" in options:
+        # SQLite in memoria: il database esiste solo sulla connessione condivisa dell'engine principale.
+        return engine
+    options.update(pool_size=settings.rate_limit_db_pool_size, max_overflow=0)
+    rate_limit_engine = create_engine(database_url, **options)
+    event.listen(rate_limit_engine, "connect", _configure_sqlite)
+    return rate_limit_engine
+
+
+@event.listens_for(engine, "invalidate")
+def _log_invalidate(dbapi_connection, connection_record, exception) -> None:
+    if exception is not None:
+        logger.warning("Connessione DB invalidata: %r", exception)
+
+
+def validate_pool_sizing() -> None:
+    per_process = settings.db_pool_size + settings.db_max_overflow
+    if settings.rate_limit_backend == "database":
+        per_process += settings.rate_limit_db_pool_size
+    processes = settings.web_workers + max(settings.job_worker_processes, 0)
+    required = per_process * processes
+
+    queries = {
+        "mysql": "SHOW VARIABLES LIKE 'max_connections'",
+        "postgresql": "SELECT 'max_connections', current_setting('max_connections')",
+    }
+    query = queries.get(engine.dialect.name)
+    if query is None:
+        return
+    try:
+        with engine.connect() as connection:
+            row = connection.execute(text(query)).first()
+    except Exception:
+        logger.warning("Impossibile leggere max_connections dal database", exc_info=True)
+        return
+    if row is None:
+        return
+
+    max_connections = int(row[1])
+    logger.info(
+        "Pool DB: %s connessioni per processo x %s processi = %s (max_connections: %s)",
+        per_process,
+        processes,
+        required,
+        max_connections,
+    )
+    if required > max_connections:
+        logger.warning(
+            "Il pool puo' aprire fino a %s connessioni ma il database ne accetta %s: riduci DB_POOL_SIZE/"
+            "DB_MAX_OVERFLOW (e RATE_LIMIT_DB_POOL_SIZE) o aumenta max_connections, altrimenti sotto carico le connessioni falliranno.",
+            required,
+            max_connections,
+        )
 
 
 def get_db() -> Generator:
+    started = time.perf_counter()
+    db_sessions.inc()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        db_session_duration.observe(time.perf_counter() - started)
@@ -1,10 +1,14 @@
-from fastapi import Depends, HTTPException, status
+import secrets
+
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from .auth import decode_access_token
+from .config import settings
 from .database import get_db
 from .models import User
+from .rate_limit import take_token
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -44,3 +48,42 @@ def get_current_user(
         )
 
     return user
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)) -> None:
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Token amministratore non valido",
+        )
+
+
+RATE_LIMIT_DETAILS = {
+    "crud": "Troppe richieste, riprova tra qualche secondo.",
+    "ai": "Troppe richieste di analisi AI, riprova tra poco.",
+}
+
+
+def check_rate_limit(budget: str, user: User) -> None:
+    # Per gli endpoint che usano Ollama solo in alcuni casi: il budget si consuma dove la chiamata parte davvero.
+    retry_after = take_token(budget, str(user.id))
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=RATE_LIMIT_DETAILS[budget],
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def _rate_limit(budget: str):
+    def check(current_user: User = Depends(get_current_user)) -> None:
+        check_rate_limit(budget, current_user)
+
+    return check
+
+
+# limit_crud va su tutti i router autenticati; limit_ai in piu' sugli endpoint che occupano Ollama.
+limit_crud = _rate_limit("crud")
+limit_ai = _rate_limit("ai")
@@ -0,0 +1,100 @@
+import asyncio
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+
+from . import database
+from .cache import TTLCache
+from .config import settings
+from .ollama_pool import default_pool
+from .singleflight import SingleFlight
+
+
+_results = TTLCache(ttl_seconds=settings.health_cache_seconds, max_entries=4)
+_ollama_results = TTLCache(ttl_seconds=settings.health_ollama_cache_seconds, max_entries=4)
+_inflight = SingleFlight()
+_database_probe = threading.Lock()
+
+
+def _check_database() -> dict:
+    # Il timeout del controllo risponde alla probe ma non ferma il thread, che puo' restare in attesa del pool
+    # fino a db_pool_timeout: finche' il precedente non termina non se ne avvia un altro.
+    if not _database_probe.acquire(blocking=False):
+        return {"ok": False, "error": "busy"}
+    try:
+        with database.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    finally:
+        _database_probe.release()
+    return {"ok": True}
+
+
+def _check_upload_dir() -> dict:
+    # Scrittura reale: os.access non rileva volumi montati in sola lettura o disco pieno.
+    with tempfile.NamedTemporaryFile(dir=settings.upload_dir, prefix=".health-") as probe:
+        probe.write(b"ok")
+        probe.flush()
+    return {"ok": True}
+
+
+async def _check_ollama() -> dict:
+    cached = _ollama_results.get("ollama")
+    if cached is not None:
+        return cached
+
+    pool = default_pool()
+    # Aggiorna anche lo stato usato dal pool per scegliere il backend.
+    await pool.probe_all()
+    healthy = [backend for backend in pool.backends if backend.healthy]
+    installed = set().union(*(backend.installed_models for backend in healthy)) if healthy else set()
+    required = {settings.ollama_text_model, settings.ollama_model}
+    missing = sorted(required - installed)
+
+    result = {
+        "ok": bool(healthy) and not missing,
+        "backends": {backend.base_url: backend.healthy for backend in pool.backends},
+        "missing_models": missing,
+    }
+    _ollama_results.set("ollama", result)
+    return result
+
+
+async def _run_check(check) -> dict:
+    started = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(check):
+            result = await asyncio.wait_for(check(), timeout=settings.health_check_timeout)
+        else:
+            result = await asyncio.wait_for(asyncio.to_thread(check), timeout=settings.health_check_timeout)
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": "timeout"}
+    except Exception as exc:
+        result = {"ok": False, "error": exc.__class__.__name__}
+    return {**result, "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+async def _readiness() -> dict:
+    results = await asyncio.gather(
+        _run_check(_check_database),
+        _run_check(_check_upload_dir),
+        _run_check(_check_ollama),
+    )
+    checks = dict(zip(("database", "upload_dir", "ollama"), results))
+    required = ["database", "upload_dir"] + (["ollama"] if settings.health_require_ollama else [])
+    if not all(checks[name]["ok"] for name in required):
+        status = "unavailable"
+    else:
+        status = "ready" if all(check["ok"] for check in checks.values()) else "degraded"
+    return {"status": status, "checks": checks}
+
+
+async def readiness() -> dict:
+    cached = _results.get("ready")
+    if cached is not None:
+        return cached
+    # Probe concorrenti condividono lo stesso controllo.
+    result = await _inflight.do("ready", _readiness)
+    _results.set("ready", result)
+    return result
@@ -0,0 +1,175 @@
+import json
+import os
+import random
+import socket
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Job
+from .tracing import current_traceparent
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JobHandler = Callable[[Session, Job, dict], Awaitable[dict | None]]
+_handlers: dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    def register(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        return func
+
+    return register
+
+
+def get_job_handler(kind: str) -> JobHandler | None:
+    return _handlers.get(kind)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def job_payload(job: Job) -> dict:
+    try:
+        return json.loads(job.payload) if job.payload else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def job_result(job: Job) -> dict | None:
+    try:
+        return json.loads(job.result) if job.result else None
+    except json.JSONDecodeError:
+        return None
+
+
+def discard_job_file(job: Job) -> None:
+    # Il file temporaneo del job non serve piu' quando il job e' fallito definitivamente.
+    file_path = job_payload(job).get("file_path")
+    if not file_path:
+        return
+    path = Path(file_path)
+    if Path(settings.job_files_dir).resolve() in path.resolve().parents:
+        path.unlink(missing_ok=True)
+
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    payload: dict | None = None,
+    user_id: int | None = None,
+    dedup_key: str | None = None,
+    run_after: datetime | None = None,
+    max_attempts: int | None = None,
+    commit: bool = True,
+) -> Job:
+    if dedup_key:
+        existing = db.query(Job).filter(Job.dedup_key == dedup_key).first()
+        if existing:
+            return existing
+
+    traceparent = current_traceparent()
+    if traceparent:
+        payload = {**(payload or {}), "traceparent": traceparent}
+    job = Job(
+        user_id=user_id,
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False, default=str),
+        dedup_key=dedup_key,
+        status=QUEUED,
+        max_attempts=max_attempts or settings.job_max_attempts,
+        run_after=run_after or datetime.utcnow(),
+    )
+    if not commit:
+        # Il chiamante committa il job insieme alle proprie modifiche, nella stessa transazione. Nel SAVEPOINT
+        # un dedup_key inserito nel frattempo da un altro processo annulla solo il job, non quelle modifiche.
+        try:
+            with db.begin_nested():
+                db.add(job)
+        except IntegrityError:
+            return db.query(Job).filter(Job.dedup_key == dedup_key).one()
+        return job
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Stesso dedup_key inserito da un altro processo.
+        db.rollback()
+        return db.query(Job).filter(Job.dedup_key == dedup_key).one()
+    db.refresh(job)
+    return job
+
+
+def claim_jobs(db: Session, worker_id: str, limit: int, kinds: list[str] | None = None) -> list[Job]:
+    now = datetime.utcnow()
+    query = db.query(Job).filter(
+        or_(
+            and_(Job.status == QUEUED, Job.run_after <= now),
+            # Job rimasti "running" oltre il visibility timeout: il worker e' morto.
+            and_(Job.status == RUNNING, Job.locked_until < now),
+        )
+    )
+    if kinds:
+        query = query.filter(Job.kind.in_(kinds))
+    # SKIP LOCKED vale su MySQL e PostgreSQL; SQLite lo ignora e non blocca le righe lette, quindi due
+    # processi worker potrebbero prendere lo stesso job: con SQLite va usato un solo processo worker.
+    candidates = (
+        query.order_by(Job.run_after.asc(), Job.id.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    claimed = []
+    for job in candidates:
+        if job.status == RUNNING and job.attempts >= job.max_attempts:
+            job.status = FAILED
+            job.dedup_key = None
+            job.locked_until = None
+            job.last_error = job.last_error or "Visibility timeout superato"
+            discard_job_file(job)
+            continue
+        job.status = RUNNING
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_until = now + timedelta(seconds=settings.job_visibility_timeout)
+        claimed.append(job)
+    db.commit()
+    return claimed
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    delay = settings.job_retry_base_seconds * (2 ** max(attempts - 1, 0))
+    return min(delay, settings.job_retry_max_seconds) * random.uniform(0.8, 1.2)
+
+
+def complete_job(db: Session, job: Job, result: dict | None = None) -> None:
+    job.status = DONE
+    job.result = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+    job.dedup_key = None
+    job.locked_until = None
+    db.commit()
+
+
+def fail_job(db: Session, job: Job, error: str) -> None:
+    job.last_error = error[:4000]
+    job.locked_until = None
+    if job.attempts >= job.max_attempts:
+        job.status = FAILED
+        job.dedup_key = None
+        discard_job_file(job)
+    else:
+        job.status = QUEUED
+        job.run_after = datetime.utcnow() + timedelta(seconds=retry_delay_seconds(job.attempts))
+    db.commit()
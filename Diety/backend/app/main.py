@@ -1,21 +1,81 @@
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+from .ai_metrics import track_ai_calls
 from .config import settings as app_settings
-from .database import Base, engine
-from .migrations import run_startup_migrations
-from .routers import auth, body_photos, chat, meals, routine, settings as settings_router, summary, water
+from .database import validate_pool_sizing
+from .deps import require_admin
+from .health import readiness
+from .metrics import (
+    MetricsMiddleware,
+    db_pool_timeouts,
+    registry,
+    start_metrics_snapshots,
+    stop_metrics_snapshots,
+)
+from .ollama_pool import start_health_checks, stop_health_checks
+from .profiling import ProfiledJSONResponse, ProfilingMiddleware, instrument_fastapi
+from .query_monitor import QueryMonitorMiddleware
+
+# I router vanno registrati prima della prima richiesta (routing e OpenAPI), quindi restano import diretti:
+# costano poco perche' httpx, passlib, jose e l'elaborazione immagini si caricano al primo uso.
+from .routers import (
+    admin,
+    auth,
+    body_photos,
+    chat,
+    dashboard,
+    jobs,
+    meals,
+    routine,
+    settings as settings_router,
+    summary,
+    water,
+)
+from .tracing import TracingMiddleware, shutdown_tracing
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 STATIC_DIR = BASE_DIR / "static"
 
-app = FastAPI(title=app_settings.app_name, version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nessuna riflessione dello schema per worker: al piu' una SELECT sulla versione. Le migrazioni (con gli
+    # snapshot dello schema) si importano solo se servono: con "skip" il worker non le carica.
+    if app_settings.db_schema_on_startup == "migrate":
+        from .migrations import migrate
+
+        migrate()
+    elif app_settings.db_schema_on_startup == "check":
+        from .migrations import check_schema_version
+
+        check_schema_version()
+    validate_pool_sizing()
+    os.makedirs(app_settings.upload_dir, exist_ok=True)
+    start_health_checks()
+    start_metrics_snapshots()
+    yield
+    await stop_health_checks()
+    stop_metrics_snapshots()
+    shutdown_tracing()
+
+
+if app_settings.profiling_enabled:
+    instrument_fastapi()
+app = FastAPI(
+    title=app_settings.app_name,
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ProfiledJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,26 +84,44 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryMonitorMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(TracingMiddleware)
+
+
+@app.middleware("http")
+async def ai_call_scope(request: Request, call_next):
+    # Raccoglie le metriche delle chiamate Ollama della richiesta per log_ai_interaction.
+    with track_ai_calls():
+        return await call_next(request)
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError) -> JSONResponse:
+    db_pool_timeouts.inc()
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servizio momentaneamente sovraccarico, riprova tra poco."},
+        headers={"Retry-After": "2"},
+    )
+
 
 app.include_router(auth.router)
 app.include_router(routine.router)
 app.include_router(meals.router)
 app.include_router(summary.router)
+app.include_router(dashboard.router)
 app.include_router(settings_router.router)
 app.include_router(water.router)
 app.include_router(body_photos.router)
 app.include_router(chat.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
 
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
-@app.on_event("startup")
-def on_startup() -> None:
-    Base.metadata.create_all(bind=engine)
-    run_startup_migrations()
-    os.makedirs(app_settings.upload_dir, exist_ok=True)
-
-
 @app.get("/", include_in_schema=False)
 def index() -> FileResponse:
     return FileResponse(str(STATIC_DIR / "index.html"))
@@ -54,6 +132,23 @@ def settings_page() -> FileResponse:
     return FileResponse(str(STATIC_DIR / "settings.html"))
 
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health", tags=["System"])
 def health_check() -> dict:
     return {"status": "ok", "app": app_settings.app_name}
+
+
+@app.get("/health/live", tags=["System"])
+def liveness_check() -> dict:
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", tags=["System"])
+async def readiness_check() -> JSONResponse:
+    result = await readiness()
+    # "degraded": Ollama non raggiungibile ma non richiesto, il resto dell'API funziona.
+    return JSONResponse(result, status_code=503 if result["status"] == "unavailable" else 200)
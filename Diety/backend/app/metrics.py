@@ -0,0 +1,401 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+AI_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        # Etichetta mancante o None: stringa vuota, non "None".
+        values = (labels.get(name) for name in self.labelnames)
+        return tuple("" if value is None else str(value) for value in values)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self) -> dict[tuple[str, ...], object]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values: dict, other: dict) -> dict:
+        merged = dict(values)
+        for key, value in other.items():
+            merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def format(self, values: dict) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()]
+
+    def render(self) -> list[str]:
+        return self.format(self.snapshot())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        function: Callable[[], float | None] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def snapshot(self) -> dict[tuple[str, ...], object]:
+        if self._function is not None:
+            value = self._function()
+            return {} if value is None else {(): value}
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per etichetta: conteggi per bucket (non cumulativi), somma e totale.
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict[tuple[str, ...], object]:
+        with self._lock:
+            return {key: [list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(values: dict, other: dict) -> dict:
+        merged = dict(values)
+        for key, (counts, total, count) in other.items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = [list(counts), total, count]
+            else:
+                merged[key] = [[a + b for a, b in zip(current[0], counts)], current[1] + total, current[2] + count]
+        return merged
+
+    def format(self, values: dict) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict[str, list]:
+        return {
+            metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in self._metrics
+        }
+
+    def render(self) -> str:
+        if settings.metrics_multiprocess_dir:
+            values = _collect_processes(self._metrics)
+        else:
+            values = {metric.name: metric.snapshot() for metric in self._metrics}
+        lines = []
+        for metric in self._metrics:
+            samples = metric.format(values.get(metric.name, {}))
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Con piu' worker (app.serve) ogni processo ha il proprio registro: ciascuno scrive periodicamente uno snapshot
+# in metrics_multiprocess_dir e /metrics somma quelli di tutti i processi. Contatori e istogrammi dei processi
+# terminati (worker riciclati) restano nel totale, i gauge contano solo i processi vivi.
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(settings.metrics_multiprocess_dir, f"{pid}.json")
+
+
+def write_snapshot() -> None:
+    path = _snapshot_path(os.getpid())
+    temporary = f"{path}.tmp"
+    try:
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(registry.snapshot(), handle)
+        os.replace(temporary, path)
+    except OSError:
+        logger.warning("Snapshot delle metriche non scritto in %s", path, exc_info=True)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect_processes(metrics: list[_Metric]) -> dict[str, dict]:
+    # Il processo che risponde usa i propri valori attuali, gli altri l'ultimo snapshot scritto.
+    write_snapshot()
+    by_name = {metric.name: metric for metric in metrics}
+    values: dict[str, dict] = {}
+    for filename in sorted(os.listdir(settings.metrics_multiprocess_dir)):
+        pid, extension = os.path.splitext(filename)
+        if extension != ".json" or not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(settings.metrics_multiprocess_dir, filename), encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        alive = _process_alive(int(pid))
+        for name, items in snapshot.items():
+            metric = by_name.get(name)
+            if metric is None or (metric.kind == "gauge" and not alive):
+                continue
+            other = {tuple(key): value for key, value in items}
+            values[name] = metric.merge(values.get(name, {}), other)
+    return values
+
+
+_snapshot_stop = threading.Event()
+_snapshot_thread: threading.Thread | None = None
+
+
+def _snapshot_loop() -> None:
+    while not _snapshot_stop.wait(settings.metrics_snapshot_interval):
+        write_snapshot()
+
+
+def start_metrics_snapshots() -> None:
+    global _snapshot_thread
+    if not settings.metrics_multiprocess_dir or _snapshot_thread is not None:
+        return
+    os.makedirs(settings.metrics_multiprocess_dir, exist_ok=True)
+    _snapshot_stop.clear()
+    _snapshot_thread = threading.Thread(target=_snapshot_loop, name="metrics-snapshots", daemon=True)
+    _snapshot_thread.start()
+
+
+def stop_metrics_snapshots() -> None:
+    global _snapshot_thread
+    if _snapshot_thread is None:
+        return
+    _snapshot_stop.set()
+    _snapshot_thread.join(timeout=5)
+    _snapshot_thread = None
+    # Ultimo snapshot all'uscita: i contatori di un worker riciclato non vanno persi.
+    write_snapshot()
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter("dietly_http_requests_total", "Richieste HTTP per route e status", ("method", "route", "status"))
+)
+http_latency = registry.register(
+    Histogram("dietly_http_request_duration_seconds", "Latenza delle richieste HTTP", ("method", "route"))
+)
+http_in_flight = registry.register(Gauge("dietly_http_requests_in_flight", "Richieste HTTP in corso"))
+db_pool_events = registry.register(
+    Counter("dietly_db_pool_events_total", "Eventi del pool di connessioni DB", ("event",))
+)
+db_pool_timeouts = registry.register(
+    Counter("dietly_db_pool_timeouts_total", "Richieste fallite per timeout nel checkout dal pool DB")
+)
+db_sessions = registry.register(Counter("dietly_db_sessions_total", "Sessioni DB aperte da get_db"))
+db_session_duration = registry.register(
+    Histogram("dietly_db_session_duration_seconds", "Durata delle sessioni DB di get_db")
+)
+db_queries_per_scope = registry.register(
+    Histogram(
+        "dietly_db_queries",
+        "Query SQL per richiesta HTTP (route) o job (job:tipo)",
+        ("scope",),
+        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+    )
+)
+db_slow_queries = registry.register(Counter("dietly_db_slow_queries_total", "Query oltre DB_SLOW_QUERY_MS"))
+db_repeated_queries = registry.register(
+    Counter(
+        "dietly_db_repeated_queries_total",
+        "Richieste o job con la stessa query ripetuta oltre DB_REPEATED_QUERY_THRESHOLD",
+        ("scope",),
+    )
+)
+ollama_latency = registry.register(
+    Histogram(
+        "dietly_ollama_request_duration_seconds",
+        "Durata delle chiamate HTTP a Ollama",
+        ("model", "endpoint", "outcome"),
+        buckets=AI_BUCKETS,
+    )
+)
+ai_interactions = registry.register(
+    Histogram(
+        "dietly_ai_interaction_duration_seconds",
+        "Durata complessiva delle interazioni AI registrate",
+        ("model", "kind"),
+        buckets=AI_BUCKETS,
+    )
+)
+ai_tokens = registry.register(
+    Counter("dietly_ai_tokens_total", "Token elaborati da Ollama", ("model", "kind", "phase"))
+)
+cache_requests = registry.register(
+    Counter("dietly_cache_requests_total", "Letture dalle cache applicative", ("cache", "result"))
+)
+upload_bytes = registry.register(
+    Counter("dietly_upload_bytes_total", "Byte ricevuti tramite upload", ("kind",))
+)
+rate_limited = registry.register(
+    Counter("dietly_rate_limited_total", "Richieste respinte dal rate limit per budget", ("budget",))
+)
+tracing_spans = registry.register(
+    Counter("dietly_tracing_spans_total", "Span di tracing esportati, falliti o scartati", ("outcome",))
+)
+
+
+def register_pool_metrics(engine) -> None:
+    def reader(attribute: str) -> Callable[[], float | None]:
+        def read() -> float | None:
+            # Solo QueuePool espone queste statistiche (ad esempio StaticPool di SQLite no).
+            method = getattr(engine.pool, attribute, None)
+            return method() if callable(method) else None
+
+        return read
+
+    for name, attribute, documentation in (
+        ("dietly_db_pool_size", "size", "Dimensione configurata del pool DB"),
+        ("dietly_db_pool_checked_out", "checkedout", "Connessioni DB in uso"),
+        ("dietly_db_pool_checked_in", "checkedin", "Connessioni DB libere nel pool"),
+        ("dietly_db_pool_overflow", "overflow", "Connessioni DB oltre pool_size"),
+    ):
+        registry.register(Gauge(name, documentation, function=reader(attribute)))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        http_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            # Template della route (es. /api/jobs/{job_id}) per non esplodere la cardinalita'.
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_latency.observe(time.perf_counter() - started, method=method, route=route_path)
+            http_requests.inc(method=method, route=route_path, status=str(status_code))
@@ -1,41 +1,302 @@
-from sqlalchemy import inspect, text
+import argparse
+import logging
+import time
+import zlib
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    inspect,
+    literal,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection
 
 from .database import engine
+from .schema_snapshots import baseline, body_photo_comparisons_v6, rate_limit_buckets_v5
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "dietly_schema_migrations"
+
+# Tabella separata da Base.metadata: create_all non deve crearla ne' rifletterla.
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+_migrations: list[Migration] = []
+
+
+def migration(version: int, name: str) -> Callable[[Callable[[Connection], None]], Callable[[Connection], None]]:
+    def register(func: Callable[[Connection], None]) -> Callable[[Connection], None]:
+        if any(item.version == version for item in _migrations):
+            raise ValueError(f"Versione di migrazione duplicata: {version}")
+        _migrations.append(Migration(version, name, func))
+        _migrations.sort(key=lambda item: item.version)
+        return func
+
+    return register
+
+
+def _column_ddl(connection: Connection, column: Column) -> str:
+    # Tipo e nullabilita' vengono dalla colonna congelata nella migrazione, compilati per il dialetto in uso
+    # (es. Boolean -> TINYINT(1) su MySQL, BOOLEAN su PostgreSQL e SQLite).
+    dialect = connection.dialect
+    ddl = column.type.compile(dialect=dialect)
+    if column.default is not None:
+        rendered = literal(column.default.arg, type_=column.type).compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}
+        )
+        ddl += f" DEFAULT {rendered}"
+    ddl += " NULL" if column.nullable else " NOT NULL"
+    return ddl
+
+
+def _add_missing_columns(connection: Connection, table_name: str, columns: list[Column]) -> None:
+    # Colonne definite come letterali nella migrazione, non lette da models.py: una migrazione gia' rilasciata
+    # emette sempre lo stesso DDL. I database creati prima del versionamento possono avere gia' alcune colonne:
+    # una sola lettura dei metadati per tabella, poi solo gli ALTER necessari.
+    existing = {column["name"] for column in inspect(connection).get_columns(table_name)}
+    for column in columns:
+        if column.name in existing:
+            continue
+        ddl = _column_ddl(connection, column)
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {ddl}"))
+
+
+@migration(1, "baseline")
+def _baseline(connection: Connection) -> None:
+    # Schema congelato, non i modelli attuali: le colonne aggiunte dopo arrivano dalle migrazioni successive.
+    baseline.create_all(bind=connection)
+
+
+@migration(2, "ai_settings_profile")
+def _ai_settings_profile(connection: Connection) -> None:
+    _add_missing_columns(
+        connection,
+        "ai_settings",
+        [
+            Column("age_years", Integer, nullable=True),
+            Column("sex", String(32), nullable=True),
+            Column("height_cm", Float, nullable=True),
+            Column("weight_kg", Float, nullable=True),
+            Column("target_weight_kg", Float, nullable=True),
+            Column("activity_level", String(32), nullable=True),
+            Column("goals", Text, nullable=True),
+            Column("dietary_preferences", Text, nullable=True),
+            Column("allergies", Text, nullable=True),
+            Column("response_language", String(16), nullable=False, default="it"),
+            Column("system_prompt", Text, nullable=True),
+            Column("reasoning_cycles", Integer, nullable=False, default=1),
+            Column("smart_routine_enabled", Boolean, nullable=False, default=False),
+        ],
+    )
+
+
+@migration(3, "body_photo_analysis_status")
+def _body_photo_analysis_status(connection: Connection) -> None:
+    # Le foto gia' presenti sono state analizzate in modo sincrono.
+    _add_missing_columns(
+        connection, "body_photos", [Column("analysis_status", String(16), nullable=False, default="done")]
+    )
 
 
-def _column_exists(table_name: str, column_name: str) -> bool:
-    inspector = inspect(engine)
-    if table_name not in inspector.get_table_names():
-        return False
-    columns = {column["name"] for column in inspector.get_columns(table_name)}
-    return column_name in columns
+@migration(4, "ai_interaction_metrics")
+def _ai_interaction_metrics(connection: Connection) -> None:
+    _add_missing_columns(
+        connection,
+        "ai_interactions",
+        [
+            Column("call_count", Integer, nullable=True),
+            Column("queue_wait_ms", Float, nullable=True),
+            Column("http_ms", Float, nullable=True),
+            Column("total_duration_ms", Float, nullable=True),
+            Column("load_duration_ms", Float, nullable=True),
+            Column("prompt_eval_count", Integer, nullable=True),
+            Column("eval_count", Integer, nullable=True),
+            Column("eval_duration_ms", Float, nullable=True),
+        ],
+    )
 
 
-def _add_column_if_missing(table_name: str, column_name: str, ddl_type: str) -> None:
-    if _column_exists(table_name, column_name):
+@migration(5, "rate_limit_buckets")
+def _rate_limit_buckets(connection: Connection) -> None:
+    rate_limit_buckets_v5.create(bind=connection, checkfirst=True)
+
+
+@migration(6, "body_photo_comparison_prompt_key")
+def _body_photo_comparison_prompt_key(connection: Connection) -> None:
+    # I confronti sono una cache rigenerabile: la tabella si ricrea con la nuova chiave univoca invece di
+    # gestire il drop del vincolo per ogni dialetto (SQLite non lo supporta senza ricostruire la tabella).
+    body_photo_comparisons_v6.drop(bind=connection, checkfirst=True)
+    body_photo_comparisons_v6.create(bind=connection)
+
+
+@migration(7, "ai_interaction_error")
+def _ai_interaction_error(connection: Connection) -> None:
+    _add_missing_columns(connection, "ai_interactions", [Column("error", Text, nullable=True)])
+
+
+@migration(8, "ai_interaction_failover_ms")
+def _ai_interaction_failover_ms(connection: Connection) -> None:
+    # queue_wait_ms misurava il tempo speso sui backend falliti prima dell'ultimo tentativo, non un'attesa in coda.
+    # RENAME COLUMN: MySQL 8+, PostgreSQL, SQLite 3.25+ (gli stessi minimi delle statistiche AI).
+    connection.execute(text("ALTER TABLE ai_interactions RENAME COLUMN queue_wait_ms TO failover_ms"))
+
+
+def latest_version() -> int:
+    return _migrations[-1].version if _migrations else 0
+
+
+def current_version(connection: Connection | None = None) -> int:
+    if connection is None:
+        with engine.connect() as own_connection:
+            return current_version(own_connection)
+    try:
+        version = connection.execute(
+            select(schema_migrations.c.version).order_by(schema_migrations.c.version.desc()).limit(1)
+        ).scalar()
+    except Exception:
+        # Tabella assente: database vuoto o precedente al versionamento.
+        connection.rollback()
+        return 0
+    return version or 0
+
+
+@contextmanager
+def _file_lock(path: str, timeout_seconds: int):
+    # fcntl solo su POSIX: importato qui, come le altre dipendenze usate da un solo dialetto.
+    import fcntl
+
+    with open(path, "a") as handle:
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Lock {path} non ottenuto entro {timeout_seconds}s") from None
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _advisory_lock(connection: Connection, timeout_seconds: int):
+    # Un solo processo alla volta applica le migrazioni; gli altri attendono e poi trovano tutto applicato.
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        # SQLite non ha lock applicativi e tra la lettura della versione e le scritture di migrate() non tiene
+        # alcun lock: due processi applicherebbero le stesse migrazioni. Lock su un file accanto al database;
+        # i database in memoria appartengono a un solo processo.
+        database = connection.engine.url.database
+        if not database or database == ":memory:" or database.startswith("file:"):
+            yield
+            return
+        with _file_lock(f"{database}.migrate.lock", timeout_seconds):
+            yield
         return
+    if dialect == "mysql":
+        acquired = connection.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"), {"name": LOCK_NAME, "timeout": timeout_seconds}
+        ).scalar()
+        if acquired != 1:
+            raise TimeoutError(f"Lock {LOCK_NAME} non ottenuto entro {timeout_seconds}s")
+    elif dialect == "postgresql":
+        key = zlib.crc32(LOCK_NAME.encode())
+        connection.execute(
+            text("SELECT set_config('lock_timeout', :timeout, false)"), {"timeout": f"{timeout_seconds}s"}
+        )
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+    connection.commit()
+    try:
+        yield
+    finally:
+        if dialect == "mysql":
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+        elif dialect == "postgresql":
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+        connection.commit()
+
 
-    statement = text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_type}")
-    with engine.begin() as connection:
-        connection.execute(statement)
+def migrate(lock_timeout: int = 300) -> list[int]:
+    applied = []
+    with engine.connect() as connection:
+        with _advisory_lock(connection, lock_timeout):
+            _metadata.create_all(bind=connection)
+            connection.commit()
+            # Letta dopo aver preso il lock: un altro processo potrebbe aver appena migrato.
+            version = current_version(connection)
+            connection.commit()
+            for item in _migrations:
+                if item.version <= version:
+                    continue
+                logger.info("Applico la migrazione %s (%s)", item.version, item.name)
+                with connection.begin():
+                    item.apply(connection)
+                    connection.execute(
+                        schema_migrations.insert().values(
+                            version=item.version, name=item.name, applied_at=datetime.utcnow()
+                        )
+                    )
+                applied.append(item.version)
+    return applied
 
 
-def run_startup_migrations() -> None:
-    # Lightweight schema drift handling for ai_settings in MVP setup without Alembic.
-    table = "ai_settings"
-    inspector = inspect(engine)
-    if table not in inspector.get_table_names():
+def check_schema_version() -> bool:
+    version = current_version()
+    if version >= latest_version():
+        return True
+    logger.error(
+        "Schema del database alla versione %s, attesa %s: esegui `python -m app.migrations`",
+        version,
+        latest_version(),
+    )
+    return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dietly schema migrations")
+    parser.add_argument("--status", action="store_true", help="Mostra la versione dello schema senza migrare")
+    parser.add_argument("--lock-timeout", type=int, default=300, help="Secondi di attesa per il lock")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.status:
+        print(f"schema {current_version()} / {latest_version()}")
         return
-    _add_column_if_missing(table, "age_years", "INT NULL")
-    _add_column_if_missing(table, "sex", "VARCHAR(32) NULL")
-    _add_column_if_missing(table, "height_cm", "FLOAT NULL")
-    _add_column_if_missing(table, "weight_kg", "FLOAT NULL")
-    _add_column_if_missing(table, "target_weight_kg", "FLOAT NULL")
-    _add_column_if_missing(table, "activity_level", "VARCHAR(32) NULL")
-    _add_column_if_missing(table, "goals", "TEXT NULL")
-    _add_column_if_missing(table, "dietary_preferences", "TEXT NULL")
-    _add_column_if_missing(table, "allergies", "TEXT NULL")
-    _add_column_if_missing(table, "response_language", "VARCHAR(16) NOT NULL DEFAULT 'it'")
-    _add_column_if_missing(table, "system_prompt", "TEXT NULL")
-    _add_column_if_missing(table, "reasoning_cycles", "INT NOT NULL DEFAULT 1")
-    _add_column_if_missing(table, "smart_routine_enabled", "TINYINT(1) NOT NULL DEFAULT 0")
+    applied = migrate(args.lock_timeout)
+    logger.info("Migrazioni applicate: %s", applied or "nessuna, schema aggiornato")
+
+
+if __name__ == "__main__":
+    main()
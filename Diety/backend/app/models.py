@@ -5,6 +5,7 @@ from sqlalchemy import (
     Column,
     Date,
     DateTime,
+    Double,
     Float,
     ForeignKey,
     Integer,
@@ -33,7 +34,12 @@ class User(Base):
     ai_settings = relationship("AISettings", back_populates="user", uselist=False, cascade="all, delete-orphan")
     water_intakes = relationship("WaterIntake", back_populates="user", cascade="all, delete-orphan")
     body_photos = relationship("BodyPhoto", back_populates="user", cascade="all, delete-orphan")
+    body_photo_comparisons = relationship(
+        "BodyPhotoComparison", back_populates="user", cascade="all, delete-orphan"
+    )
     ai_interactions = relationship("AIInteraction", back_populates="user", cascade="all, delete-orphan")
+    jobs = relationship("Job", back_populates="user", cascade="all, delete-orphan")
+    chat_conversations = relationship("ChatConversation", back_populates="user", cascade="all, delete-orphan")
 
 
 class Routine(Base):
@@ -147,7 +153,18 @@ class AIInteraction(Base):
     input_payload = Column(Text, nullable=True)
     output_payload = Column(Text, nullable=True)
     meta = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Metriche delle chiamate Ollama (somma se l'interazione ne ha fatte piu' di una).
+    call_count = Column(Integer, nullable=True)
+    failover_ms = Column(Float, nullable=True)
+    http_ms = Column(Float, nullable=True)
+    total_duration_ms = Column(Float, nullable=True)
+    load_duration_ms = Column(Float, nullable=True)
+    prompt_eval_count = Column(Integer, nullable=True)
+    eval_count = Column(Integer, nullable=True)
+    eval_duration_ms = Column(Float, nullable=True)
+    # Errore che ha fatto fallire l'interazione; NULL se riuscita.
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     user = relationship("User", back_populates="ai_interactions")
 
@@ -174,6 +191,95 @@ class BodyPhoto(Base):
     captured_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
     ai_summary = Column(Text, nullable=True)
     ai_payload = Column(Text, nullable=True)
+    analysis_status = Column(String(16), default="pending", nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     user = relationship("User", back_populates="body_photos")
+
+
+class BodyPhotoComparison(Base):
+    __tablename__ = "body_photo_comparisons"
+    __table_args__ = (
+        UniqueConstraint("user_id", "photo_ids", "model", "prompt_key", name="uq_body_photo_comparison_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    kind = Column(String(16), nullable=False)
+    # Id delle foto confrontate, dalla piu' recente alla meno recente (es. "12,9").
+    photo_ids = Column(String(191), nullable=False)
+    latest_id = Column(Integer, ForeignKey("body_photos.id"), nullable=False, index=True)
+    previous_id = Column(Integer, ForeignKey("body_photos.id"), nullable=False, index=True)
+    model = Column(String(120), nullable=False)
+    # Digest di lingua, system prompt e cicli di ragionamento: cambiarli produce un nuovo confronto.
+    prompt_key = Column(String(40), nullable=False, default="")
+    comparison = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    user = relationship("User", back_populates="body_photo_comparisons")
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    kind = Column(String(40), nullable=False, index=True)
+    payload = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)
+    dedup_key = Column(String(191), nullable=True, unique=True)
+
+    status = Column(String(16), default="queued", nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    locked_until = Column(DateTime, nullable=True)
+    locked_by = Column(String(120), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    user = relationship("User", back_populates="jobs")
+
+
+class ChatConversation(Base):
+    __tablename__ = "chat_conversations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    title = Column(String(120), nullable=False, default="Nuova chat")
+    # Riassunto incrementale dei turni con id <= summarized_until_id.
+    summary = Column(Text, nullable=True)
+    summarized_until_id = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+
+    user = relationship("User", back_populates="chat_conversations")
+    turns = relationship(
+        "ChatTurn",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        order_by="ChatTurn.id",
+    )
+
+
+class ChatTurn(Base):
+    __tablename__ = "chat_turns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("chat_conversations.id"), nullable=False, index=True)
+    role = Column(String(16), nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    conversation = relationship("ChatConversation", back_populates="turns")
+
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    # "<budget>:<subject JWT>"; tokens e updated_at (secondi epoch) in doppia precisione.
+    key = Column(String(191), primary_key=True)
+    tokens = Column(Double, nullable=False)
+    updated_at = Column(Double, nullable=False)
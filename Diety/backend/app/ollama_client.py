@@ -1,16 +1,26 @@
 import base64
 import json
 import re
+import time
+from dataclasses import dataclass
 
-import httpx
-
+from .ai_metrics import AICall, call_from_response, record_ai_call
 from .config import settings
+from .metrics import ollama_latency
+from .ollama_pool import pool_for
+from .profiling import span
 
 
 class OllamaServiceError(Exception):
     pass
 
 
+@dataclass
+class GenerateResult:
+    text: str
+    call: AICall
+
+
 VALID_MEAL_TYPES = {"breakfast", "lunch", "dinner", "snack", "other"}
 MEAL_TYPE_ALIASES = {
     "breakfast": "breakfast",
@@ -206,81 +216,207 @@ def _safe_text(value: object, fallback: str = "") -> str:
     return text if text else fallback
 
 
-def _extract_analysis_fields(parsed: dict) -> dict:
-    calories_keys = {
-        "calories",
-        "calorie",
-        "kcal",
-        "energy",
-        "kilocalories",
-        "totalcalories",
-        "energia",
-    }
-    proteins_keys = {
-        "proteins",
-        "protein",
-        "proteing",
-        "proteinsg",
-        "proteine",
-        "proteinigrams",
-    }
-    carbs_keys = {
-        "carbs",
-        "carbohydrates",
-        "carbohydrate",
-        "carbohydratesg",
-        "carbsg",
-        "carboidrati",
-        "carboidrato",
-    }
-    fats_keys = {
-        "fats",
-        "fat",
-        "fatsg",
-        "fatg",
-        "grassi",
-        "grasso",
-        "lipids",
-        "lipid",
-    }
-    food_name_keys = {"foodname", "dishname", "name", "mealname", "piatto", "cibo"}
-    notes_keys = {"notes", "description", "details", "osservazioni", "descrizione"}
-    confidence_keys = {"confidence", "score", "certainty", "accuracylevel", "reliability"}
-    meal_type_keys = {"mealtype", "tipopasto", "mealcategory", "category", "categoria"}
+CALORIES_KEYS = {
+    "calories",
+    "calorie",
+    "kcal",
+    "energy",
+    "kilocalories",
+    "totalcalories",
+    "energia",
+}
+PROTEINS_KEYS = {
+    "proteins",
+    "protein",
+    "proteing",
+    "proteinsg",
+    "proteine",
+    "proteinigrams",
+}
+CARBS_KEYS = {
+    "carbs",
+    "carbohydrates",
+    "carbohydrate",
+    "carbohydratesg",
+    "carbsg",
+    "carboidrati",
+    "carboidrato",
+}
+FATS_KEYS = {
+    "fats",
+    "fat",
+    "fatsg",
+    "fatg",
+    "grassi",
+    "grasso",
+    "lipids",
+    "lipid",
+}
+FOOD_NAME_KEYS = {"foodname", "dishname", "name", "mealname", "piatto", "cibo"}
+NOTES_KEYS = {"notes", "description", "details", "osservazioni", "descrizione"}
+CONFIDENCE_KEYS = {"confidence", "score", "certainty", "accuracylevel", "reliability"}
+MEAL_TYPE_KEYS = {"mealtype", "tipopasto", "mealcategory", "category", "categoria"}
+
 
-    food_name = _safe_text(_find_value_by_keys(parsed, food_name_keys), fallback="Pasto rilevato")
-    notes = _safe_text(_find_value_by_keys(parsed, notes_keys), fallback="")
-    meal_type = _normalize_meal_type(_find_value_by_keys(parsed, meal_type_keys))
+def _extract_analysis_fields(parsed: dict) -> dict:
+    food_name = _safe_text(_find_value_by_keys(parsed, FOOD_NAME_KEYS), fallback="Pasto rilevato")
+    notes = _safe_text(_find_value_by_keys(parsed, NOTES_KEYS), fallback="")
+    meal_type = _normalize_meal_type(_find_value_by_keys(parsed, MEAL_TYPE_KEYS))
 
     return {
         "meal_type": meal_type,
         "food_name": food_name,
-        "calories": _safe_float(_find_value_by_keys(parsed, calories_keys)),
-        "proteins": _safe_float(_find_value_by_keys(parsed, proteins_keys)),
-        "carbs": _safe_float(_find_value_by_keys(parsed, carbs_keys)),
-        "fats": _safe_float(_find_value_by_keys(parsed, fats_keys)),
+        "calories": _safe_float(_find_value_by_keys(parsed, CALORIES_KEYS)),
+        "proteins": _safe_float(_find_value_by_keys(parsed, PROTEINS_KEYS)),
+        "carbs": _safe_float(_find_value_by_keys(parsed, CARBS_KEYS)),
+        "fats": _safe_float(_find_value_by_keys(parsed, FATS_KEYS)),
         "notes": notes,
-        "confidence": min(max(_safe_float(_find_value_by_keys(parsed, confidence_keys)), 0.0), 1.0),
+        "confidence": min(max(_safe_float(_find_value_by_keys(parsed, CONFIDENCE_KEYS)), 0.0), 1.0),
     }
 
 
-async def _generate(payload: dict, base_url: str | None = None, timeout: int | None = None) -> str:
-    target_base_url = (base_url or settings.ollama_base_url).rstrip("/")
-    target_timeout = timeout or settings.ollama_timeout
+def _is_client_error(status_code: int) -> bool:
+    # 408 e 429 indicano un backend lento o saturo: contano come guasti.
+    return 400 <= status_code < 500 and status_code not in (408, 429)
+
+
+def _client_error_message(response) -> str:
     try:
-        async with httpx.AsyncClient(timeout=target_timeout) as client:
-            response = await client.post(f"{target_base_url}/api/generate", json=payload)
-            response.raise_for_status()
-            raw = response.json()
-    except httpx.HTTPError as exc:
+        detail = response.json().get("error")
+    except (ValueError, AttributeError):
+        detail = None
+    return f"Richiesta rifiutata da Ollama ({response.status_code}): {detail or response.reason_phrase}"
+
+
+async def _post(
+    path: str,
+    payload: dict,
+    base_url: str | None = None,
+    timeout: int | None = None,
+    affinity: str | None = None,
+) -> tuple[dict, AICall]:
+    # httpx (con certifi) costa ~90ms di import: lo carichiamo alla prima chiamata, non all'avvio del worker.
+    import httpx
+
+    requested_at = time.monotonic()
+    target_timeout = timeout or settings.ollama_timeout
+    model = payload.get("model")
+    endpoint = path.rsplit("/", 1)[-1]
+    pool = pool_for(base_url)
+    candidates = pool.candidates(model, affinity)
+    request_timeout = httpx.Timeout(target_timeout, connect=settings.ollama_connect_timeout)
+    raw = None
+    last_error = None
+    started = requested_at
+    backend = None
+
+    def record_failure(message: str) -> None:
+        # Anche le chiamate fallite finiscono nelle metriche dell'interazione, con la durata spesa.
+        failed_at = time.monotonic()
+        record_ai_call(
+            AICall(
+                model=model,
+                endpoint=path,
+                backend=backend.base_url if backend else "",
+                failover_ms=round((started - requested_at) * 1000, 3),
+                http_ms=round((failed_at - started) * 1000, 3) if backend else 0.0,
+                error=message[:255],
+            )
+        )
+
+    for backend in candidates[: max(settings.ollama_max_attempts, 1)]:
+        breaker = backend.breaker(model)
+        permit = breaker.try_acquire()
+        if permit is None:
+            continue
+        started = time.monotonic()
+        try:
+            with pool.track(backend), span("ollama", model=model, endpoint=endpoint, backend=backend.base_url):
+                async with httpx.AsyncClient(timeout=request_timeout) as client:
+                    response = await client.post(f"{backend.base_url}{path}", json=payload)
+                    response.raise_for_status()
+                    raw = response.json()
+        except BaseException as exc:
+            # Ogni uscita chiude il permesso: uno slot di sonda perso lascerebbe il breaker half-open per sempre.
+            if not isinstance(exc, (httpx.HTTPError, ValueError)):
+                # Cancellazione o errore nostro (non del backend): nessun esito, lo slot si libera.
+                breaker.release(permit)
+                raise
+            failed_after = time.monotonic() - started
+            if isinstance(exc, httpx.HTTPStatusError) and _is_client_error(exc.response.status_code):
+                # Richiesta rifiutata (es. 404 modello non installato): il backend funziona,
+                # niente circuit breaker ne' failover.
+                breaker.release(permit)
+                ollama_latency.observe(failed_after, model=model, endpoint=endpoint, outcome="client_error")
+                message = _client_error_message(exc.response)
+                record_failure(message)
+                raise OllamaServiceError(message) from exc
+            pool.record_failure(backend, model, failed_after, permit)
+            ollama_latency.observe(failed_after, model=model, endpoint=endpoint, outcome="error")
+            last_error = exc
+            continue
+        finished = time.monotonic()
+        pool.record_success(backend, model, finished - started, permit)
+        ollama_latency.observe(finished - started, model=model, endpoint=endpoint, outcome="success")
+        break
+
+    if raw is None and last_error is None:
+        ollama_latency.observe(0, model=model, endpoint=endpoint, outcome="rejected")
+        backend = None
+        started = time.monotonic()
+        message = "Nessun backend Ollama disponibile al momento. Riprova tra poco."
+        record_failure(message)
+        raise OllamaServiceError(message)
+    if raw is None:
+        record_failure(f"{type(last_error).__name__}: {last_error}")
         raise OllamaServiceError(
             "Ollama non raggiungibile. Verifica che il servizio sia in esecuzione in locale."
-        ) from exc
-
+        ) from last_error
+
+    # failover: tempo speso prima dell'ultimo tentativo (backend falliti o saltati). Il pool non accoda:
+    # non c'e' un'attesa in coda da misurare.
+    call = call_from_response(
+        raw,
+        model=model,
+        endpoint=path,
+        backend=backend.base_url,
+        failover_ms=(started - requested_at) * 1000,
+        http_ms=(finished - started) * 1000,
+    )
+    record_ai_call(call)
+    return raw, call
+
+
+async def _generate(
+    payload: dict,
+    base_url: str | None = None,
+    timeout: int | None = None,
+    cycle: int = 1,
+    fallback: bool = False,
+) -> GenerateResult:
+    with span("generate", model=payload.get("model"), cycle=cycle, fallback=fallback) as attrs:
+        raw, call = await _post("/api/generate", payload, base_url=base_url, timeout=timeout)
+        attrs.update(prompt_tokens=call.prompt_eval_count, output_tokens=call.eval_count)
     output = raw.get("response", "")
     if not output:
         raise OllamaServiceError("Ollama ha restituito una risposta vuota")
-    return output.strip()
+    return GenerateResult(text=output.strip(), call=call)
+
+
+async def _chat(
+    payload: dict,
+    base_url: str | None = None,
+    timeout: int | None = None,
+    affinity: str | None = None,
+    cycle: int = 1,
+) -> GenerateResult:
+    with span("chat", model=payload.get("model"), cycle=cycle) as attrs:
+        raw, call = await _post("/api/chat", payload, base_url=base_url, timeout=timeout, affinity=affinity)
+        attrs.update(prompt_tokens=call.prompt_eval_count, output_tokens=call.eval_count)
+    output = (raw.get("message") or {}).get("content", "")
+    if not output:
+        raise OllamaServiceError("Ollama ha restituito una risposta vuota")
+    return GenerateResult(text=output.strip(), call=call)
 
 
 async def _generate_text(
@@ -306,15 +442,25 @@ async def _generate_text(
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    response = await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)
+    response = (await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)).text
+    return await _refine_text(response, request_payload, preferences, cycle_count, ollama_base_url, timeout_seconds)
+
 
+async def _refine_text(
+    response: str,
+    request_payload: dict,
+    preferences: dict | None,
+    cycle_count: int,
+    ollama_base_url: str,
+    timeout_seconds: int,
+) -> str:
     if cycle_count <= 1:
         return response
 
     system_prompt = _resolve_preference_str(preferences, "system_prompt", "")
     language = _resolve_language_label(preferences)
 
-    for _ in range(1, cycle_count):
+    for cycle in range(2, cycle_count + 1):
         refine_prompt = (
             f"Rivedi e migliora la risposta seguente mantenendo chiarezza e coerenza. "
             f"Rispondi solo con la versione finale in {language}.\n\nRISPOSTA:\n{response}"
@@ -322,7 +468,9 @@ async def _generate_text(
         if system_prompt:
             refine_prompt = f"{system_prompt}\n\n{refine_prompt}"
         request_payload["prompt"] = refine_prompt
-        response = await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)
+        response = (
+            await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds, cycle=cycle)
+        ).text
 
     return response
 
@@ -357,11 +505,13 @@ async def _estimate_macros_from_text(
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(
+    generated = await _generate(
         request_payload,
         base_url=ollama_base_url,
         timeout=timeout_seconds,
+        fallback=True,
     )
+    raw_response = generated.text
     parsed = _extract_json_block(raw_response)
     extracted = _extract_analysis_fields(parsed)
     return {
@@ -413,11 +563,12 @@ async def analyze_food_image(
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(
+    generated = await _generate(
         request_payload,
         base_url=ollama_base_url,
         timeout=timeout_seconds,
     )
+    raw_response = generated.text
 
     parsed = _extract_json_block(raw_response)
     extracted = _extract_analysis_fields(parsed)
@@ -520,11 +671,12 @@ async def estimate_manual_meal_from_items(
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(
+    generated = await _generate(
         request_payload,
         base_url=ollama_base_url,
         timeout=timeout_seconds,
     )
+    raw_response = generated.text
 
     extracted = None
     try:
@@ -582,37 +734,24 @@ async def estimate_manual_meal_from_items(
     }
 
 
-async def generate_daily_advice(payload: dict, preferences: dict | None = None) -> str:
-    profile = payload.get("user_profile", {}) if isinstance(payload, dict) else {}
-    goals = profile.get("goals") or (preferences or {}).get("goals")
-    dietary_preferences = profile.get("dietary_preferences") or (preferences or {}).get("dietary_preferences")
-    allergies = profile.get("allergies") or (preferences or {}).get("allergies")
-
-    context_bits = []
-    if goals:
-        context_bits.append(f"Obiettivi utente: {goals}")
-    if dietary_preferences:
-        context_bits.append(f"Preferenze alimentari: {dietary_preferences}")
-    if allergies:
-        context_bits.append(f"Allergie/intolleranze: {allergies}")
-
-    personal_context = " | ".join(context_bits) if context_bits else "Nessun contesto aggiuntivo"
-
-    prompt = (
-        "Sei un nutrizionista virtuale. Crea un breve resoconto della giornata "
-        "con 3 consigli pratici e realistici. Personalizza i consigli in base a obiettivi e "
-        "preferenze dell'utente quando disponibili. Rispondi in testo semplice, massimo 7 righe. "
-        f"Contesto utente: {personal_context}. "
-        f"Dati giornata: {json.dumps(payload, ensure_ascii=False)}"
+async def generate_day_insights(
+    payload: dict,
+    preferences: dict | None = None,
+    include_advice: bool = True,
+) -> dict:
+    fields = (
+        "needs (oggetto con calories, proteins, carbs, fats come numeri e note come string: "
+        "fabbisogno giornaliero stimato dal profilo), "
+        "guidance (string: 1-2 frasi su come bilanciare i macro per il resto della giornata)"
     )
-    return await _generate_text(prompt, preferences)
-
-
-async def generate_daily_needs(payload: dict, preferences: dict | None = None) -> dict | None:
+    if include_advice:
+        fields += (
+            ", advice (string: breve resoconto della giornata con 3 consigli pratici e realistici, "
+            "personalizzati su obiettivi e preferenze, massimo 7 righe)"
+        )
     prompt = (
-        "Calcola il fabbisogno giornaliero di una persona in base ai dati forniti. "
-        "Rispondi SOLO in JSON con: calories (number), proteins (number), carbs (number), fats (number), "
-        "note (string). Usa numeri puri senza unita. "
+        "Sei un nutrizionista virtuale. Analizza la giornata dell'utente e rispondi SOLO in JSON con: "
+        f"{fields}. Usa numeri puri senza unita. "
         f"Dati: {json.dumps(payload, ensure_ascii=False)}"
     )
 
@@ -630,28 +769,42 @@ async def generate_daily_needs(payload: dict, preferences: dict | None = None) -
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)
+    raw_response = (await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)).text
     parsed = _extract_json_block(raw_response)
 
+    needs_block = _find_value_by_keys(parsed, {"needs", "fabbisogno", "dailyneeds"})
+    if not isinstance(needs_block, dict):
+        needs_block = parsed
+
+    advice = ""
+    if include_advice:
+        advice = _safe_text(_find_value_by_keys(parsed, {"advice", "resoconto", "dailyadvice"}))
+        cycle_count = max(1, min(_resolve_preference_int(preferences, "reasoning_cycles", 1), MAX_REASONING_CYCLES))
+        if advice and cycle_count > 1:
+            # I cicli di ragionamento affinano solo il resoconto della giornata chiusa, in testo libero:
+            # needs e guidance restano quelli della risposta JSON.
+            refine_payload = {key: value for key, value in request_payload.items() if key != "format"}
+            advice = await _refine_text(
+                advice, refine_payload, preferences, cycle_count, ollama_base_url, timeout_seconds
+            )
+
     return {
         "needs": {
-            "calories": _safe_float(parsed.get("calories")),
-            "proteins": _safe_float(parsed.get("proteins")),
-            "carbs": _safe_float(parsed.get("carbs")),
-            "fats": _safe_float(parsed.get("fats")),
+            "calories": _safe_float(_find_value_by_keys(needs_block, CALORIES_KEYS)),
+            "proteins": _safe_float(_find_value_by_keys(needs_block, PROTEINS_KEYS)),
+            "carbs": _safe_float(_find_value_by_keys(needs_block, CARBS_KEYS)),
+            "fats": _safe_float(_find_value_by_keys(needs_block, FATS_KEYS)),
         },
-        "note": _safe_text(parsed.get("note"), fallback="Stima calcolata automaticamente dall'AI."),
+        "note": _safe_text(
+            _find_value_by_keys(needs_block, {"note", *NOTES_KEYS}),
+            fallback="Stima calcolata automaticamente dall'AI.",
+        ),
+        "guidance": _safe_text(_find_value_by_keys(parsed, {"guidance", "consiglio", "timelineguidance"})),
+        "advice": advice,
+        "raw": raw_response,
     }
 
 
-async def generate_timeline_guidance(payload: dict, preferences: dict | None = None) -> str:
-    prompt = (
-        "Genera un breve consiglio (1-2 frasi) su come bilanciare i macro per il resto della giornata. "
-        f"Dati: {json.dumps(payload, ensure_ascii=False)}"
-    )
-    return await _generate_text(prompt, preferences)
-
-
 async def generate_smart_routine(payload: dict, preferences: dict | None = None) -> dict | None:
     prompt = (
         "Ottimizza una routine alimentare giornaliera. Rispondi SOLO in JSON con eventuali campi: "
@@ -675,7 +828,7 @@ async def generate_smart_routine(payload: dict, preferences: dict | None = None)
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)
+    raw_response = (await _generate(request_payload, base_url=ollama_base_url, timeout=timeout_seconds)).text
     parsed = _extract_json_block(raw_response)
 
     return {
@@ -721,11 +874,12 @@ async def analyze_body_photo(
     if temperature is not None:
         request_payload["options"] = {"temperature": temperature}
 
-    raw_response = await _generate(
+    generated = await _generate(
         request_payload,
         base_url=ollama_base_url,
         timeout=timeout_seconds,
     )
+    raw_response = generated.text
     parsed = _extract_json_block(raw_response)
 
     return {
@@ -748,10 +902,98 @@ async def compare_body_photos(payload: dict, preferences: dict | None = None) ->
     return await _generate_text(prompt, preferences)
 
 
-async def generate_chat_response(payload: dict, preferences: dict | None = None) -> str:
+async def compare_body_photo_series(payload: dict, preferences: dict | None = None) -> str:
     prompt = (
-        "Sei DietlyBot, assistente nutrizionale. Rispondi in modo professionale, empatico e pratico. "
-        "Usa frasi chiare e consigli realistici. "
-        f"Dati utente: {json.dumps(payload, ensure_ascii=False)}"
+        "Analizza una serie di foto corpo in ordine cronologico e descrivi l'andamento complessivo: "
+        "progressi, peggioramenti e punti su cui concentrarsi. "
+        "Rispondi in un paragrafo conciso. "
+        f"Dati serie: {json.dumps(payload, ensure_ascii=False)}"
     )
     return await _generate_text(prompt, preferences)
+
+
+def _chat_messages(payload: dict, preferences: dict | None) -> list[dict]:
+    # Ordine pensato per la cache del prefisso di Ollama: prima cio' che cambia di rado (persona, profilo,
+    # obiettivi, riassunto), poi lo storico che cresce solo in coda. I dati del giorno cambiano a ogni pasto
+    # e vanno dopo lo storico, subito prima del nuovo messaggio: non invalidano il prefisso gia' in cache.
+    persona = (
+        "Sei DietlyBot, assistente nutrizionale. Rispondi in modo professionale, empatico e pratico. "
+        "Usa frasi chiare e consigli realistici.\n"
+        f"Profilo utente: {json.dumps(payload.get('user_profile'), ensure_ascii=False, sort_keys=True)}\n"
+        f"Obiettivi giornalieri: {json.dumps(payload.get('targets'), ensure_ascii=False, sort_keys=True)}"
+    )
+    day_data = {"totals": payload.get("totals"), "daily_summary": payload.get("daily_summary")}
+    messages = [{"role": "system", "content": _prefix_prompt(persona, preferences)}]
+    if payload.get("conversation_summary"):
+        summary = payload["conversation_summary"]
+        messages.append({"role": "system", "content": f"Riassunto della conversazione precedente: {summary}"})
+    messages.extend(
+        {"role": item["role"], "content": item["content"]}
+        for item in payload.get("history") or []
+    )
+    messages.append(
+        {"role": "system", "content": f"Dati di oggi: {json.dumps(day_data, ensure_ascii=False, sort_keys=True)}"}
+    )
+    messages.append({"role": "user", "content": payload.get("message", "")})
+    return messages
+
+
+async def generate_chat_response(
+    payload: dict,
+    preferences: dict | None = None,
+    affinity: str | None = None,
+) -> str:
+    text_model = _resolve_preference_str(preferences, "text_model", settings.ollama_text_model)
+    ollama_base_url = _resolve_preference_str(preferences, "ollama_base_url", settings.ollama_base_url)
+    timeout_seconds = _resolve_preference_int(preferences, "timeout_seconds", settings.ollama_timeout)
+    temperature = _resolve_preference_float(preferences, "temperature", default=None)
+    cycle_count = max(1, min(_resolve_preference_int(preferences, "reasoning_cycles", 1), MAX_REASONING_CYCLES))
+
+    messages = _chat_messages(payload, preferences)
+    request_payload = {
+        "model": text_model,
+        "messages": messages,
+        "stream": False,
+        "keep_alive": settings.ollama_keep_alive,
+    }
+    if temperature is not None:
+        request_payload["options"] = {"temperature": temperature}
+
+    response = (
+        await _chat(request_payload, base_url=ollama_base_url, timeout=timeout_seconds, affinity=affinity)
+    ).text
+
+    language = _resolve_language_label(preferences)
+    for cycle in range(2, cycle_count + 1):
+        # La revisione accoda due messaggi: il prefisso gia' valutato viene riusato.
+        request_payload["messages"] = messages + [
+            {"role": "assistant", "content": response},
+            {
+                "role": "user",
+                "content": (
+                    "Rivedi e migliora la risposta precedente mantenendo chiarezza e coerenza. "
+                    f"Rispondi solo con la versione finale in {language}."
+                ),
+            },
+        ]
+        response = (
+            await _chat(
+                request_payload,
+                base_url=ollama_base_url,
+                timeout=timeout_seconds,
+                affinity=affinity,
+                cycle=cycle,
+            )
+        ).text
+
+    return response
+
+
+async def summarize_chat_history(payload: dict, preferences: dict | None = None) -> str:
+    prompt = (
+        "Aggiorna il riassunto di una conversazione tra un utente e DietlyBot. "
+        "Integra il riassunto precedente con i nuovi messaggi mantenendo fatti, obiettivi, "
+        "preferenze e consigli gia' dati. Rispondi solo con il riassunto, massimo 120 parole. "
+        f"Dati: {json.dumps(payload, ensure_ascii=False)}"
+    )
+    return await _generate_text(prompt, preferences, cycles=1)
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from .circuit_breaker import CircuitBreaker, Permit
+from .config import settings
+
+
+if TYPE_CHECKING:
+    import httpx
+
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT_SECONDS = 5
+# Pool per URL personalizzati degli utenti: al massimo questi, e scartati se inutilizzati cosi' a lungo.
+CUSTOM_POOL_MAX = 32
+CUSTOM_POOL_IDLE_SECONDS = 3600
+
+
+@dataclass
+class OllamaBackend:
+    base_url: str
+    weight: float = 1.0
+    healthy: bool = True
+    in_flight: int = 0
+    installed_models: set[str] = field(default_factory=set)
+    loaded_models: set[str] = field(default_factory=set)
+    breakers: dict[str, CircuitBreaker] = field(default_factory=dict)
+
+    def breaker(self, model: str | None) -> CircuitBreaker:
+        key = model or ""
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(
+                window=settings.ollama_breaker_window,
+                min_calls=settings.ollama_breaker_min_calls,
+                failure_rate=settings.ollama_breaker_failure_rate,
+                slow_call_seconds=settings.ollama_breaker_slow_call_seconds or None,
+                open_seconds=settings.ollama_breaker_open_seconds,
+                half_open_calls=settings.ollama_breaker_half_open_calls,
+            )
+        return self.breakers[key]
+
+    def is_available(self, model: str | None) -> bool:
+        return self.healthy and self.breaker(model).can_attempt()
+
+    def serves(self, model: str | None) -> bool:
+        # Finche' il primo probe non ha letto /api/tags non escludiamo nessun modello.
+        return not model or not self.installed_models or model in self.installed_models
+
+    def load_score(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+
+class OllamaBackendPool:
+    def __init__(self, backends: list[OllamaBackend]):
+        self.backends = backends
+        self.last_used = time.monotonic()
+
+    def busy(self) -> bool:
+        return any(backend.in_flight for backend in self.backends)
+
+    def candidates(self, model: str | None, affinity: str | None = None) -> list[OllamaBackend]:
+        available = [backend for backend in self.backends if backend.is_available(model)]
+        serving = [backend for backend in available if backend.serves(model)] or available
+        ordered = sorted(
+            serving,
+            key=lambda backend: (model not in backend.loaded_models, backend.load_score(), random.random()),
+        )
+        if affinity and len(ordered) > 1:
+            # Stessa conversazione -> stesso backend (rendezvous hashing), cosi' la cache del prefisso
+            # del prompt resta sul nodo che l'ha calcolata.
+            preferred = max(
+                ordered,
+                key=lambda backend: hashlib.sha1(f"{affinity}|{backend.base_url}".encode()).hexdigest(),
+            )
+            ordered.remove(preferred)
+            ordered.insert(0, preferred)
+        return ordered
+
+    @contextmanager
+    def track(self, backend: OllamaBackend):
+        backend.in_flight += 1
+        try:
+            yield backend
+        finally:
+            backend.in_flight -= 1
+
+    def record_success(
+        self, backend: OllamaBackend, model: str | None, duration: float, permit: Permit | None = None
+    ) -> None:
+        backend.breaker(model).record(True, duration, permit)
+        if model:
+            backend.loaded_models.add(model)
+
+    def record_failure(
+        self, backend: OllamaBackend, model: str | None, duration: float, permit: Permit | None = None
+    ) -> None:
+        breaker = backend.breaker(model)
+        breaker.record(False, duration, permit)
+        if not breaker.can_attempt():
+            logger.warning(
+                "Circuit breaker aperto per %s (%s) per %ss",
+                backend.base_url,
+                model,
+                settings.ollama_breaker_open_seconds,
+            )
+
+    async def probe(self, client: "httpx.AsyncClient", backend: OllamaBackend) -> None:
+        import httpx
+
+        try:
+            response = await client.get(f"{backend.base_url}/api/tags")
+            response.raise_for_status()
+            backend.installed_models = model_names(response.json())
+            backend.healthy = True
+        except (httpx.HTTPError, ValueError):
+            backend.healthy = False
+            return
+
+        try:
+            response = await client.get(f"{backend.base_url}/api/ps")
+            response.raise_for_status()
+            backend.loaded_models = model_names(response.json())
+        except (httpx.HTTPError, ValueError):
+            # /api/ps non e' disponibile nelle versioni piu vecchie di Ollama.
+            pass
+
+    async def probe_all(self) -> None:
+        import httpx
+
+        timeout = httpx.Timeout(PROBE_TIMEOUT_SECONDS, connect=settings.ollama_connect_timeout)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            await asyncio.gather(*(self.probe(client, backend) for backend in self.backends))
+
+
+def model_names(payload: dict) -> set[str]:
+    names = set()
+    for entry in payload.get("models", []):
+        if isinstance(entry, dict):
+            name = entry.get("name") or entry.get("model")
+            if name:
+                names.add(str(name))
+    return names
+
+
+def _normalize_url(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+def parse_backends(spec: str) -> list[OllamaBackend]:
+    backends = []
+    for chunk in spec.split(","):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        url, _, weight = chunk.partition("|")
+        try:
+            parsed_weight = float(weight) if weight.strip() else 1.0
+        except ValueError:
+            parsed_weight = 1.0
+        backends.append(OllamaBackend(base_url=_normalize_url(url), weight=max(parsed_weight, 0.01)))
+    return backends
+
+
+_default_pool: OllamaBackendPool | None = None
+_custom_pools: OrderedDict[str, OllamaBackendPool] = OrderedDict()
+_health_task: asyncio.Task | None = None
+
+
+def default_pool() -> OllamaBackendPool:
+    global _default_pool
+    if _default_pool is None:
+        backends = parse_backends(settings.ollama_base_urls) or parse_backends(settings.ollama_base_url)
+        _default_pool = OllamaBackendPool(backends)
+    return _default_pool
+
+
+def pool_for(base_url: str | None) -> OllamaBackendPool:
+    pool = default_pool()
+    if not base_url:
+        return pool
+
+    url = _normalize_url(base_url)
+    # Solo un host del pool usa il pool condiviso. OLLAMA_BASE_URL non basta: con OLLAMA_BASE_URLS il pool puo'
+    # contenere altri host, e chi ha fissato un host non deve essere bilanciato su macchine diverse.
+    if any(backend.base_url == url for backend in pool.backends):
+        return pool
+
+    # URL personalizzato dall'utente: pool dedicato con un solo backend, in cache LRU limitata.
+    custom = _custom_pools.pop(url, None) or OllamaBackendPool([OllamaBackend(base_url=url)])
+    custom.last_used = time.monotonic()
+    _custom_pools[url] = custom
+    _evict_custom_pools()
+    return custom
+
+
+def _evict_custom_pools() -> None:
+    now = time.monotonic()
+    # Dal meno recente, mai l'ultimo usato; chi ha chiamate in corso resta e viene rivalutato dopo.
+    for url, pool in list(_custom_pools.items())[:-1]:
+        if len(_custom_pools) <= CUSTOM_POOL_MAX and now - pool.last_used < CUSTOM_POOL_IDLE_SECONDS:
+            break
+        if not pool.busy():
+            del _custom_pools[url]
+
+
+async def _health_loop(interval: int) -> None:
+    while True:
+        _evict_custom_pools()
+        for pool in [default_pool(), *_custom_pools.values()]:
+            try:
+                await pool.probe_all()
+            except Exception:
+                logger.exception("Health check Ollama fallito")
+        await asyncio.sleep(interval)
+
+
+def start_health_checks() -> None:
+    global _health_task
+    if settings.ollama_health_interval <= 0 or _health_task is not None:
+        return
+    _health_task = asyncio.create_task(_health_loop(settings.ollama_health_interval))
+
+
+async def stop_health_checks() -> None:
+    global _health_task
+    if _health_task is None:
+        return
+    _health_task.cancel()
+    try:
+        await _health_task
+    except asyncio.CancelledError:
+        pass
+    _health_task = None
@@ -0,0 +1,325 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import secrets
+import time
+import uuid
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from .config import settings
+from .tracing import child_span, current_span, finish_span, start_span, trace_ids
+
+
+logger = logging.getLogger(__name__)
+
+# Oltre questo numero di span per richiesta si contano soltanto (es. query in un ciclo).
+MAX_SPANS = 500
+STATEMENT_PREVIEW = 200
+# Versioni di FastAPI di cui instrument_fastapi conosce le funzioni interne (firme e punti di chiamata).
+FASTAPI_INSTRUMENTED_VERSIONS = ("0.115.",)
+
+
+@dataclass
+class Span:
+    kind: str
+    start_ms: float
+    duration_ms: float
+    attrs: dict
+
+    def as_dict(self) -> dict:
+        return {"kind": self.kind, "start_ms": self.start_ms, "duration_ms": self.duration_ms, **self.attrs}
+
+
+@dataclass
+class RequestProfile:
+    id: str
+    trigger: str
+    flame: bool = False
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    dropped: int = 0
+    flame_path: str | None = None
+
+    def add(self, kind: str, started: float, finished: float, attrs: dict) -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append(
+            Span(kind, round((started - self.started) * 1000, 3), round((finished - started) * 1000, 3), attrs)
+        )
+
+    def totals(self) -> dict[str, dict]:
+        totals: dict[str, dict] = {}
+        for item in self.spans:
+            entry = totals.setdefault(item.kind, {"count": 0, "ms": 0.0})
+            entry["count"] += 1
+            entry["ms"] = round(entry["ms"] + item.duration_ms, 3)
+        return totals
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f'{kind};dur={entry["ms"]};desc="{entry["count"]}x"' for kind, entry in self.totals().items()
+        )
+
+
+_current: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+
+
+def current_profile() -> RequestProfile | None:
+    return _current.get()
+
+
+@contextmanager
+def span(kind: str, **attrs):
+    # Senza profilazione ne' tracing attivi costa due letture di ContextVar: si puo' lasciare nei percorsi caldi.
+    # Lo stesso dizionario attrs finisce nel profilo e nello span di tracing (figlio dello span corrente).
+    profile = _current.get()
+    if profile is None and current_span() is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    with child_span(kind, attrs):
+        try:
+            yield attrs
+        except BaseException as exc:
+            attrs.setdefault("error", type(exc).__name__)
+            raise
+        finally:
+            if profile is not None:
+                profile.add(kind, started, time.perf_counter(), attrs)
+
+
+def _shorten(statement: str) -> str:
+    compact = " ".join(statement.split())
+    return compact if len(compact) <= STATEMENT_PREVIEW else compact[:STATEMENT_PREVIEW] + "..."
+
+
+def instrument_engine(engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is None or (_current.get() is None and current_span() is None):
+            return
+        attrs = {"statement": _shorten(statement), "db.system": engine.dialect.name}
+        context._profile_started = time.perf_counter()
+        context._profile_attrs = attrs
+        context._trace_span = start_span("db", attrs)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        started = getattr(context, "_profile_started", None)
+        if started is None:
+            return
+        profile = _current.get()
+        if profile is not None:
+            profile.add("db", started, time.perf_counter(), context._profile_attrs)
+        if context._trace_span is not None:
+            finish_span(context._trace_span)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context) -> None:
+        trace_span = getattr(exception_context.execution_context, "_trace_span", None)
+        if trace_span is not None:
+            finish_span(trace_span, error=type(exception_context.original_exception).__name__)
+
+
+class ProfiledJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with span("json_render"):
+            return super().render(content)
+
+
+def _start_profiler(async_mode: bool):
+    if settings.profiling_profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument non installato: flame graph con cProfile")
+        else:
+            profiler = Profiler(async_mode="enabled" if async_mode else "disabled")
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _write_profiler(profile: RequestProfile, profiler) -> None:
+    os.makedirs(settings.profiling_output_dir, exist_ok=True)
+    base = os.path.join(settings.profiling_output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{profile.id}")
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        # Apribile con snakeviz, o flameprof per un flame graph SVG.
+        path = f"{base}.prof"
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = f"{base}.html"
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(profiler.output_html())
+    profile.flame_path = path
+
+
+@contextmanager
+def _flame_graph(profile: RequestProfile, async_mode: bool):
+    try:
+        profiler = _start_profiler(async_mode)
+    except Exception:
+        # Un solo profiler per thread: con due richieste "flame" concorrenti la seconda ha solo gli span.
+        logger.warning("Profiler non avviato per la richiesta %s", profile.id, exc_info=True)
+        yield
+        return
+    try:
+        yield
+    finally:
+        try:
+            _write_profiler(profile, profiler)
+        except Exception:
+            logger.warning("Impossibile salvare il flame graph della richiesta %s", profile.id, exc_info=True)
+
+
+def _call_with_flame(profile: RequestProfile, func: Callable, values: dict):
+    with _flame_graph(profile, async_mode=False):
+        return func(**values)
+
+
+def instrument_fastapi() -> bool:
+    # FastAPI non offre hook tra validazione, endpoint e serializzazione: si avvolgono le funzioni
+    # di fastapi.routing, che il route handler risolve a ogni richiesta. Sono API private: con una versione
+    # non verificata si profila senza questi span (e senza flame graph) invece di rischiare di rompere le route.
+    import fastapi
+    import fastapi.routing as routing
+
+    if getattr(routing, "_dietly_profiling", False):
+        return True
+    names = ("solve_dependencies", "serialize_response", "run_endpoint_function")
+    if not fastapi.__version__.startswith(FASTAPI_INSTRUMENTED_VERSIONS) or not all(
+        hasattr(routing, name) for name in names
+    ):
+        logger.warning(
+            "FastAPI %s non verificato per la profilazione: niente span di validazione, endpoint e serializzazione",
+            fastapi.__version__,
+        )
+        return False
+    original_solve = routing.solve_dependencies
+    original_serialize = routing.serialize_response
+    original_run = routing.run_endpoint_function
+
+    async def solve_dependencies(**kwargs):
+        # Validazione Pydantic di path, query e body piu' le dipendenze (get_db, utente corrente).
+        with span("validation"):
+            return await original_solve(**kwargs)
+
+    async def serialize_response(**kwargs):
+        # Validazione con response_model e jsonable_encoder.
+        with span("serialization"):
+            return await original_serialize(**kwargs)
+
+    async def run_endpoint_function(*, dependant, values: dict, is_coroutine: bool):
+        profile = _current.get()
+        with span("endpoint", name=getattr(dependant.call, "__name__", "")):
+            if profile is None or not profile.flame:
+                return await original_run(dependant=dependant, values=values, is_coroutine=is_coroutine)
+            if is_coroutine:
+                with _flame_graph(profile, async_mode=True):
+                    return await dependant.call(**values)
+            # Gli endpoint sincroni girano nel threadpool: il profiler va avviato in quel thread.
+            return await run_in_threadpool(_call_with_flame, profile, dependant.call, values)
+
+    routing.solve_dependencies = solve_dependencies
+    routing.serialize_response = serialize_response
+    routing.run_endpoint_function = run_endpoint_function
+    routing._dietly_profiling = True
+    return True
+
+
+def _requested_mode(headers: Headers) -> str | None:
+    mode = headers.get("x-profile", "").strip().lower()
+    if not mode:
+        return None
+    if settings.profiling_allow_header:
+        return mode
+    token = headers.get("x-admin-token")
+    if settings.admin_token and token and secrets.compare_digest(token, settings.admin_token):
+        return mode
+    return None
+
+
+def _log_profile(scope, profile: RequestProfile, status_code: int) -> None:
+    route = scope.get("route")
+    record = {
+        "event": "request_profile",
+        "profile_id": profile.id,
+        "trigger": profile.trigger,
+        "method": scope.get("method", ""),
+        "route": getattr(route, "path", None) or "unmatched",
+        "path": scope.get("path", ""),
+        "status": status_code,
+        "duration_ms": round((time.perf_counter() - profile.started) * 1000, 3),
+        "totals": profile.totals(),
+        "spans": [item.as_dict() for item in profile.spans],
+        "dropped_spans": profile.dropped,
+        "flame_graph": profile.flame_path,
+        **trace_ids(),
+    }
+    # Una riga JSON per richiesta; "extra" per i formatter strutturati.
+    logger.info(json.dumps(record, default=str, ensure_ascii=False), extra={"profile": record})
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.profiling_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        mode = _requested_mode(Headers(scope=scope))
+        if mode is not None:
+            trigger = "header"
+        elif (
+            settings.profiling_sample_rate > 0
+            and scope.get("path", "").startswith("/api/")
+            and random.random() < settings.profiling_sample_rate
+        ):
+            trigger = "sampled"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        # Flame graph solo su richiesta esplicita: il profiler rallenta troppo per il campionamento.
+        profile = RequestProfile(
+            id=uuid.uuid4().hex[:16],
+            trigger=trigger,
+            flame=mode == "flame" and bool(settings.profiling_output_dir),
+        )
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if trigger == "header":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-Profile-Id", profile.id)
+                    timing = profile.server_timing()
+                    if timing:
+                        headers.append("Server-Timing", timing)
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            _log_profile(scope, profile, status_code)
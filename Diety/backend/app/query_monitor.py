@@ -0,0 +1,135 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+
+from .config import settings
+from .metrics import db_queries_per_scope, db_repeated_queries, db_slow_queries
+
+
+logger = logging.getLogger(__name__)
+
+PARAMS_PREVIEW = 500
+EXPLAIN_PREFIX = {"sqlite": "EXPLAIN QUERY PLAN ", "mysql": "EXPLAIN ", "postgresql": "EXPLAIN "}
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    duration_ms: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    stats = QueryStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def report_queries(stats: QueryStats, scope: str) -> None:
+    db_queries_per_scope.observe(stats.count, scope=scope)
+    if settings.db_repeated_query_mode == "off":
+        return
+    repeated = stats.repeated(max(settings.db_repeated_query_threshold, 2))
+    if repeated:
+        db_repeated_queries.inc(scope=scope)
+    for statement, count in repeated:
+        logger.warning("Possibile N+1 in %s: stessa query eseguita %s volte: %s", scope, count, statement)
+
+
+def _format_params(parameters) -> str:
+    if not settings.db_slow_query_log_params:
+        return "(nascosti)"
+    text = repr(parameters)
+    return text if len(text) <= PARAMS_PREVIEW else text[:PARAMS_PREVIEW] + "..."
+
+
+def _explain(conn, statement: str, parameters) -> str | None:
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    # Cursore DBAPI sulla stessa connessione: niente eventi dell'engine (e quindi niente ricorsione),
+    # stessa transazione della query appena riuscita.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    except Exception as exc:
+        return f"EXPLAIN non disponibile: {exc!r}"
+    finally:
+        cursor.close()
+    return "\n".join(" | ".join(str(value) for value in row) for row in rows)
+
+
+def monitor_engine(engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None:
+            context._query_started = time.perf_counter()
+        stats = _stats.get()
+        if stats is None:
+            return
+        stats.count += 1
+        stats.statements[statement] += 1
+        threshold = max(settings.db_repeated_query_threshold, 2)
+        if settings.db_repeated_query_mode == "raise" and stats.statements[statement] == threshold:
+            # Modalita' sviluppo/test: l'eccezione parte dalla query che supera la soglia (es. il lazy load).
+            raise RepeatedQueryError(f"Stessa query eseguita {threshold} volte: {' '.join(statement.split())}")
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = _stats.get()
+        if stats is not None:
+            stats.duration_ms += elapsed_ms
+        if not settings.db_slow_query_ms or elapsed_ms < settings.db_slow_query_ms:
+            return
+        db_slow_queries.inc()
+        plan = None
+        if settings.db_slow_query_explain and not executemany:
+            plan = _explain(conn, statement, parameters)
+        logger.warning(
+            "Query lenta (%.0f ms): %s\nParametri: %s%s",
+            elapsed_ms,
+            " ".join(statement.split()),
+            _format_params(parameters),
+            f"\nPiano:\n{plan}" if plan else "",
+        )
+
+
+class QueryMonitorMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = scope.get("route")
+                report_queries(stats, getattr(route, "path", None) or "unmatched")
@@ -0,0 +1,170 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .config import settings
+from .database import create_rate_limit_engine
+from .metrics import rate_limited
+from .models import RateLimitBucket
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MAX_BUCKETS = 100_000
+
+# Token bucket atomico lato Redis (o server compatibile): stato in un hash che scade quando il bucket e' pieno.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+@dataclass(frozen=True)
+class Budget:
+    name: str
+    per_minute: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    @property
+    def capacity(self) -> int:
+        return max(self.burst, 1)
+
+
+def _budget(name: str) -> Budget | None:
+    per_minute = getattr(settings, f"rate_limit_{name}_per_minute")
+    if per_minute <= 0:
+        return None
+    return Budget(name, per_minute, getattr(settings, f"rate_limit_{name}_burst"))
+
+
+class MemoryBuckets:
+    def __init__(self, max_entries: int = MEMORY_MAX_BUCKETS):
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, budget: Budget) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (budget.capacity, now))
+            tokens = min(budget.capacity, tokens + (now - updated_at) * budget.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / budget.rate
+            self._buckets[key] = (tokens, now)
+            # Un bucket dimenticato riparte pieno: si scartano i meno recenti.
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class DatabaseBuckets:
+    def __init__(self):
+        self._engine = create_rate_limit_engine()
+
+    def take(self, key: str, budget: Budget) -> float:
+        table = RateLimitBucket.__table__
+        now = time.time()
+        refilled = table.c.tokens + (now - table.c.updated_at) * budget.rate
+        available = case((refilled > budget.capacity, budget.capacity), else_=refilled)
+        # Transazione propria e breve, separata dalla sessione della richiesta: non si puo' riusare la connessione
+        # della richiesta (il commit del bucket chiuderebbe la sua transazione). Il checkout avviene sul pool
+        # dedicato, restituito subito: conta in validate_pool_sizing.
+        with self._engine.begin() as connection:
+            # Refill e consumo in un solo UPDATE condizionale: atomico anche tra processi.
+            # ordered_values: su MySQL le assegnazioni sono valutate in ordine.
+            result = connection.execute(
+                update(table)
+                .where(table.c.key == key, available >= 1)
+                .ordered_values((table.c.tokens, available - 1), (table.c.updated_at, now))
+            )
+            if result.rowcount:
+                return 0.0
+            tokens = connection.execute(select(available).where(table.c.key == key)).scalar()
+        if tokens is not None:
+            return (1 - tokens) / budget.rate
+
+        try:
+            with self._engine.begin() as connection:
+                connection.execute(insert(table).values(key=key, tokens=budget.capacity - 1, updated_at=now))
+        except IntegrityError:
+            # Primo accesso in parallelo da un altro processo: il bucket ora esiste.
+            return self.take(key, budget)
+        return 0.0
+
+
+class RedisBuckets:
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._script = self._client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key: str, budget: Budget) -> float:
+        return float(self._script(keys=[f"dietly:ratelimit:{key}"], args=[budget.rate, budget.capacity, time.time()]))
+
+
+_backends: dict[str, MemoryBuckets | DatabaseBuckets | RedisBuckets] = {}
+
+
+def _backend() -> MemoryBuckets | DatabaseBuckets | RedisBuckets:
+    name = settings.rate_limit_backend
+    backend = _backends.get(name)
+    if backend is not None:
+        return backend
+    if name == "database":
+        backend = DatabaseBuckets()
+    elif name == "redis":
+        try:
+            backend = RedisBuckets(settings.rate_limit_redis_url)
+        except ImportError:
+            logger.warning("Pacchetto redis non installato: rate limit in memoria per processo")
+            backend = MemoryBuckets()
+    else:
+        backend = MemoryBuckets()
+    return _backends.setdefault(name, backend)
+
+
+def take_token(budget_name: str, subject: str) -> int:
+    # Secondi da attendere prima del prossimo token; 0 = richiesta consentita.
+    if not settings.rate_limit_enabled:
+        return 0
+    budget = _budget(budget_name)
+    if budget is None:
+        return 0
+    try:
+        wait = _backend().take(f"{budget.name}:{subject}", budget)
+    except Exception:
+        # Store condiviso non raggiungibile: meglio lasciar passare che bloccare tutti gli utenti.
+        logger.warning("Rate limit non verificabile per %s", budget.name, exc_info=True)
+        return 0
+    if wait <= 0:
+        return 0
+    rate_limited.inc(budget=budget.name)
+    return max(math.ceil(wait), 1)
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import case, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..deps import require_admin
+from ..models import AIInteraction
+from ..schemas import AIStatsGroup, AIStatsResponse
+
+
+router = APIRouter(prefix="/api/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+def _round(value: float | None) -> float | None:
+    return round(float(value), 2) if value is not None else None
+
+
+def _percentile(value, rank, count, percent: int):
+    # Nearest-rank: il valore al rango ceil(p/100 * n), senza divisioni (portabile tra MySQL, PostgreSQL e SQLite).
+    return func.min(case((rank * 100 >= count * percent, value)))
+
+
+def _model_label():
+    # Costante inline e non parametro: l'espressione nel GROUP BY resta identica a quella nel SELECT.
+    return func.coalesce(AIInteraction.model, literal_column("'default'"))
+
+
+def _percentiles(db: Session, since: datetime) -> dict:
+    model = _model_label()
+    group = (model, AIInteraction.kind)
+    latency = func.coalesce(AIInteraction.failover_ms, 0) + func.coalesce(AIInteraction.http_ms, 0)
+    failover = func.coalesce(AIInteraction.failover_ms, 0)
+    has_rate = (AIInteraction.eval_count > 0) & (AIInteraction.eval_duration_ms > 0)
+    rate = case((has_rate, AIInteraction.eval_count * 1000.0 / AIInteraction.eval_duration_ms))
+    rate_group = case((has_rate, 1), else_=0)
+
+    # Percentili solo sulle interazioni riuscite: i fallimenti hanno tempi non confrontabili (timeout, rifiuti).
+    ranked = (
+        select(
+            model.label("model"),
+            AIInteraction.kind.label("kind"),
+            latency.label("latency"),
+            failover.label("failover"),
+            rate.label("rate"),
+            func.count().over(partition_by=group).label("n"),
+            func.row_number().over(partition_by=group, order_by=latency).label("latency_rank"),
+            func.row_number().over(partition_by=group, order_by=failover).label("failover_rank"),
+            func.count(rate).over(partition_by=group).label("rate_n"),
+            func.row_number().over(partition_by=(*group, rate_group), order_by=rate).label("rate_rank"),
+        )
+        .where(
+            AIInteraction.created_at >= since,
+            AIInteraction.call_count.isnot(None),
+            AIInteraction.error.is_(None),
+        )
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            ranked.c.model,
+            ranked.c.kind,
+            _percentile(ranked.c.latency, ranked.c.latency_rank, ranked.c.n, 50).label("latency_p50"),
+            _percentile(ranked.c.latency, ranked.c.latency_rank, ranked.c.n, 95).label("latency_p95"),
+            _percentile(ranked.c.failover, ranked.c.failover_rank, ranked.c.n, 95).label("failover_p95"),
+            func.min(
+                case(
+                    (ranked.c.rate.isnot(None) & (ranked.c.rate_rank * 100 >= ranked.c.rate_n * 50), ranked.c.rate)
+                )
+            ).label("rate_p50"),
+        ).group_by(ranked.c.model, ranked.c.kind)
+    )
+    return {(row.model, row.kind): row for row in rows}
+
+
+@router.get("/ai-stats", response_model=AIStatsResponse)
+def ai_stats(
+    hours: int = Query(ge=1, le=24 * 90),
+    db: Session = Depends(get_db),
+):
+    # Tutto aggregato nel database: una riga per (modello, tipo), indipendentemente dal numero di interazioni.
+    since = datetime.utcnow() - timedelta(hours=hours)
+    model = _model_label()
+    succeeded = AIInteraction.error.is_(None)
+    has_tokens = (AIInteraction.eval_count > 0) & (AIInteraction.eval_duration_ms > 0)
+    totals = db.execute(
+        select(
+            model.label("model"),
+            AIInteraction.kind.label("kind"),
+            func.count().label("interactions"),
+            func.sum(func.coalesce(AIInteraction.call_count, 0)).label("calls"),
+            func.sum(case((succeeded, 0), else_=1)).label("errors"),
+            func.avg(case((succeeded, AIInteraction.load_duration_ms))).label("load_duration_avg"),
+            func.avg(case((succeeded, AIInteraction.prompt_eval_count))).label("prompt_tokens_avg"),
+            func.avg(case((succeeded, AIInteraction.eval_count))).label("output_tokens_avg"),
+            func.sum(case((succeeded & has_tokens, AIInteraction.eval_count))).label("rate_tokens"),
+            func.sum(case((succeeded & has_tokens, AIInteraction.eval_duration_ms))).label("rate_ms"),
+        )
+        .where(AIInteraction.created_at >= since, AIInteraction.call_count.isnot(None))
+        .group_by(model, AIInteraction.kind)
+        .order_by(model, AIInteraction.kind)
+    ).all()
+    percentiles = _percentiles(db, since)
+
+    groups = []
+    for row in totals:
+        ranked = percentiles.get((row.model, row.kind))
+        groups.append(
+            AIStatsGroup(
+                model=row.model,
+                kind=row.kind,
+                interactions=row.interactions,
+                calls=row.calls or 0,
+                errors=row.errors or 0,
+                error_rate=round(row.errors / row.interactions, 4) if row.interactions else None,
+                latency_p50_ms=_round(ranked.latency_p50) if ranked else None,
+                latency_p95_ms=_round(ranked.latency_p95) if ranked else None,
+                failover_p95_ms=_round(ranked.failover_p95) if ranked else None,
+                load_duration_avg_ms=_round(row.load_duration_avg),
+                prompt_tokens_avg=_round(row.prompt_tokens_avg),
+                output_tokens_avg=_round(row.output_tokens_avg),
+                tokens_per_second_p50=_round(ranked.rate_p50) if ranked else None,
+                tokens_per_second=_round(row.rate_tokens * 1000 / row.rate_ms) if row.rate_ms else None,
+            )
+        )
+
+    return {"since": since, "groups": groups}
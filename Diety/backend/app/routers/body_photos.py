@@ -1,20 +1,30 @@
+import asyncio
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..config import settings
-from ..database import get_db
-from ..deps import get_current_user
-from ..models import BodyPhoto, User
-from ..ollama_client import analyze_body_photo, compare_body_photos
-from ..schemas import BodyPhotoCompareResponse, BodyPhotoRead
-from ..services import ai_preferences_from_user, log_ai_interaction
+from ..database import SessionLocal, get_db
+from ..deps import get_current_user, limit_ai, limit_crud
+from ..jobs import enqueue_job
+from ..metrics import upload_bytes
+from ..models import BodyPhoto, Job, User
+from ..schemas import BodyPhotoCompareResponse, BodyPhotoRead, BodyPhotoSeriesResponse
+from ..services import compare_photos
 
 
-router = APIRouter(prefix="/api/body-photos", tags=["BodyPhotos"])
+router = APIRouter(prefix="/api/body-photos", tags=["BodyPhotos"], dependencies=[Depends(limit_crud)])
+
+PENDING_STATUSES = {"pending", "processing"}
+SSE_POLL_SECONDS = 1.0
+SSE_MAX_SECONDS = 300
+MAX_SERIES_PHOTOS = 12
 
 
 def _store_upload(file: UploadFile, user_id: int) -> str:
@@ -24,13 +34,75 @@ def _store_upload(file: UploadFile, user_id: int) -> str:
     user_dir.mkdir(parents=True, exist_ok=True)
     file_path = user_dir / filename
 
+    content = file.file.read()
     with file_path.open("wb") as buffer:
-        buffer.write(file.file.read())
+        buffer.write(content)
+    upload_bytes.inc(len(content), kind="body_photo")
 
     relative_path = file_path.relative_to(Path(settings.upload_dir)).as_posix()
     return f"/static/uploads/{relative_path}"
 
 
+def _photo_to_read(photo: BodyPhoto) -> BodyPhotoRead:
+    return BodyPhotoRead(
+        id=photo.id,
+        kind=photo.kind,
+        image_url=photo.image_path,
+        captured_at=photo.captured_at,
+        ai_summary=photo.ai_summary,
+        analysis_status=photo.analysis_status,
+    )
+
+
+def _analysis_dedup_key(photo_id: int) -> str:
+    return f"body_photo_analysis:{photo_id}"
+
+
+def _expire_unclaimed_analyses(db: Session, photos: list[BodyPhoto]) -> None:
+    # Senza un worker attivo il job non viene mai preso: oltre il timeout la foto risulta fallita invece di
+    # restare "pending" per sempre. Se un worker parte dopo, l'analisi aggiorna comunque la foto.
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.body_photo_analysis_timeout)
+    stale = {
+        _analysis_dedup_key(photo.id): photo
+        for photo in photos
+        if photo.analysis_status == "pending" and photo.captured_at < cutoff
+    }
+    if not stale:
+        return
+    attempts = dict(db.query(Job.dedup_key, Job.attempts).filter(Job.dedup_key.in_(stale)).all())
+    expired = False
+    for key, photo in stale.items():
+        if attempts.get(key, 0) == 0:
+            photo.analysis_status = "failed"
+            photo.ai_summary = "Analisi AI non avviata: nessun worker disponibile, riprova piu' tardi."
+            expired = True
+    if expired:
+        db.commit()
+
+
+def _find_user_photo(db: Session, user_id: int, photo_id: int) -> BodyPhoto | None:
+    photo = db.query(BodyPhoto).filter(BodyPhoto.id == photo_id, BodyPhoto.user_id == user_id).first()
+    if photo:
+        _expire_unclaimed_analyses(db, [photo])
+    return photo
+
+
+def _poll_photo(user_id: int, photo_id: int) -> tuple[str | None, bool]:
+    # Sessione breve per ogni controllo: lo stream non tiene occupata una connessione del pool.
+    with SessionLocal() as db:
+        photo = _find_user_photo(db, user_id, photo_id)
+        if photo is None:
+            return None, True
+        return _photo_to_read(photo).model_dump_json(), photo.analysis_status not in PENDING_STATUSES
+
+
+def _get_user_photo_or_404(db: Session, user_id: int, photo_id: int) -> BodyPhoto:
+    photo = _find_user_photo(db, user_id, photo_id)
+    if not photo:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Foto non trovata")
+    return photo
+
+
 @router.get("", response_model=list[BodyPhotoRead])
 def list_body_photos(
     kind: str | None = None,
@@ -41,20 +113,12 @@ def list_body_photos(
     if kind:
         query = query.filter(BodyPhoto.kind == kind.lower())
     photos = query.order_by(BodyPhoto.captured_at.desc()).all()
-    return [
-        BodyPhotoRead(
-            id=photo.id,
-            kind=photo.kind,
-            image_url=photo.image_path,
-            captured_at=photo.captured_at,
-            ai_summary=photo.ai_summary,
-        )
-        for photo in photos
-    ]
+    _expire_unclaimed_analyses(db, photos)
+    return [_photo_to_read(photo) for photo in photos]
 
 
-@router.post("", response_model=BodyPhotoRead)
-async def upload_body_photo(
+@router.post("", response_model=BodyPhotoRead, dependencies=[Depends(limit_ai)])
+def upload_body_photo(
     kind: str = Form(...),
     image: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -65,115 +129,164 @@ async def upload_body_photo(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Tipo foto non valido.")
 
     image_url = _store_upload(image, current_user.id)
-    ai_preferences = ai_preferences_from_user(current_user) or {}
-
-    ai_summary = None
-    ai_payload = None
-    analysis = None
-    try:
-        image.file.seek(0)
-        analysis = await analyze_body_photo(image.file.read(), kind=kind, preferences=ai_preferences)
-        ai_summary = analysis.get("summary")
-        ai_payload = analysis.get("raw")
-    except Exception:
-        ai_summary = "Analisi AI non disponibile per questa foto."
 
     photo = BodyPhoto(
         user_id=current_user.id,
         kind=kind,
         image_path=image_url,
         captured_at=datetime.utcnow(),
-        ai_summary=ai_summary,
-        ai_payload=ai_payload,
+        analysis_status="pending",
     )
     db.add(photo)
+    db.flush()
+    # Foto e job nella stessa transazione: non resta mai una foto "pending" senza job che la analizzi.
+    enqueue_job(
+        db,
+        "body_photo_analysis",
+        {"photo_id": photo.id},
+        user_id=current_user.id,
+        dedup_key=_analysis_dedup_key(photo.id),
+        commit=False,
+    )
     db.commit()
     db.refresh(photo)
 
-    if analysis:
-        log_ai_interaction(
-            db,
-            current_user.id,
-            kind="body_photo_analysis",
-            model=ai_preferences.get("vision_model"),
-            input_payload={"kind": kind},
-            output_payload=analysis,
-            meta={"photo_id": photo.id},
+    return _photo_to_read(photo)
+
+
+def _ensure_analyzed(db: Session, photos: list[BodyPhoto]) -> None:
+    _expire_unclaimed_analyses(db, photos)
+    if any(photo.analysis_status in PENDING_STATUSES for photo in photos):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Analisi AI delle foto ancora in corso, riprova tra poco.",
         )
 
-    return BodyPhotoRead(
-        id=photo.id,
-        kind=photo.kind,
-        image_url=photo.image_path,
-        captured_at=photo.captured_at,
-        ai_summary=photo.ai_summary,
-    )
 
+def _photo_pair(
+    db: Session, user_id: int, kind: str, latest_id: int | None, previous_id: int | None
+) -> list[BodyPhoto]:
+    if (latest_id is None) != (previous_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Indica sia latest_id sia previous_id, oppure nessuno dei due.",
+        )
 
-@router.get("/compare", response_model=BodyPhotoCompareResponse)
-async def compare_latest_photos(
-    kind: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    kind = kind.lower()
+    if latest_id is not None:
+        if latest_id == previous_id:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Seleziona due foto diverse.")
+        latest = _get_user_photo_or_404(db, user_id, latest_id)
+        previous = _get_user_photo_or_404(db, user_id, previous_id)
+        if latest.kind != kind or previous.kind != kind:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Le foto da confrontare devono essere entrambe del tipo richiesto.",
+            )
+        if latest.captured_at < previous.captured_at:
+            latest, previous = previous, latest
+    else:
+        photos = (
+            db.query(BodyPhoto)
+            .filter(BodyPhoto.user_id == user_id, BodyPhoto.kind == kind)
+            .order_by(BodyPhoto.captured_at.desc())
+            .limit(2)
+            .all()
+        )
+        if len(photos) < 2:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Servono almeno 2 foto per il confronto.")
+        latest, previous = photos[0], photos[1]
+
+    _ensure_analyzed(db, [latest, previous])
+    return [latest, previous]
+
+
+def _photo_series(db: Session, user_id: int, kind: str, limit: int) -> list[BodyPhoto]:
     photos = (
         db.query(BodyPhoto)
-        .filter(BodyPhoto.user_id == current_user.id, BodyPhoto.kind == kind)
+        .filter(BodyPhoto.user_id == user_id, BodyPhoto.kind == kind)
         .order_by(BodyPhoto.captured_at.desc())
-        .limit(2)
+        .limit(limit)
         .all()
     )
     if len(photos) < 2:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Servono almeno 2 foto per il confronto.")
 
-    latest, previous = photos[0], photos[1]
-    ai_preferences = ai_preferences_from_user(current_user) or {}
-
-    comparison = None
-    try:
-        comparison = await compare_body_photos(
-            {
-                "latest": {
-                    "date": latest.captured_at.isoformat(),
-                    "summary": latest.ai_summary,
-                },
-                "previous": {
-                    "date": previous.captured_at.isoformat(),
-                    "summary": previous.ai_summary,
-                },
-            },
-            preferences=ai_preferences,
-        )
-    except Exception:
-        comparison = "Confronto non disponibile al momento."
+    _ensure_analyzed(db, photos)
+    return photos
 
-    log_ai_interaction(
-        db,
-        current_user.id,
-        kind="body_photo_compare",
-        model=ai_preferences.get("text_model"),
-        input_payload={
-            "latest_id": latest.id,
-            "previous_id": previous.id,
-        },
-        output_payload={"comparison": comparison},
-    )
+
+def _photo_reads(photos: list[BodyPhoto]) -> list[BodyPhotoRead]:
+    return [_photo_to_read(photo) for photo in photos]
+
+
+@router.get("/compare", response_model=BodyPhotoCompareResponse, dependencies=[Depends(limit_ai)])
+async def compare_latest_photos(
+    kind: str,
+    latest_id: int | None = Query(default=None),
+    previous_id: int | None = Query(default=None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    # Handler async per la chiamata a Ollama: le query sulla sessione della richiesta girano nel threadpool.
+    photos = await run_in_threadpool(_photo_pair, db, current_user.id, kind.lower(), latest_id, previous_id)
+    result = await compare_photos(db, current_user, photos)
+    latest, previous = await run_in_threadpool(_photo_reads, photos)
 
     return {
-        "latest": BodyPhotoRead(
-            id=latest.id,
-            kind=latest.kind,
-            image_url=latest.image_path,
-            captured_at=latest.captured_at,
-            ai_summary=latest.ai_summary,
-        ),
-        "previous": BodyPhotoRead(
-            id=previous.id,
-            kind=previous.kind,
-            image_url=previous.image_path,
-            captured_at=previous.captured_at,
-            ai_summary=previous.ai_summary,
-        ),
-        "comparison": comparison,
+        "latest": latest,
+        "previous": previous,
+        "comparison": result["comparison"],
+        "cached": result["cached"],
     }
+
+
+@router.get("/compare/series", response_model=BodyPhotoSeriesResponse, dependencies=[Depends(limit_ai)])
+async def compare_photo_series(
+    kind: str,
+    limit: int = Query(default=4, ge=2, le=MAX_SERIES_PHOTOS),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    photos = await run_in_threadpool(_photo_series, db, current_user.id, kind.lower(), limit)
+    result = await compare_photos(db, current_user, photos)
+
+    return {
+        "photos": await run_in_threadpool(_photo_reads, list(reversed(photos))),
+        "comparison": result["comparison"],
+        "cached": result["cached"],
+    }
+
+
+@router.get("/{photo_id}", response_model=BodyPhotoRead)
+def get_body_photo(
+    photo_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    return _photo_to_read(_get_user_photo_or_404(db, current_user.id, photo_id))
+
+
+@router.get("/{photo_id}/events")
+def body_photo_events(
+    photo_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    _get_user_photo_or_404(db, current_user.id, photo_id)
+    user_id = current_user.id
+
+    async def stream():
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while True:
+            data, finished = await run_in_threadpool(_poll_photo, user_id, photo_id)
+            if data is None:
+                # La risposta e' gia' iniziata: niente HTTPException, si chiude lo stream con un evento di errore.
+                yield 'event: error\ndata: {"detail": "Foto non trovata"}\n\n'
+                return
+            if finished or time.monotonic() >= deadline:
+                yield f"event: status\ndata: {data}\n\n"
+                return
+            yield ": pending\n\n"
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
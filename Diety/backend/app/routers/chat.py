@@ -1,13 +1,21 @@
 from datetime import date, datetime, time
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..conversations import (
+    add_turn,
+    build_chat_window,
+    create_conversation,
+    get_conversation,
+    schedule_summary_if_needed,
+)
 from ..database import get_db
-from ..deps import get_current_user
-from ..models import DailySummary, Meal, User
-from ..ollama_client import generate_chat_response
-from ..schemas import ChatRequest, ChatResponse
+from ..deps import get_current_user, limit_ai, limit_crud
+from ..models import ChatConversation, DailySummary, Meal, User
+from ..ollama_client import OllamaServiceError, generate_chat_response
+from ..schemas import ChatConversationDetail, ChatConversationRead, ChatRequest, ChatResponse
 from ..services import (
     aggregate_macros,
     ai_preferences_from_user,
@@ -16,40 +24,53 @@ from ..services import (
 )
 
 
-router = APIRouter(prefix="/api/chat", tags=["Chat"])
+router = APIRouter(prefix="/api/chat", tags=["Chat"], dependencies=[Depends(limit_crud)])
 
 
-@router.post("", response_model=ChatResponse)
-async def chat_with_bot(
-    payload: ChatRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
+def _get_conversation_or_404(db: Session, user: User, conversation_id: int) -> ChatConversation:
+    conversation = get_conversation(db, user, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversazione non trovata")
+    return conversation
+
+
+def _open_conversation(db: Session, user: User, payload: ChatRequest) -> ChatConversation:
+    if payload.conversation_id is not None:
+        return _get_conversation_or_404(db, user, payload.conversation_id)
+    title = " ".join(payload.message.split())
+    return create_conversation(
+        db,
+        user,
+        title=title if len(title) <= 48 else f"{title[:48]}...",
+        history=[item.model_dump() for item in payload.history],
+    )
+
+
+def _chat_context(db: Session, user: User, conversation: ChatConversation, message: str) -> tuple[dict, dict]:
+    window = build_chat_window(db, conversation, message)
+
     today = date.today()
     start = datetime.combine(today, time.min)
     end = datetime.combine(today, time.max)
 
     meals = (
         db.query(Meal)
-        .filter(Meal.user_id == current_user.id, Meal.consumed_at >= start, Meal.consumed_at <= end)
+        .filter(Meal.user_id == user.id, Meal.consumed_at >= start, Meal.consumed_at <= end)
         .order_by(Meal.consumed_at.asc())
         .all()
     )
     totals = aggregate_macros(meals)
-    routine = current_user.routine
+    routine = user.routine
     targets = targets_from_routine(routine)
 
-    summary = (
-        db.query(DailySummary)
-        .filter(DailySummary.user_id == current_user.id, DailySummary.day == today)
-        .first()
-    )
+    summary = db.query(DailySummary).filter(DailySummary.user_id == user.id, DailySummary.day == today).first()
 
-    preferences = ai_preferences_from_user(current_user) or {}
+    preferences = ai_preferences_from_user(user) or {}
 
     context = {
-        "message": payload.message,
-        "history": [item.model_dump() for item in payload.history[-8:]],
+        "message": message,
+        "conversation_summary": window["summary"],
+        "history": window["history"],
         "totals": totals,
         "targets": targets,
         "daily_summary": summary.advice if summary else None,
@@ -65,16 +86,134 @@ async def chat_with_bot(
             "allergies": preferences.get("allergies"),
         },
     }
+    return context, preferences
+
+
+def _record_failure(
+    db: Session,
+    user: User,
+    conversation: ChatConversation,
+    context: dict,
+    preferences: dict,
+    exc: Exception,
+    new_conversation: bool,
+) -> None:
+    log_ai_interaction(
+        db,
+        user.id,
+        kind="dietly_chat",
+        model=preferences.get("text_model"),
+        input_payload=context,
+        output_payload=None,
+        meta={"conversation_id": conversation.id},
+        error=exc,
+    )
+    if new_conversation:
+        # Conversazione appena creata per questo messaggio: senza risposta resterebbe vuota in elenco.
+        db.delete(conversation)
+        db.commit()
 
-    reply = await generate_chat_response(context, preferences=preferences)
+
+def _store_reply(
+    db: Session,
+    user: User,
+    conversation: ChatConversation,
+    context: dict,
+    preferences: dict,
+    message: str,
+    reply: str,
+) -> None:
+    add_turn(db, conversation, "user", message)
+    add_turn(db, conversation, "assistant", reply)
+    schedule_summary_if_needed(db, conversation)
 
     log_ai_interaction(
         db,
-        current_user.id,
+        user.id,
         kind="dietly_chat",
         model=preferences.get("text_model"),
         input_payload=context,
         output_payload={"reply": reply},
+        meta={"conversation_id": conversation.id},
+    )
+
+
+@router.post("", response_model=ChatResponse, dependencies=[Depends(limit_ai)])
+async def chat_with_bot(
+    payload: ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    # Il lavoro sul DB gira nel threadpool, un passo alla volta sulla sessione della richiesta: un checkout
+    # in attesa sul pool esaurito blocca solo questa richiesta, non l'event loop con le chiamate AI in corso.
+    conversation = await run_in_threadpool(_open_conversation, db, current_user, payload)
+    # Letto una volta sola: dopo i commit l'istanza scade e ogni accesso rifarebbe una SELECT qui.
+    conversation_id = conversation.id
+    context, preferences = await run_in_threadpool(_chat_context, db, current_user, conversation, payload.message)
+
+    try:
+        reply = await generate_chat_response(
+            context,
+            preferences=preferences,
+            affinity=f"chat:{conversation_id}",
+        )
+    except Exception as exc:
+        await run_in_threadpool(
+            _record_failure,
+            db,
+            current_user,
+            conversation,
+            context,
+            preferences,
+            exc,
+            payload.conversation_id is None,
+        )
+        if isinstance(exc, OllamaServiceError):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc)) from exc
+        raise
+
+    await run_in_threadpool(
+        _store_reply, db, current_user, conversation, context, preferences, payload.message, reply
     )
+    return {"reply": reply, "conversation_id": conversation_id}
+
 
-    return {"reply": reply}
+@router.get("/conversations", response_model=list[ChatConversationRead])
+def list_conversations(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    return (
+        db.query(ChatConversation)
+        .filter(ChatConversation.user_id == current_user.id)
+        .order_by(ChatConversation.updated_at.desc())
+        .limit(50)
+        .all()
+    )
+
+
+@router.get("/conversations/{conversation_id}", response_model=ChatConversationDetail)
+def get_conversation_detail(
+    conversation_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    conversation = _get_conversation_or_404(db, current_user, conversation_id)
+    return {
+        "id": conversation.id,
+        "title": conversation.title,
+        "created_at": conversation.created_at,
+        "updated_at": conversation.updated_at,
+        "messages": [{"role": turn.role, "content": turn.content} for turn in conversation.turns],
+    }
+
+
+@router.delete("/conversations/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_conversation(
+    conversation_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    conversation = _get_conversation_or_404(db, current_user, conversation_id)
+    db.delete(conversation)
+    db.commit()
@@ -0,0 +1,51 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..database import get_db
+from ..deps import get_current_user, limit_crud
+from ..models import User
+from ..rate_limit import take_token
+from ..schemas import DashboardResponse
+from ..services import DASHBOARD_SECTIONS, build_dashboard, load_day_context, sections_needing_ai
+
+
+router = APIRouter(prefix="/api/dashboard", tags=["Dashboard"], dependencies=[Depends(limit_crud)])
+
+
+@router.get("", response_model=DashboardResponse)
+async def get_dashboard(
+    day: Optional[date] = Query(default=None),
+    sections: Optional[str] = Query(default=None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    target_day = day or date.today()
+    requested = set(DASHBOARD_SECTIONS)
+    if sections:
+        requested = {name.strip() for name in sections.split(",") if name.strip()}
+        unknown = requested - set(DASHBOARD_SECTIONS)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Sezioni non valide: {', '.join(sorted(unknown))}",
+            )
+
+    context = await run_in_threadpool(load_day_context, db, current_user, target_day)
+    rate_limited = set()
+    pending = await run_in_threadpool(sections_needing_ai, db, current_user, context, requested)
+    # Un token "ai" per richiesta, solo se qualche sezione chiamerebbe Ollama. Oltre il budget niente 429: le
+    # sezioni AI hanno gia' una versione locale e la dashboard resta utilizzabile.
+    if pending and await run_in_threadpool(take_token, "ai", str(current_user.id)):
+        rate_limited = pending
+    return await build_dashboard(
+        db=db,
+        user=current_user,
+        day=target_day,
+        sections=requested,
+        context=context,
+        rate_limited=rate_limited,
+    )
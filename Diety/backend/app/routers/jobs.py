@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..deps import get_current_user, limit_crud
+from ..jobs import job_result
+from ..models import Job, User
+from ..schemas import JobRead
+
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"], dependencies=[Depends(limit_crud)])
+
+
+def job_to_read(job: Job) -> JobRead:
+    return JobRead(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        attempts=job.attempts,
+        result=job_result(job),
+        last_error=job.last_error if job.status == "failed" else None,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+@router.get("/{job_id}", response_model=JobRead)
+def get_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job non trovato")
+    return job_to_read(job)
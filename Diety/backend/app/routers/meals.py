@@ -1,15 +1,22 @@
+import uuid
 from datetime import date, datetime, time
+from pathlib import Path
 from typing import Optional
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..config import settings
 from ..database import get_db
-from ..deps import get_current_user
+from ..deps import get_current_user, limit_ai, limit_crud
+from ..jobs import enqueue_job
+from ..metrics import upload_bytes
 from ..models import Meal, User
 from ..ollama_client import OllamaServiceError, analyze_food_image, estimate_manual_meal_from_items
 from ..schemas import (
     ImageAnalysisResponse,
+    JobRead,
     ManualMealEstimateRequest,
     ManualMealEstimateResponse,
     MealCreate,
@@ -18,9 +25,10 @@ from ..schemas import (
     MealUpdate,
 )
 from ..services import ai_preferences_from_user, aggregate_macros, log_ai_interaction
+from .jobs import job_to_read
 
 
-router = APIRouter(prefix="/api/meals", tags=["Meals"])
+router = APIRouter(prefix="/api/meals", tags=["Meals"], dependencies=[Depends(limit_crud)])
 
 
 def _get_user_meal_or_404(db: Session, user_id: int, meal_id: int) -> Meal:
@@ -30,7 +38,7 @@ def _get_user_meal_or_404(db: Session, user_id: int, meal_id: int) -> Meal:
     return meal
 
 
-@router.post("/analyze-image", response_model=ImageAnalysisResponse)
+@router.post("/analyze-image", response_model=ImageAnalysisResponse, dependencies=[Depends(limit_ai)])
 async def analyze_image(
     image: UploadFile = File(...),
     hint: str = Form(default=""),
@@ -43,25 +51,38 @@ async def analyze_image(
     payload = await image.read()
     if not payload:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Immagine vuota")
+    upload_bytes.inc(len(payload), kind="meal_image")
 
-    ai_preferences = ai_preferences_from_user(current_user) or {}
+    ai_preferences = await run_in_threadpool(ai_preferences_from_user, current_user) or {}
 
+    input_payload = {
+        "hint": hint,
+        "file_name": image.filename,
+        "content_type": image.content_type,
+        "size_bytes": len(payload),
+    }
     try:
         result = await analyze_food_image(payload, hint, preferences=ai_preferences)
     except OllamaServiceError as exc:
+        await run_in_threadpool(
+            log_ai_interaction,
+            db,
+            current_user.id,
+            kind="image_analysis",
+            model=ai_preferences.get("vision_model"),
+            input_payload=input_payload,
+            output_payload=None,
+            error=exc,
+        )
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc)) from exc
 
-    log_ai_interaction(
+    await run_in_threadpool(
+        log_ai_interaction,
         db,
         current_user.id,
         kind="image_analysis",
         model=ai_preferences.get("vision_model"),
-        input_payload={
-            "hint": hint,
-            "file_name": image.filename,
-            "content_type": image.content_type,
-            "size_bytes": len(payload),
-        },
+        input_payload=input_payload,
         output_payload=result,
         meta={"fallback_used": result.get("fallback_used")},
     )
@@ -78,13 +99,55 @@ async def analyze_image(
     }
 
 
-@router.post("/estimate-manual", response_model=ManualMealEstimateResponse)
+@router.post(
+    "/analyze-image/jobs",
+    response_model=JobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(limit_ai)],
+)
+def enqueue_image_analysis(
+    image: UploadFile = File(...),
+    hint: str = Form(default=""),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    if not image.content_type or not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File non supportato")
+
+    # Handler sincrono (threadpool): lettura del file, scrittura su disco e accodamento non bloccano l'event loop.
+    payload = image.file.read()
+    if not payload:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Immagine vuota")
+    upload_bytes.inc(len(payload), kind="meal_image")
+
+    extension = Path(image.filename or "").suffix or ".jpg"
+    user_dir = Path(settings.job_files_dir) / "meal-analysis" / str(current_user.id)
+    user_dir.mkdir(parents=True, exist_ok=True)
+    file_path = user_dir / f"{uuid.uuid4().hex}{extension}"
+    file_path.write_bytes(payload)
+
+    job = enqueue_job(
+        db,
+        "image_analysis",
+        {
+            "user_id": current_user.id,
+            "file_path": str(file_path),
+            "hint": hint,
+            "file_name": image.filename,
+            "content_type": image.content_type,
+        },
+        user_id=current_user.id,
+    )
+    return job_to_read(job)
+
+
+@router.post("/estimate-manual", response_model=ManualMealEstimateResponse, dependencies=[Depends(limit_ai)])
 async def estimate_manual_meal(
     payload: ManualMealEstimateRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    ai_preferences = ai_preferences_from_user(current_user) or {}
+    ai_preferences = await run_in_threadpool(ai_preferences_from_user, current_user) or {}
 
     items = [
         {"name": item.name, "quantity": item.quantity}
@@ -94,6 +157,7 @@ async def estimate_manual_meal(
     if not items:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inserisci almeno un ingrediente valido.")
 
+    input_payload = {"items": items, "hint": payload.hint, "meal_type": payload.meal_type}
     try:
         result = await estimate_manual_meal_from_items(
             items=items,
@@ -102,14 +166,25 @@ async def estimate_manual_meal(
             preferences=ai_preferences,
         )
     except OllamaServiceError as exc:
+        await run_in_threadpool(
+            log_ai_interaction,
+            db,
+            current_user.id,
+            kind="manual_meal_estimate",
+            model=ai_preferences.get("text_model"),
+            input_payload=input_payload,
+            output_payload=None,
+            error=exc,
+        )
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc)) from exc
 
-    log_ai_interaction(
+    await run_in_threadpool(
+        log_ai_interaction,
         db,
         current_user.id,
         kind="manual_meal_estimate",
         model=ai_preferences.get("text_model"),
-        input_payload={"items": items, "hint": payload.hint, "meal_type": payload.meal_type},
+        input_payload=input_payload,
         output_payload=result,
     )
 
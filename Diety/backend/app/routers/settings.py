@@ -1,15 +1,16 @@
-import httpx
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..config import settings as app_settings
 from ..database import get_db
-from ..deps import get_current_user
+from ..deps import get_current_user, limit_crud
 from ..models import AISettings, User
+from ..ollama_pool import model_names
 from ..schemas import AISettingsRead, AISettingsUpdate, OllamaModelsResponse
 
 
-router = APIRouter(prefix="/api/settings", tags=["Settings"])
+router = APIRouter(prefix="/api/settings", tags=["Settings"], dependencies=[Depends(limit_crud)])
 
 
 def _get_or_create_ai_settings(db: Session, user: User) -> AISettings:
@@ -33,21 +34,13 @@ def _resolve_ollama_base_url(ai_settings: AISettings, override: str | None = Non
 
 
 def _extract_model_names(payload: dict) -> list[str]:
-    models = payload.get("models", [])
-    names: list[str] = []
-    for entry in models:
-        if not isinstance(entry, dict):
-            continue
-        model_name = entry.get("name") or entry.get("model")
-        if model_name:
-            names.append(str(model_name))
-    return sorted(set(names))
-
-
-def _vision_candidates(model_names: list[str]) -> list[str]:
+    return sorted(model_names(payload))
+
+
+def _vision_candidates(names: list[str]) -> list[str]:
     keywords = ("llava", "vision", "ocr", "bakllava", "moondream", "minicpm")
-    candidates = [name for name in model_names if any(keyword in name.lower() for keyword in keywords)]
-    return candidates or model_names
+    candidates = [name for name in names if any(keyword in name.lower() for keyword in keywords)]
+    return candidates or names
 
 
 @router.get("", response_model=AISettingsRead)
@@ -97,11 +90,15 @@ async def get_ollama_models(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    ai_settings = _get_or_create_ai_settings(db, current_user)
+    # Lettura nel threadpool: l'handler resta async per la chiamata HTTP a Ollama.
+    ai_settings = await run_in_threadpool(_get_or_create_ai_settings, db, current_user)
     target_url = _resolve_ollama_base_url(ai_settings, base_url)
 
+    # Come in ollama_client._post: httpx costa ~90ms di import e questo router viene caricato all'avvio.
+    import httpx
+
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(20, connect=app_settings.ollama_connect_timeout)) as client:
             response = await client.get(f"{target_url}/api/tags")
             response.raise_for_status()
             payload = response.json()
@@ -114,26 +111,26 @@ async def get_ollama_models(
             ),
         ) from exc
 
-    model_names = _extract_model_names(payload)
-    if not model_names:
+    installed = _extract_model_names(payload)
+    if not installed:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Nessun modello trovato in Ollama per l'URL specificato.",
         )
 
-    vision = _vision_candidates(model_names)
-    text = [name for name in model_names if name not in vision] or model_names
+    vision = _vision_candidates(installed)
+    text = [name for name in installed if name not in vision] or installed
 
     default_vision_model = ai_settings.vision_model or app_settings.ollama_model
     default_text_model = ai_settings.text_model or app_settings.ollama_text_model
 
     return {
         "base_url": target_url,
-        "models": model_names,
+        "models": installed,
         "vision_candidates": vision,
         "text_candidates": text,
         "default_vision_model": default_vision_model,
         "default_text_model": default_text_model,
-        "default_vision_installed": default_vision_model in model_names,
-        "default_text_installed": default_text_model in model_names,
+        "default_vision_installed": default_vision_model in installed,
+        "default_text_installed": default_text_model in installed,
     }
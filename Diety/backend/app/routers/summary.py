@@ -3,15 +3,31 @@ from typing import Optional
 
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..database import get_db
-from ..deps import get_current_user
+from ..deps import check_rate_limit, get_current_user, limit_crud
 from ..models import User
 from ..schemas import DailyNeedsResponse, DailySummaryResponse, TimelineResponse
-from ..services import build_daily_needs, build_daily_summary, build_timeline
+from ..services import (
+    DayContext,
+    build_daily_needs,
+    build_daily_summary,
+    build_timeline,
+    load_day_context,
+    sections_needing_ai,
+)
 
 
-router = APIRouter(prefix="/api/summary", tags=["Summary"])
+router = APIRouter(prefix="/api/summary", tags=["Summary"], dependencies=[Depends(limit_crud)])
+
+
+async def _day_context(db: Session, user: User, day: date, section: str, refresh: bool = False) -> DayContext:
+    # Il budget "ai" si consuma solo se la risposta non e' gia' in cache e va generata con Ollama.
+    context = await run_in_threadpool(load_day_context, db, user, day)
+    if await run_in_threadpool(sections_needing_ai, db, user, context, {section}, refresh):
+        await run_in_threadpool(check_rate_limit, "ai", user)
+    return context
 
 
 @router.get("/day", response_model=DailySummaryResponse)
@@ -22,7 +38,8 @@ async def get_day_summary(
     current_user: User = Depends(get_current_user),
 ):
     target_day = day or date.today()
-    return await build_daily_summary(db=db, user=current_user, day=target_day, refresh=refresh)
+    context = await _day_context(db, current_user, target_day, "summary", refresh)
+    return await build_daily_summary(db=db, user=current_user, day=target_day, refresh=refresh, context=context)
 
 
 @router.get("/needs", response_model=DailyNeedsResponse)
@@ -32,7 +49,8 @@ async def get_daily_needs(
     current_user: User = Depends(get_current_user),
 ):
     target_day = day or date.today()
-    return await build_daily_needs(db=db, user=current_user, day=target_day)
+    context = await _day_context(db, current_user, target_day, "needs")
+    return await build_daily_needs(db=db, user=current_user, day=target_day, context=context)
 
 
 @router.get("/timeline", response_model=TimelineResponse)
@@ -42,4 +60,5 @@ async def get_daily_timeline(
     current_user: User = Depends(get_current_user),
 ):
     target_day = day or date.today()
-    return await build_timeline(db=db, user=current_user, day=target_day)
+    context = await _day_context(db, current_user, target_day, "timeline")
+    return await build_timeline(db=db, user=current_user, day=target_day, context=context)
@@ -1,16 +1,16 @@
-from datetime import date, datetime, time
+from datetime import date, datetime
 
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 
 from ..database import get_db
-from ..deps import get_current_user
+from ..deps import get_current_user, limit_crud
 from ..models import User, WaterIntake
 from ..schemas import WaterCreate, WaterIntakeRead, WaterSummaryResponse
-from ..services import estimate_water_target_ml, ai_preferences_from_user
+from ..services import build_water_summary
 
 
-router = APIRouter(prefix="/api/water", tags=["Water"])
+router = APIRouter(prefix="/api/water", tags=["Water"], dependencies=[Depends(limit_crud)])
 
 
 @router.post("", response_model=WaterIntakeRead)
@@ -34,23 +34,4 @@ def get_water_summary(
     current_user: User = Depends(get_current_user),
 ):
     target_day = day or date.today()
-    start = datetime.combine(target_day, time.min)
-    end = datetime.combine(target_day, time.max)
-
-    entries = (
-        db.query(WaterIntake)
-        .filter(WaterIntake.user_id == current_user.id, WaterIntake.consumed_at >= start, WaterIntake.consumed_at <= end)
-        .order_by(WaterIntake.consumed_at.asc())
-        .all()
-    )
-
-    total_ml = sum(entry.amount_ml for entry in entries)
-    preferences = ai_preferences_from_user(current_user) or {}
-    target_ml = estimate_water_target_ml(preferences)
-
-    return {
-        "day": target_day,
-        "total_ml": total_ml,
-        "target_ml": target_ml,
-        "entries": entries,
-    }
+    return build_water_summary(db, current_user, target_day)
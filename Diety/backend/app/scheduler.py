@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .jobs import FAILED, enqueue_job
+from .models import DailySummary, Job, Meal, Routine
+from .services import is_day_closed
+
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_window(value: str) -> tuple[time, time] | None:
+    if not value or "-" not in value:
+        return None
+    start_raw, end_raw = value.split("-", 1)
+    try:
+        return time.fromisoformat(start_raw.strip()), time.fromisoformat(end_raw.strip())
+    except ValueError:
+        logger.warning("SUMMARY_SCHEDULER_WINDOW non valido: %s", value)
+        return None
+
+
+def in_processing_window(now: datetime, window: tuple[time, time] | None) -> bool:
+    if window is None:
+        return True
+    start, end = window
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    # Finestra a cavallo della mezzanotte, es. 22:00-06:00.
+    return current >= start or current < end
+
+
+def _recently_failed(db: Session, user_ids: set[int]) -> set[tuple[int, str]]:
+    # Un job fallito perde il dedup_key: senza questa pausa ogni scansione ne accoderebbe uno nuovo, con tutti
+    # i tentativi, per tutta la durata di un guasto di Ollama.
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.summary_scheduler_failure_cooldown)
+    failed = set()
+    for user_id, payload in db.query(Job.user_id, Job.payload).filter(
+        Job.kind == "daily_summary",
+        Job.status == FAILED,
+        Job.updated_at >= cutoff,
+        Job.user_id.in_(user_ids),
+    ):
+        try:
+            failed.add((user_id, json.loads(payload or "{}").get("day")))
+        except ValueError:
+            continue
+    return failed
+
+
+def find_due_summaries(db: Session, now: datetime) -> list[tuple[int, date]]:
+    due = []
+    for day in (now.date() - timedelta(days=1), now.date()):
+        start = datetime.combine(day, time.min)
+        end = datetime.combine(day, time.max)
+        active_ids = {
+            user_id
+            for (user_id,) in db.query(Meal.user_id)
+            .filter(Meal.consumed_at >= start, Meal.consumed_at <= end)
+            .distinct()
+        }
+        if not active_ids:
+            continue
+
+        done_ids = {
+            user_id
+            for (user_id,) in db.query(DailySummary.user_id).filter(
+                DailySummary.day == day,
+                DailySummary.advice.isnot(None),
+                DailySummary.user_id.in_(active_ids),
+            )
+        }
+        pending_ids = active_ids - done_ids
+        if not pending_ids:
+            continue
+
+        routines = {
+            routine.user_id: routine
+            for routine in db.query(Routine).filter(Routine.user_id.in_(pending_ids))
+        }
+        failed = _recently_failed(db, pending_ids)
+        for user_id in sorted(pending_ids):
+            if (user_id, day.isoformat()) in failed:
+                continue
+            if is_day_closed(day, routines.get(user_id), now):
+                due.append((user_id, day))
+    return due
+
+
+def _window_delay_seconds(now: datetime, window: tuple[time, time] | None) -> float:
+    if in_processing_window(now, window):
+        return 0.0
+    start = datetime.combine(now.date(), window[0])
+    if start <= now:
+        start += timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+def enqueue_due_summaries(db: Session, now: datetime) -> int:
+    window = _parse_window(settings.summary_scheduler_window)
+    # La finestra e' in ora locale, la coda ragiona in UTC.
+    run_after = datetime.utcnow() + timedelta(seconds=_window_delay_seconds(now, window))
+    due = find_due_summaries(db, now)
+    for user_id, day in due:
+        enqueue_job(
+            db,
+            "daily_summary",
+            {"user_id": user_id, "day": day.isoformat()},
+            user_id=user_id,
+            dedup_key=f"daily_summary:{user_id}:{day.isoformat()}",
+            run_after=run_after,
+        )
+    return len(due)
+
+
+async def run_summary_scheduler(interval_seconds: int) -> None:
+    while True:
+        db = SessionLocal()
+        try:
+            enqueue_due_summaries(db, datetime.now())
+        except Exception:
+            logger.exception("Scansione riepiloghi di fine giornata fallita")
+            db.rollback()
+        finally:
+            db.close()
+        await asyncio.sleep(max(interval_seconds, 5))
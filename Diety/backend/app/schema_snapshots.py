@@ -0,0 +1,244 @@
+# Schema congelato per le migrazioni che creano tabelle: una migrazione gia' rilasciata deve produrre sempre lo
+# stesso DDL, anche quando i modelli in models.py cambiano. Le modifiche successive vanno in nuove migrazioni,
+# mai qui. MetaData separato da Base.metadata: create_all dei modelli non vede queste tabelle.
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Double,
+    Float,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    Time,
+    UniqueConstraint,
+)
+
+
+# Migrazione 1: lo schema dei modelli quando e' stato introdotto il versionamento.
+baseline = MetaData()
+
+Table(
+    "users",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String(255), unique=True, index=True, nullable=False),
+    Column("full_name", String(120), nullable=False),
+    Column("password_hash", String(255), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+Table(
+    "routines",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, unique=True, index=True),
+    Column("breakfast_time", Time, nullable=False),
+    Column("lunch_time", Time, nullable=False),
+    Column("dinner_time", Time, nullable=False),
+    Column("day_end_time", Time, nullable=True),
+    Column("calorie_target", Float, nullable=True),
+    Column("protein_target", Float, nullable=True),
+    Column("carbs_target", Float, nullable=True),
+    Column("fats_target", Float, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "meals",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("meal_type", String(32), nullable=False),
+    Column("food_name", String(255), nullable=False),
+    Column("consumed_at", DateTime, nullable=False, index=True),
+    Column("calories", Float, nullable=False),
+    Column("proteins", Float, nullable=False),
+    Column("carbs", Float, nullable=False),
+    Column("fats", Float, nullable=False),
+    Column("notes", Text, nullable=True),
+    Column("source", String(16), nullable=False),
+    Column("ai_payload", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+)
+
+Table(
+    "daily_summaries",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("day", Date, nullable=False, index=True),
+    Column("calories", Float, nullable=False),
+    Column("proteins", Float, nullable=False),
+    Column("carbs", Float, nullable=False),
+    Column("fats", Float, nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("advice", Text, nullable=True),
+    Column("generated_at", DateTime, nullable=False),
+    UniqueConstraint("user_id", "day", name="uq_daily_summary_user_day"),
+)
+
+Table(
+    "ai_settings",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, unique=True, index=True),
+    Column("ollama_base_url", String(255), nullable=True),
+    Column("vision_model", String(120), nullable=False),
+    Column("text_model", String(120), nullable=False),
+    Column("timeout_seconds", Integer, nullable=False),
+    Column("temperature", Float, nullable=False),
+    Column("macro_fallback_enabled", Boolean, nullable=False),
+    Column("meal_type_autodetect_enabled", Boolean, nullable=False),
+    Column("smart_routine_enabled", Boolean, nullable=False),
+    Column("age_years", Integer, nullable=True),
+    Column("sex", String(32), nullable=True),
+    Column("height_cm", Float, nullable=True),
+    Column("weight_kg", Float, nullable=True),
+    Column("target_weight_kg", Float, nullable=True),
+    Column("activity_level", String(32), nullable=True),
+    Column("goals", Text, nullable=True),
+    Column("dietary_preferences", Text, nullable=True),
+    Column("allergies", Text, nullable=True),
+    Column("response_language", String(16), nullable=False),
+    Column("system_prompt", Text, nullable=True),
+    Column("reasoning_cycles", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "ai_interactions",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("kind", String(40), nullable=False),
+    Column("model", String(120), nullable=True),
+    Column("input_payload", Text, nullable=True),
+    Column("output_payload", Text, nullable=True),
+    Column("meta", Text, nullable=True),
+    Column("call_count", Integer, nullable=True),
+    Column("queue_wait_ms", Float, nullable=True),
+    Column("http_ms", Float, nullable=True),
+    Column("total_duration_ms", Float, nullable=True),
+    Column("load_duration_ms", Float, nullable=True),
+    Column("prompt_eval_count", Integer, nullable=True),
+    Column("eval_count", Integer, nullable=True),
+    Column("eval_duration_ms", Float, nullable=True),
+    Column("created_at", DateTime, nullable=False, index=True),
+)
+
+Table(
+    "water_intakes",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("amount_ml", Integer, nullable=False),
+    Column("consumed_at", DateTime, nullable=False, index=True),
+    Column("created_at", DateTime, nullable=False),
+)
+
+Table(
+    "body_photos",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("kind", String(16), nullable=False),
+    Column("image_path", String(255), nullable=False),
+    Column("captured_at", DateTime, nullable=False, index=True),
+    Column("ai_summary", Text, nullable=True),
+    Column("ai_payload", Text, nullable=True),
+    Column("analysis_status", String(16), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+Table(
+    "body_photo_comparisons",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("kind", String(16), nullable=False),
+    Column("photo_ids", String(191), nullable=False),
+    Column("latest_id", Integer, ForeignKey("body_photos.id"), nullable=False, index=True),
+    Column("previous_id", Integer, ForeignKey("body_photos.id"), nullable=False, index=True),
+    Column("model", String(120), nullable=False),
+    Column("comparison", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    UniqueConstraint("user_id", "photo_ids", "model", name="uq_body_photo_comparison_photos_model"),
+)
+
+Table(
+    "jobs",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=True, index=True),
+    Column("kind", String(40), nullable=False, index=True),
+    Column("payload", Text, nullable=True),
+    Column("result", Text, nullable=True),
+    Column("dedup_key", String(191), nullable=True, unique=True),
+    Column("status", String(16), nullable=False, index=True),
+    Column("attempts", Integer, nullable=False),
+    Column("max_attempts", Integer, nullable=False),
+    Column("run_after", DateTime, nullable=False, index=True),
+    Column("locked_until", DateTime, nullable=True),
+    Column("locked_by", String(120), nullable=True),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "chat_conversations",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("title", String(120), nullable=False),
+    Column("summary", Text, nullable=True),
+    Column("summarized_until_id", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False, index=True),
+)
+
+Table(
+    "chat_turns",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("conversation_id", Integer, ForeignKey("chat_conversations.id"), nullable=False, index=True),
+    Column("role", String(16), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+
+# Migrazione 5.
+rate_limit_buckets_v5 = Table(
+    "rate_limit_buckets",
+    MetaData(),
+    Column("key", String(191), primary_key=True),
+    Column("tokens", Double, nullable=False),
+    Column("updated_at", Double, nullable=False),
+)
+
+# Migrazione 6: chiave univoca estesa a prompt_key. Le chiavi esterne puntano alle colonne della baseline.
+_users = baseline.tables["users"]
+_body_photos = baseline.tables["body_photos"]
+body_photo_comparisons_v6 = Table(
+    "body_photo_comparisons",
+    MetaData(),
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey(_users.c.id), nullable=False, index=True),
+    Column("kind", String(16), nullable=False),
+    Column("photo_ids", String(191), nullable=False),
+    Column("latest_id", Integer, ForeignKey(_body_photos.c.id), nullable=False, index=True),
+    Column("previous_id", Integer, ForeignKey(_body_photos.c.id), nullable=False, index=True),
+    Column("model", String(120), nullable=False),
+    Column("prompt_key", String(40), nullable=False),
+    Column("comparison", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    UniqueConstraint("user_id", "photo_ids", "model", "prompt_key", name="uq_body_photo_comparison_key"),
+)
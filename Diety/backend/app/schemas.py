@@ -1,5 +1,5 @@
 from datetime import date, datetime, time
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, ConfigDict, EmailStr, Field
 
@@ -274,29 +274,100 @@ class TimelineResponse(BaseModel):
     guidance: Optional[str]
 
 
+class DashboardResponse(BaseModel):
+    day: date
+    summary: Optional[DailySummaryResponse] = None
+    needs: Optional[DailyNeedsResponse] = None
+    timeline: Optional[TimelineResponse] = None
+    meals: Optional[MealListResponse] = None
+    water: Optional[WaterSummaryResponse] = None
+    sections: dict[str, str]
+
+
 class BodyPhotoRead(BaseModel):
     id: int
     kind: str
     image_url: str
     captured_at: datetime
     ai_summary: Optional[str]
+    analysis_status: str = "done"
 
 
 class BodyPhotoCompareResponse(BaseModel):
     latest: BodyPhotoRead
     previous: BodyPhotoRead
     comparison: Optional[str]
+    cached: bool = False
+
+
+class BodyPhotoSeriesResponse(BaseModel):
+    photos: list[BodyPhotoRead]
+    comparison: Optional[str]
+    cached: bool = False
 
 
 class ChatMessage(BaseModel):
-    role: str
+    role: Literal["user", "assistant"]
     content: str
 
 
+class ChatHistoryMessage(ChatMessage):
+    content: str = Field(min_length=1, max_length=4000)
+
+
 class ChatRequest(BaseModel):
     message: str = Field(min_length=1, max_length=2000)
-    history: list[ChatMessage] = Field(default_factory=list)
+    conversation_id: Optional[int] = None
+    # Usato solo per creare una nuova conversazione a partire da una chat salvata in locale.
+    history: list[ChatHistoryMessage] = Field(default_factory=list, max_length=50)
 
 
 class ChatResponse(BaseModel):
     reply: str
+    conversation_id: int
+
+
+class ChatConversationRead(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ChatConversationDetail(ChatConversationRead):
+    messages: list[ChatMessage]
+
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    result: Optional[dict] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class AIStatsGroup(BaseModel):
+    model: str
+    kind: str
+    interactions: int
+    calls: int
+    errors: int
+    error_rate: Optional[float]
+    latency_p50_ms: Optional[float]
+    latency_p95_ms: Optional[float]
+    failover_p95_ms: Optional[float]
+    load_duration_avg_ms: Optional[float]
+    prompt_tokens_avg: Optional[float]
+    output_tokens_avg: Optional[float]
+    tokens_per_second_p50: Optional[float]
+    tokens_per_second: Optional[float]
+
+
+class AIStatsResponse(BaseModel):
+    since: datetime
+    groups: list[AIStatsGroup]
@@ -0,0 +1,99 @@
+import argparse
+import functools
+import importlib.util
+import logging
+import os
+import random
+import tempfile
+from socket import socket
+
+import uvicorn
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _implementation(preferred: str, module: str) -> str:
+    # uvicorn[standard] installa uvloop e httptools; su piattaforme senza wheel si ripiega su asyncio/h11.
+    return preferred if importlib.util.find_spec(module) else "auto"
+
+
+def _run_worker(config: uvicorn.Config, sockets: list[socket] | None = None) -> None:
+    # Jitter per processo: i worker non si riciclano tutti nello stesso momento.
+    if config.limit_max_requests:
+        config.limit_max_requests += random.randint(0, max(settings.web_max_requests_jitter, 0))
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def _run_migrations() -> None:
+    from .database import engine
+    from .migrations import migrate
+
+    applied = migrate()
+    logger.info("Migrazioni applicate: %s", applied or "nessuna, schema aggiornato")
+    # Il supervisore non serve richieste: niente connessioni aperte da ereditare.
+    engine.dispose()
+
+
+def _prepare_metrics_dir() -> None:
+    # Un registro per worker: gli snapshot in questa cartella vengono sommati da /metrics.
+    # Svuotata a ogni avvio del supervisore, altrimenti si sommerebbero i processi di un'esecuzione precedente.
+    directory = settings.metrics_multiprocess_dir or tempfile.mkdtemp(prefix="dietly-metrics-")
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, filename))
+    os.environ["METRICS_MULTIPROCESS_DIR"] = directory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dietly production server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.web_workers)
+    parser.add_argument("--max-requests", type=int, default=settings.web_max_requests, help="0 = mai riciclare")
+    parser.add_argument("--graceful-timeout", type=int, default=settings.web_graceful_timeout)
+    parser.add_argument("--keep-alive", type=int, default=settings.web_keep_alive)
+    parser.add_argument("--skip-migrations", action="store_true", help="Non applicare le migrazioni prima dell'avvio")
+    parser.add_argument("--reload", action="store_true", help="Sviluppo: un processo, riavvio al cambio dei file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not args.skip_migrations:
+        _run_migrations()
+    # Le migrazioni le ha gia' applicate il supervisore: i worker non toccano lo schema.
+    os.environ["DB_SCHEMA_ON_STARTUP"] = "skip"
+    # Ogni worker dimensiona il proprio pool; il controllo su max_connections conta tutti i processi.
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    if not args.reload:
+        _prepare_metrics_dir()
+
+    config = uvicorn.Config(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        loop=_implementation("uvloop", "uvloop"),
+        http=_implementation("httptools", "httptools"),
+        workers=max(args.workers, 1),
+        reload=args.reload,
+        limit_max_requests=args.max_requests or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+    )
+    sock = config.bind_socket()
+    target = functools.partial(_run_worker, config)
+    if args.reload:
+        ChangeReload(config, target=target, sockets=[sock]).run()
+        return
+
+    # Anche con un solo worker passiamo dal supervisore: riavvia i processi riciclati o morti,
+    # SIGHUP li riavvia uno alla volta (reload senza downtime), SIGTTIN/SIGTTOU ne aggiungono o tolgono uno.
+    logger.info("Avvio di %s worker uvicorn su %s:%s", config.workers, args.host, args.port)
+    Multiprocess(config, target=target, sockets=[sock]).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,38 @@
+import asyncio
+import json
+from collections.abc import Awaitable
+from dataclasses import dataclass
 from datetime import date, datetime, time, timedelta
+from pathlib import Path
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .ai_metrics import drain_ai_calls, interaction_columns, track_ai_calls
+from .cache import TTLCache
+from .config import settings
+from .database import SessionLocal
+from .metrics import ai_interactions, ai_tokens, record_cache
+from .models import AIInteraction, BodyPhoto, BodyPhotoComparison, DailySummary, Meal, Routine, User, WaterIntake
+from .ollama_client import (
+    compare_body_photo_series,
+    compare_body_photos,
+    generate_day_insights,
+    generate_smart_routine,
+)
+from .profiling import span
+from .singleflight import SingleFlight, input_digest
+from .tracing import trace_ids
 
-import json
 
-from .models import AIInteraction, DailySummary, Meal, Routine, User
-from .ollama_client import (
-    generate_daily_advice,
-    generate_daily_needs,
-    generate_timeline_guidance,
+_inflight = SingleFlight()
+_insights_cache = TTLCache(ttl_seconds=settings.day_insights_cache_ttl, name="day_insights")
+
+DASHBOARD_SECTIONS = ("summary", "needs", "timeline", "meals", "water")
+FALLBACK_ADVICE = (
+    "Giornata chiusa: prova a distribuire meglio i macro nei pasti principali "
+    "e aumenta leggermente verdura/fibra nei prossimi giorni."
 )
 
 
@@ -24,7 +48,27 @@ def log_ai_interaction(
     input_payload: dict | None,
     output_payload: dict | str | None,
     meta: dict | None = None,
+    error: Exception | str | None = None,
 ) -> None:
+    calls = drain_ai_calls()
+    if model is None and calls:
+        # Senza preferenze utente il modello effettivo e' quello di default usato nella chiamata.
+        model = calls[-1].model
+    if calls:
+        model_label = model or "default"
+        if error is None:
+            ai_interactions.observe(
+                sum(call.failover_ms + call.http_ms for call in calls) / 1000,
+                model=model_label,
+                kind=kind,
+            )
+        prompt_tokens = sum(call.prompt_eval_count or 0 for call in calls)
+        output_tokens = sum(call.eval_count or 0 for call in calls)
+        ai_tokens.inc(prompt_tokens, model=model_label, kind=kind, phase="prompt")
+        ai_tokens.inc(output_tokens, model=model_label, kind=kind, phase="output")
+    ids = trace_ids()
+    if ids:
+        meta = {**(meta or {}), **ids}
     try:
         entry = AIInteraction(
             user_id=user_id,
@@ -33,6 +77,8 @@ def log_ai_interaction(
             input_payload=json.dumps(input_payload, ensure_ascii=False) if input_payload is not None else None,
             output_payload=json.dumps(output_payload, ensure_ascii=False) if isinstance(output_payload, (dict, list)) else output_payload,
             meta=json.dumps(meta, ensure_ascii=False) if meta is not None else None,
+            error=str(error)[:4000] if error is not None else None,
+            **interaction_columns(calls),
         )
         db.add(entry)
         db.commit()
@@ -119,112 +165,189 @@ def ai_preferences_from_user(user: User) -> dict | None:
     }
 
 
-async def build_daily_summary(
-    db: Session,
-    user: User,
-    day: date,
-    refresh: bool = False,
-) -> dict:
+@dataclass
+class DayContext:
+    day: date
+    meals: list[Meal]
+    totals: dict
+    routine: Routine | None
+    targets: dict
+    ai_preferences: dict | None
+
+
+def load_day_meals(db: Session, user_id: int, day: date) -> list[Meal]:
     start = datetime.combine(day, time.min)
     end = datetime.combine(day, time.max)
-
-    meals = (
+    return (
         db.query(Meal)
-        .filter(Meal.user_id == user.id, Meal.consumed_at >= start, Meal.consumed_at <= end)
+        .filter(Meal.user_id == user_id, Meal.consumed_at >= start, Meal.consumed_at <= end)
         .order_by(Meal.consumed_at.asc())
         .all()
     )
 
-    totals = aggregate_macros(meals)
+
+def load_day_context(db: Session, user: User, day: date) -> DayContext:
+    meals = load_day_meals(db, user.id, day)
     routine = user.routine
-    targets = targets_from_routine(routine)
-    day_end_time = compute_day_end_time(routine)
-    closed = is_day_closed(day, routine)
+    return DayContext(
+        day=day,
+        meals=meals,
+        totals=aggregate_macros(meals),
+        routine=routine,
+        targets=targets_from_routine(routine),
+        ai_preferences=ai_preferences_from_user(user),
+    )
 
-    stored_summary = db.query(DailySummary).filter(DailySummary.user_id == user.id, DailySummary.day == day).first()
-    advice = stored_summary.advice if stored_summary else None
-    ai_preferences = ai_preferences_from_user(user)
 
-    ai_used = False
-    if closed:
-        if refresh or not advice:
-            prompt_payload = {
-                "day": str(day),
-                "totals": totals,
-                "targets": targets,
-                "meal_count": len(meals),
-                "user_profile": {
-                    "age_years": ai_preferences.get("age_years") if ai_preferences else None,
-                    "sex": ai_preferences.get("sex") if ai_preferences else None,
-                    "height_cm": ai_preferences.get("height_cm") if ai_preferences else None,
-                    "weight_kg": ai_preferences.get("weight_kg") if ai_preferences else None,
-                    "target_weight_kg": ai_preferences.get("target_weight_kg") if ai_preferences else None,
-                    "activity_level": ai_preferences.get("activity_level") if ai_preferences else None,
-                    "goals": ai_preferences.get("goals") if ai_preferences else None,
-                    "dietary_preferences": ai_preferences.get("dietary_preferences") if ai_preferences else None,
-                    "allergies": ai_preferences.get("allergies") if ai_preferences else None,
-                },
-            }
-            try:
-                advice = await generate_daily_advice(
-                    prompt_payload,
-                    preferences=ai_preferences,
-                )
-                ai_used = True
-            except Exception:
-                advice = (
-                    "Giornata chiusa: prova a distribuire meglio i macro nei pasti principali "
-                    "e aumenta leggermente verdura/fibra nei prossimi giorni."
-                )
-
-        if stored_summary:
-            stored_summary.calories = totals["calories"]
-            stored_summary.proteins = totals["proteins"]
-            stored_summary.carbs = totals["carbs"]
-            stored_summary.fats = totals["fats"]
-            stored_summary.status = "closed"
-            stored_summary.advice = advice
-            stored_summary.generated_at = datetime.utcnow()
-        else:
-            db.add(
-                DailySummary(
-                    user_id=user.id,
-                    day=day,
-                    calories=totals["calories"],
-                    proteins=totals["proteins"],
-                    carbs=totals["carbs"],
-                    fats=totals["fats"],
-                    status="closed",
-                    advice=advice,
-                    generated_at=datetime.utcnow(),
-                )
-            )
+PROFILE_KEYS = (
+    "age_years",
+    "sex",
+    "height_cm",
+    "weight_kg",
+    "target_weight_kg",
+    "activity_level",
+    "goals",
+    "dietary_preferences",
+    "allergies",
+)
 
-        db.commit()
 
-        if ai_used and ai_preferences:
-            log_ai_interaction(
-                db,
-                user.id,
-                kind="daily_advice",
-                model=ai_preferences.get("text_model"),
-                input_payload=prompt_payload,
-                output_payload={"advice": advice},
-                meta={"day": str(day)},
-            )
+def _coalesce_key(endpoint: str, user: User, context: DayContext, **inputs) -> tuple:
+    # Un pasto aggiunto o modificato cambia la chiave: chi arriva dopo non riceve il risultato calcolato prima.
+    routine = context.routine
+    ai_settings = user.ai_settings
+    digest = input_digest(
+        {
+            "inputs": inputs,
+            "meals": [meal.id for meal in context.meals],
+            "totals": context.totals,
+            "routine": routine.updated_at if routine else None,
+            "ai_settings": ai_settings.updated_at if ai_settings else None,
+        }
+    )
+    return (user.id, endpoint, context.day, digest)
+
+
+def _load_task_context(db: Session, user_id: int, day: date) -> tuple[User, DayContext]:
+    user = db.get(User, user_id)
+    if user is None:
+        raise LookupError(f"Utente {user_id} non trovato")
+    return user, load_day_context(db, user, day)
 
+
+def _read_task_context(user_id: int, day: date) -> DayContext:
+    with SessionLocal() as db:
+        return _load_task_context(db, user_id, day)[1]
+
+
+def _summary_result(context: DayContext, closed: bool, advice: str | None) -> dict:
     return {
-        "day": day,
+        "day": context.day,
         "is_closed": closed,
         "status": "closed" if closed else "open",
-        "day_end_time": day_end_time,
-        "meals_count": len(meals),
-        "totals": totals,
-        "targets": targets,
+        "day_end_time": compute_day_end_time(context.routine),
+        "meals_count": len(context.meals),
+        "totals": context.totals,
+        "targets": context.targets,
         "advice": advice if closed else None,
     }
 
 
+def _stored_advice(db: Session, user_id: int, day: date) -> str | None:
+    stored_summary = db.query(DailySummary).filter(DailySummary.user_id == user_id, DailySummary.day == day).first()
+    return stored_summary.advice if stored_summary else None
+
+
+def summary_snapshot(db: Session, user: User, context: DayContext) -> dict:
+    closed = is_day_closed(context.day, context.routine)
+    return _summary_result(context, closed, _stored_advice(db, user.id, context.day))
+
+
+async def build_daily_summary(
+    db: Session,
+    user: User,
+    day: date,
+    refresh: bool = False,
+    context: DayContext | None = None,
+) -> dict:
+    context = context or await run_in_threadpool(load_day_context, db, user, day)
+    return await _daily_summary_flight(user, context, refresh)
+
+
+def _daily_summary_flight(user: User, context: DayContext, refresh: bool = False) -> Awaitable[dict]:
+    key = _coalesce_key("daily_summary", user, context, refresh=refresh)
+    return _inflight.do(key, lambda: _build_daily_summary(user.id, context.day, refresh))
+
+
+def _read_summary_state(user_id: int, day: date) -> tuple[DayContext, str | None]:
+    with SessionLocal() as db:
+        _, context = _load_task_context(db, user_id, day)
+        return context, _stored_advice(db, user_id, day)
+
+
+async def _build_daily_summary(user_id: int, day: date, refresh: bool) -> dict:
+    # Il task condiviso sopravvive alla richiesta che l'ha avviato: usa sessioni proprie, mai quella
+    # del primo chiamante, e non tiene una connessione aperta durante la chiamata AI. Le letture e le
+    # scritture girano nel threadpool: un checkout bloccato sul pool non ferma l'event loop.
+    context, advice = await run_in_threadpool(_read_summary_state, user_id, day)
+    closed = is_day_closed(day, context.routine)
+
+    if closed:
+        if refresh or not advice:
+            try:
+                insights = await day_insights(user_id, context, refresh=refresh)
+                generated = insights.get("advice") or None
+            except Exception:
+                generated = None
+            # Se l'AI fallisce si tiene il resoconto gia' salvato, altrimenti resta NULL: il testo di
+            # ripiego non si salva, cosi' scheduler e letture successive riprovano la generazione.
+            advice = generated or advice
+
+        await run_in_threadpool(_store_closed_summary, user_id, day, context.totals, advice)
+
+    return _summary_result(context, closed, advice or FALLBACK_ADVICE)
+
+
+def _store_closed_summary(user_id: int, day: date, totals: dict, advice: str | None) -> None:
+    with SessionLocal() as db:
+        _upsert_closed_summary(db, user_id, day, totals, advice)
+
+
+def _upsert_closed_summary(
+    db: Session,
+    user_id: int,
+    day: date,
+    totals: dict,
+    advice: str | None,
+) -> None:
+    values = {
+        "calories": totals["calories"],
+        "proteins": totals["proteins"],
+        "carbs": totals["carbs"],
+        "fats": totals["fats"],
+        "status": "closed",
+        "advice": advice,
+        "generated_at": datetime.utcnow(),
+    }
+
+    stored_summary = db.query(DailySummary).filter(DailySummary.user_id == user_id, DailySummary.day == day).first()
+    if stored_summary is None:
+        db.add(DailySummary(user_id=user_id, day=day, **values))
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # Un altro worker ha creato la riga nel frattempo: la aggiorniamo.
+            db.rollback()
+            stored_summary = (
+                db.query(DailySummary).filter(DailySummary.user_id == user_id, DailySummary.day == day).one()
+            )
+
+    for field, value in values.items():
+        setattr(stored_summary, field, value)
+    db.commit()
+
+
 def _activity_multiplier(level: str | None) -> float:
     mapping = {
         "sedentario": 1.2,
@@ -308,59 +431,162 @@ def _macro_focus(remaining: dict) -> str:
     return "macro"
 
 
-async def build_daily_needs(db: Session, user: User, day: date) -> dict:
-    start = datetime.combine(day, time.min)
-    end = datetime.combine(day, time.max)
-    meals = (
-        db.query(Meal)
-        .filter(Meal.user_id == user.id, Meal.consumed_at >= start, Meal.consumed_at <= end)
-        .order_by(Meal.consumed_at.asc())
-        .all()
+def _day_insights_payload(context: DayContext, closed: bool) -> dict:
+    ai_preferences = context.ai_preferences or {}
+    targets = context.targets
+    if not targets.get("calories"):
+        targets = estimate_daily_needs_from_profile(ai_preferences)
+
+    return {
+        "day": str(context.day),
+        "day_closed": closed,
+        "totals": context.totals,
+        "targets": targets,
+        "remaining": _timeline_remaining(context),
+        "meal_count": len(context.meals),
+        "user_profile": {key: ai_preferences.get(key) for key in PROFILE_KEYS},
+    }
+
+
+def _insights_request(user_id: int, context: DayContext) -> tuple[tuple, dict, dict]:
+    closed = is_day_closed(context.day, context.routine)
+    payload = _day_insights_payload(context, closed)
+    ai_preferences = context.ai_preferences or {}
+    key = (user_id, context.day, input_digest({"payload": payload, "preferences": ai_preferences}))
+    return key, payload, ai_preferences
+
+
+def sections_needing_ai(
+    db: Session,
+    user: User,
+    context: DayContext,
+    sections: set[str],
+    refresh: bool = False,
+) -> set[str]:
+    # Le sezioni che in questa richiesta chiamerebbero Ollama, per consumare il budget "ai" solo quando serve.
+    # Legge il resoconto salvato con la sessione della richiesta: va chiamata nel threadpool.
+    if not refresh and _insights_cache.peek(_insights_request(user.id, context)[0]) is not None:
+        return set()
+    pending = set()
+    if "summary" in sections and is_day_closed(context.day, context.routine):
+        if refresh or not _stored_advice(db, user.id, context.day):
+            pending.add("summary")
+    if "needs" in sections:
+        pending.add("needs")
+    if "timeline" in sections and context.routine:
+        pending.add("timeline")
+    return pending
+
+
+async def day_insights(user_id: int, context: DayContext, refresh: bool = False) -> dict:
+    key, payload, ai_preferences = _insights_request(user_id, context)
+    if refresh:
+        _insights_cache.pop(key)
+    else:
+        cached = _insights_cache.get(key)
+        if cached is not None:
+            return cached
+
+    return await _inflight.do(
+        ("day_insights", *key), lambda: _generate_insights(user_id, payload, ai_preferences, key)
     )
-    totals = aggregate_macros(meals)
-    ai_preferences = ai_preferences_from_user(user) or {}
-    needs = estimate_daily_needs_from_profile(ai_preferences)
-    source = "stimato"
-    note = "Stima basata su dati inseriti e livello di attivita."
 
-    ai_payload = {"profile": ai_preferences, "totals": totals}
+
+async def _generate_insights(user_id: int, payload: dict, ai_preferences: dict, key: tuple) -> dict:
+    insights = None
+    error = None
     try:
-        ai_result = await generate_daily_needs(
-            ai_payload,
+        insights = await generate_day_insights(
+            payload,
             preferences=ai_preferences,
+            include_advice=payload["day_closed"],
         )
-        if ai_result:
-            candidate = ai_result.get("needs", {})
-            used = False
-            if sum(candidate.values()) > 0:
-                needs = candidate
-                note = ai_result.get("note") or note
-                source = "ai"
-                used = True
-            log_ai_interaction(
-                db,
-                user.id,
-                kind="daily_needs",
-                model=ai_preferences.get("text_model"),
-                input_payload=ai_payload,
-                output_payload=ai_result,
-                meta={"day": str(day), "used": used},
-            )
+        _insights_cache.set(key, insights)
+    except Exception as exc:
+        error = exc
+        raise
+    finally:
+        await run_in_threadpool(_log_day_insights, user_id, payload, ai_preferences, insights, error)
+    return insights
+
+
+def _log_day_insights(
+    user_id: int, payload: dict, ai_preferences: dict, insights: dict | None, error: Exception | None
+) -> None:
+    with SessionLocal() as db:
+        log_ai_interaction(
+            db,
+            user_id,
+            kind="day_insights",
+            model=ai_preferences.get("text_model"),
+            input_payload=payload,
+            output_payload=insights,
+            meta={"day": payload["day"]},
+            error=error,
+        )
+
+
+def local_needs(context: DayContext) -> dict:
+    ai_preferences = context.ai_preferences or {}
+    return {
+        "day": context.day,
+        "needs": estimate_daily_needs_from_profile(ai_preferences),
+        "totals": context.totals,
+        "water_ml": estimate_water_target_ml(ai_preferences),
+        "source": "stimato",
+        "note": "Stima basata su dati inseriti e livello di attivita.",
+    }
+
+
+async def build_daily_needs(
+    db: Session,
+    user: User,
+    day: date,
+    context: DayContext | None = None,
+) -> dict:
+    context = context or await run_in_threadpool(load_day_context, db, user, day)
+    return await _daily_needs_flight(user, context)
+
+
+def _daily_needs_flight(user: User, context: DayContext) -> Awaitable[dict]:
+    key = _coalesce_key("daily_needs", user, context)
+    return _inflight.do(key, lambda: _build_daily_needs(user.id, context.day))
+
+
+async def _build_daily_needs(user_id: int, day: date) -> dict:
+    context = await run_in_threadpool(_read_task_context, user_id, day)
+    result = local_needs(context)
+
+    try:
+        insights = await day_insights(user_id, context)
+        candidate = insights.get("needs", {})
+        if sum(candidate.values()) > 0:
+            result["needs"] = candidate
+            result["note"] = insights.get("note") or result["note"]
+            result["source"] = "ai"
     except Exception:
         pass
 
+    return result
+
+
+def _timeline_remaining(context: DayContext) -> dict:
+    targets = context.targets
+    if not targets.get("calories"):
+        targets = estimate_daily_needs_from_profile(context.ai_preferences or {})
+
+    totals = context.totals
     return {
-        "day": day,
-        "needs": needs,
-        "totals": totals,
-        "water_ml": estimate_water_target_ml(ai_preferences),
-        "source": source,
-        "note": note,
+        "calories": max((targets.get("calories") or 0) - totals.get("calories", 0), 0),
+        "proteins": max((targets.get("proteins") or 0) - totals.get("proteins", 0), 0),
+        "carbs": max((targets.get("carbs") or 0) - totals.get("carbs", 0), 0),
+        "fats": max((targets.get("fats") or 0) - totals.get("fats", 0), 0),
     }
 
 
-async def build_timeline(db: Session, user: User, day: date) -> dict:
-    routine = user.routine
+def timeline_result(context: DayContext, guidance: str | None) -> dict:
+    routine = context.routine
+    day = context.day
     if not routine:
         return {"day": day, "phases": [], "guidance": None}
 
@@ -392,54 +618,8 @@ async def build_timeline(db: Session, user: User, day: date) -> dict:
             else:
                 phase_status.append("future")
 
-    totals = aggregate_macros(
-        db.query(Meal)
-        .filter(
-            Meal.user_id == user.id,
-            Meal.consumed_at >= datetime.combine(day, time.min),
-            Meal.consumed_at <= datetime.combine(day, time.max),
-        )
-        .all()
-    )
-
-    ai_preferences = ai_preferences_from_user(user) or {}
-    targets = targets_from_routine(routine)
-    if not targets.get("calories"):
-        targets = estimate_daily_needs_from_profile(ai_preferences)
-
-    remaining = {
-        "calories": max((targets.get("calories") or 0) - totals.get("calories", 0), 0),
-        "proteins": max((targets.get("proteins") or 0) - totals.get("proteins", 0), 0),
-        "carbs": max((targets.get("carbs") or 0) - totals.get("carbs", 0), 0),
-        "fats": max((targets.get("fats") or 0) - totals.get("fats", 0), 0),
-    }
-
-    guidance = None
-    try:
-        timeline_payload = {
-            "day": str(day),
-            "totals": totals,
-            "targets": targets,
-            "remaining": remaining,
-        }
-        guidance = await generate_timeline_guidance(
-            timeline_payload,
-            preferences=ai_preferences,
-        )
-        log_ai_interaction(
-            db,
-            user.id,
-            kind="timeline_guidance",
-            model=ai_preferences.get("text_model"),
-            input_payload=timeline_payload,
-            output_payload={"guidance": guidance},
-            meta={"day": str(day)},
-        )
-    except Exception:
-        guidance = f"Restano circa {round(remaining['calories'])} kcal: privilegia {_macro_focus(remaining)} nei prossimi pasti."
-
     output_phases = []
-    focus = _macro_focus(remaining)
+    focus = _macro_focus(_timeline_remaining(context))
     for (label, phase_time), status in zip(phases, phase_status):
         if status == "current":
             suggestion = f"Focalizzati su {focus}."
@@ -457,3 +637,361 @@ async def build_timeline(db: Session, user: User, day: date) -> dict:
         )
 
     return {"day": day, "phases": output_phases, "guidance": guidance}
+
+
+async def build_timeline(
+    db: Session,
+    user: User,
+    day: date,
+    context: DayContext | None = None,
+) -> dict:
+    context = context or await run_in_threadpool(load_day_context, db, user, day)
+    return await _timeline_flight(user, context)
+
+
+def _timeline_flight(user: User, context: DayContext) -> Awaitable[dict]:
+    key = _coalesce_key("timeline", user, context)
+    return _inflight.do(key, lambda: _build_timeline(user.id, context.day))
+
+
+async def _build_timeline(user_id: int, day: date) -> dict:
+    context = await run_in_threadpool(_read_task_context, user_id, day)
+    if not context.routine:
+        return timeline_result(context, None)
+
+    remaining = _timeline_remaining(context)
+    try:
+        insights = await day_insights(user_id, context)
+        guidance = insights.get("guidance") or None
+    except Exception:
+        guidance = None
+    if not guidance:
+        guidance = f"Restano circa {round(remaining['calories'])} kcal: privilegia {_macro_focus(remaining)} nei prossimi pasti."
+
+    return timeline_result(context, guidance)
+
+
+def build_water_summary(db: Session, user: User, day: date, preferences: dict | None = None) -> dict:
+    start = datetime.combine(day, time.min)
+    end = datetime.combine(day, time.max)
+    entries = (
+        db.query(WaterIntake)
+        .filter(WaterIntake.user_id == user.id, WaterIntake.consumed_at >= start, WaterIntake.consumed_at <= end)
+        .order_by(WaterIntake.consumed_at.asc())
+        .all()
+    )
+    if preferences is None:
+        preferences = ai_preferences_from_user(user) or {}
+
+    return {
+        "day": day,
+        "total_ml": sum(entry.amount_ml for entry in entries),
+        "target_ml": estimate_water_target_ml(preferences),
+        "entries": entries,
+    }
+
+
+async def _dashboard_section(sections: dict, name: str, flight: Awaitable[dict]) -> dict | None:
+    # Nessun accesso al DB qui: i task delle sezioni non condividono la sessione della richiesta.
+    try:
+        # Ogni sezione gira nel proprio task: metriche AI separate da quelle delle altre sezioni.
+        with track_ai_calls(), span("dashboard_section", name=name):
+            result = await asyncio.wait_for(flight, timeout=settings.dashboard_ai_timeout)
+        sections[name] = "ok"
+        return result
+    except asyncio.TimeoutError:
+        sections[name] = "timeout"
+    except Exception:
+        sections[name] = "error"
+    return None
+
+
+async def build_dashboard(
+    db: Session,
+    user: User,
+    day: date,
+    sections: set[str],
+    context: DayContext | None = None,
+    rate_limited: set[str] | None = None,
+) -> dict:
+    # Le query sulla sessione della richiesta girano nel threadpool, una alla volta: mai due thread sulla
+    # stessa sessione, e un'attesa sul pool DB non blocca l'event loop.
+    context = context or await run_in_threadpool(load_day_context, db, user, day)
+    rate_limited = rate_limited or set()
+    status_by_section: dict[str, str] = {}
+    result: dict = {"day": day, "sections": status_by_section}
+
+    # Le sezioni AI girano in parallelo su task con sessioni proprie; le chiavi si calcolano qui, con la
+    # sessione della richiesta, prima del gather. In caso di timeout si restituisce la versione locale.
+    ai_sections = {
+        "summary": (_daily_summary_flight, lambda: summary_snapshot(db, user, context)),
+        "needs": (_daily_needs_flight, lambda: local_needs(context)),
+        "timeline": (_timeline_flight, lambda: timeline_result(context, None)),
+    }
+    requested = [name for name in ai_sections if name in sections]
+    # Le sezioni oltre il budget "ai" non avviano il task: restituiscono subito la versione locale.
+    live = [name for name in requested if name not in rate_limited]
+    status_by_section.update({name: "rate_limited" for name in requested if name in rate_limited})
+    flights = [ai_sections[name][0](user, context) for name in live]
+    outputs = await asyncio.gather(
+        *(_dashboard_section(status_by_section, name, flight) for name, flight in zip(live, flights))
+    )
+    output_by_section = dict(zip(live, outputs))
+    for name in requested:
+        if status_by_section[name] == "ok":
+            result[name] = output_by_section[name]
+        else:
+            result[name] = await run_in_threadpool(ai_sections[name][1])
+
+    if "meals" in sections:
+        result["meals"] = {"day": day, "totals": context.totals, "meals": list(reversed(context.meals))}
+        status_by_section["meals"] = "ok"
+    if "water" in sections:
+        result["water"] = await run_in_threadpool(
+            build_water_summary, db, user, day, preferences=context.ai_preferences or {}
+        )
+        status_by_section["water"] = "ok"
+
+    return result
+
+
+def _comparison_request(db: Session, user: User, photos: list[BodyPhoto]) -> dict:
+    # photos va dalla foto piu' recente alla meno recente. Il confronto dipende dalle foto, dal modello e
+    # dalle impostazioni del prompt: un nuovo upload o una lingua diversa cambiano la chiave.
+    ai_preferences = ai_preferences_from_user(user) or {}
+    model = ai_preferences.get("text_model") or settings.ollama_text_model
+    photo_ids = ",".join(str(photo.id) for photo in photos)
+    prompt_key = input_digest(
+        {key: ai_preferences.get(key) for key in ("response_language", "system_prompt", "reasoning_cycles")}
+    )
+
+    stored = (
+        db.query(BodyPhotoComparison)
+        .filter(
+            BodyPhotoComparison.user_id == user.id,
+            BodyPhotoComparison.photo_ids == photo_ids,
+            BodyPhotoComparison.model == model,
+            BodyPhotoComparison.prompt_key == prompt_key,
+        )
+        .first()
+    )
+    return {
+        "user_id": user.id,
+        "ai_preferences": ai_preferences,
+        "model": model,
+        "photo_ids": photo_ids,
+        "prompt_key": prompt_key,
+        "stored": stored.comparison if stored else None,
+        "snapshots": [
+            {"id": photo.id, "kind": photo.kind, "date": photo.captured_at.isoformat(), "summary": photo.ai_summary}
+            for photo in photos
+        ],
+    }
+
+
+async def compare_photos(db: Session, user: User, photos: list[BodyPhoto]) -> dict:
+    request = await run_in_threadpool(_comparison_request, db, user, photos)
+    record_cache("body_photo_compare", request["stored"] is not None)
+    if request["stored"] is not None:
+        return {"comparison": request["stored"], "cached": True}
+
+    key = ("body_photo_compare", request["user_id"], request["photo_ids"], request["model"], request["prompt_key"])
+    return await _inflight.do(
+        key,
+        lambda: _generate_photo_comparison(
+            request["user_id"],
+            request["snapshots"],
+            request["photo_ids"],
+            request["model"],
+            request["prompt_key"],
+            request["ai_preferences"],
+        ),
+    )
+
+
+async def _generate_photo_comparison(
+    user_id: int,
+    photos: list[dict],
+    photo_ids: str,
+    model: str,
+    prompt_key: str,
+    ai_preferences: dict,
+) -> dict:
+    latest, previous = photos[0], photos[-1]
+    try:
+        if len(photos) == 2:
+            comparison = await compare_body_photos(
+                {
+                    "latest": {"date": latest["date"], "summary": latest["summary"]},
+                    "previous": {"date": previous["date"], "summary": previous["summary"]},
+                },
+                preferences=ai_preferences,
+            )
+        else:
+            comparison = await compare_body_photo_series(
+                {"photos": [{"date": photo["date"], "summary": photo["summary"]} for photo in reversed(photos)]},
+                preferences=ai_preferences,
+            )
+    except Exception as exc:
+        await run_in_threadpool(_log_failed_photo_comparison, user_id, photo_ids, model, exc)
+        return {"comparison": "Confronto non disponibile al momento.", "cached": False}
+
+    await run_in_threadpool(_store_photo_comparison, user_id, photos, photo_ids, model, prompt_key, comparison)
+    return {"comparison": comparison, "cached": False}
+
+
+def _log_failed_photo_comparison(user_id: int, photo_ids: str, model: str, exc: Exception) -> None:
+    with SessionLocal() as db:
+        log_ai_interaction(
+            db,
+            user_id,
+            kind="body_photo_compare",
+            model=model,
+            input_payload={"photo_ids": photo_ids},
+            output_payload=None,
+            error=exc,
+        )
+
+
+def _store_photo_comparison(
+    user_id: int,
+    photos: list[dict],
+    photo_ids: str,
+    model: str,
+    prompt_key: str,
+    comparison: str,
+) -> None:
+    latest, previous = photos[0], photos[-1]
+    with SessionLocal() as db:
+        log_ai_interaction(
+            db,
+            user_id,
+            kind="body_photo_compare",
+            model=model,
+            input_payload={"photo_ids": photo_ids, "latest_id": latest["id"], "previous_id": previous["id"]},
+            output_payload={"comparison": comparison},
+        )
+
+        db.add(
+            BodyPhotoComparison(
+                user_id=user_id,
+                kind=latest["kind"],
+                photo_ids=photo_ids,
+                latest_id=latest["id"],
+                previous_id=previous["id"],
+                model=model,
+                prompt_key=prompt_key,
+                comparison=comparison,
+            )
+        )
+        try:
+            db.commit()
+        except IntegrityError:
+            # Stesso confronto salvato da un'altra richiesta: il risultato e' equivalente.
+            db.rollback()
+
+
+def upload_path_from_url(image_url: str) -> Path:
+    relative = image_url.removeprefix("/static/uploads/")
+    return Path(settings.upload_dir) / relative
+
+
+def parse_routine_time(value: str) -> time | None:
+    if not value:
+        return None
+    value = value.strip()
+    parts = value.split(":")
+    if len(parts) != 2:
+        return None
+    try:
+        hours = int(parts[0])
+        minutes = int(parts[1])
+    except ValueError:
+        return None
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+        return None
+    return time(hours, minutes)
+
+
+def smart_routine_requested(routine: Routine, ai_preferences: dict) -> bool:
+    has_targets = any(
+        value is not None
+        for value in (
+            routine.calorie_target,
+            routine.protein_target,
+            routine.carbs_target,
+            routine.fats_target,
+        )
+    )
+    return bool(ai_preferences.get("smart_routine_enabled")) and (has_targets or bool(ai_preferences.get("goals")))
+
+
+async def optimize_routine(
+    db: Session,
+    user: User,
+    routine: Routine,
+    ai_preferences: dict,
+) -> tuple[bool, str | None]:
+    # Le eccezioni arrivano al chiamante: il job smart_routine deve poter fallire ed essere ritentato.
+    ai_note = None
+    ai_applied = False
+    ai_payload = {
+        "routine": {
+            "breakfast_time": routine.breakfast_time.strftime("%H:%M") if routine.breakfast_time else None,
+            "lunch_time": routine.lunch_time.strftime("%H:%M") if routine.lunch_time else None,
+            "dinner_time": routine.dinner_time.strftime("%H:%M") if routine.dinner_time else None,
+            "day_end_time": routine.day_end_time.strftime("%H:%M") if routine.day_end_time else None,
+        },
+        "targets": {
+            "calorie_target": routine.calorie_target,
+            "protein_target": routine.protein_target,
+            "carbs_target": routine.carbs_target,
+            "fats_target": routine.fats_target,
+        },
+        "profile": ai_preferences,
+    }
+    try:
+        ai_result = await generate_smart_routine(ai_payload, preferences=ai_preferences)
+    except Exception as exc:
+        await run_in_threadpool(
+            log_ai_interaction,
+            db,
+            user.id,
+            kind="smart_routine",
+            model=ai_preferences.get("text_model"),
+            input_payload=ai_payload,
+            output_payload=None,
+            error=exc,
+        )
+        raise
+    if ai_result:
+        updated = False
+        for field in ("breakfast_time", "lunch_time", "dinner_time", "day_end_time"):
+            parsed = parse_routine_time(ai_result.get(field) or "")
+            if parsed:
+                setattr(routine, field, parsed)
+                updated = True
+        for field, key in (
+            ("calorie_target", "calorie_target"),
+            ("protein_target", "protein_target"),
+            ("carbs_target", "carbs_target"),
+            ("fats_target", "fats_target"),
+        ):
+            value = ai_result.get(key)
+            if value and value > 0:
+                setattr(routine, field, value)
+                updated = True
+        ai_note = ai_result.get("note") or "Routine ottimizzata da AI."
+        ai_applied = updated
+        await run_in_threadpool(
+            log_ai_interaction,
+            db,
+            user.id,
+            kind="smart_routine",
+            model=ai_preferences.get("text_model"),
+            input_payload=ai_payload,
+            output_payload=ai_result,
+            meta={"note": ai_note, "applied": ai_applied},
+        )
+
+    return ai_applied, ai_note
@@ -0,0 +1,27 @@
+import asyncio
+import hashlib
+import json
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+def input_digest(payload: Any) -> str:
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: se una richiesta viene annullata le altre in attesa ricevono comunque il risultato.
+        return await asyncio.shield(task)
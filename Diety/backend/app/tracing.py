@@ -0,0 +1,311 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .config import settings
+from .metrics import tracing_spans
+
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 512
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass
+class TraceSpan:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    attrs: dict
+    server: bool = False
+    end_ns: int | None = None
+    error: str | None = None
+
+
+_current_span: ContextVar[TraceSpan | None] = ContextVar("trace_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def tracing_enabled() -> bool:
+    return settings.tracing_exporter in ("file", "otlp")
+
+
+def current_span() -> TraceSpan | None:
+    return _current_span.get()
+
+
+def trace_ids() -> dict:
+    current = _current_span.get()
+    if current is None:
+        return {}
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
+
+
+def current_traceparent() -> str | None:
+    current = _current_span.get()
+    if current is None:
+        return None
+    return f"00-{current.trace_id}-{current.span_id}-01"
+
+
+def start_trace(name: str, attrs: dict, traceparent: str | None = None, server: bool = False) -> TraceSpan | None:
+    if not tracing_enabled():
+        return None
+    match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+    if match:
+        # Decisione di campionamento del chiamante (flag 01 = campionato).
+        if not int(match.group(3), 16) & 1:
+            return None
+        trace_id, parent_id = match.group(1), match.group(2)
+    elif random.random() < settings.tracing_sample_rate:
+        trace_id, parent_id = _new_id(128), None
+    else:
+        return None
+    return TraceSpan(name, trace_id, _new_id(64), parent_id, time.time_ns(), attrs, server=server)
+
+
+def start_span(name: str, attrs: dict) -> TraceSpan | None:
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return TraceSpan(name, parent.trace_id, _new_id(64), parent.span_id, time.time_ns(), attrs)
+
+
+def finish_span(span: TraceSpan, error: str | None = None) -> None:
+    span.end_ns = time.time_ns()
+    span.error = error or span.error or span.attrs.get("error")
+    _exporter().submit(span)
+
+
+@contextmanager
+def _activate(span: TraceSpan):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = type(exc).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        finish_span(span)
+
+
+@contextmanager
+def child_span(name: str, attrs: dict):
+    span = start_span(name, attrs)
+    if span is None:
+        yield None
+        return
+    with _activate(span):
+        yield span
+
+
+@contextmanager
+def trace(name: str, traceparent: str | None = None, **attrs):
+    # Radice di una nuova traccia (es. un job), o continuazione di quella indicata da traceparent.
+    span = start_trace(name, attrs, traceparent)
+    if span is None:
+        yield None
+        return
+    with _activate(span):
+        yield span
+
+
+def _otlp_value(value: object) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attrs: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attrs.items() if value is not None]
+
+
+def encode_otlp(spans: list[TraceSpan]) -> dict:
+    encoded = []
+    for span in spans:
+        item = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # 2 = SERVER, 1 = INTERNAL
+            "kind": 2 if span.server else 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": _otlp_attributes(span.attrs),
+        }
+        if span.parent_id:
+            item["parentSpanId"] = span.parent_id
+        if span.error:
+            item["status"] = {"code": 2, "message": span.error}
+        encoded.append(item)
+    resource = {"service.name": settings.tracing_service_name, "process.pid": os.getpid()}
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes(resource)},
+                "scopeSpans": [{"scope": {"name": "dietly"}, "spans": encoded}],
+            }
+        ]
+    }
+
+
+def _write_file(spans: list[TraceSpan]) -> None:
+    # Una riga OTLP/JSON per lotto (formato del receiver otlpjsonfile del collector).
+    # O_APPEND con una sola write: piu' worker possono scrivere sullo stesso file.
+    line = (json.dumps(encode_otlp(spans), ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(settings.tracing_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def _post_otlp(spans: list[TraceSpan]) -> None:
+    import httpx
+
+    response = httpx.post(settings.tracing_endpoint, json=encode_otlp(spans), timeout=5)
+    response.raise_for_status()
+
+
+_STOP = object()
+
+
+class SpanExporter:
+    def __init__(self, write: Callable[[list[TraceSpan]], None]):
+        self._write = write
+        self._queue: queue.Queue = queue.Queue(maxsize=max(settings.tracing_queue_size, 1))
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, span: TraceSpan) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Meglio perdere span che rallentare le richieste se il collector non risponde.
+            tracing_spans.inc(outcome="dropped")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + settings.tracing_export_interval
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+                tracing_spans.inc(len(batch), outcome="exported")
+            except Exception:
+                tracing_spans.inc(len(batch), outcome="failed")
+                logger.warning("Esportazione di %s span fallita", len(batch), exc_info=True)
+
+    def shutdown(self, timeout: float = 5) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._thread = None
+
+
+_exporters: dict[str, SpanExporter] = {}
+
+
+def _exporter() -> SpanExporter:
+    name = settings.tracing_exporter
+    exporter = _exporters.get(name)
+    if exporter is None:
+        exporter = _exporters.setdefault(name, SpanExporter(_post_otlp if name == "otlp" else _write_file))
+    return exporter
+
+
+def shutdown_tracing() -> None:
+    for exporter in list(_exporters.values()):
+        exporter.shutdown()
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "")
+        root = start_trace(
+            f"{method} {scope.get('path', '')}",
+            {"http.method": method, "http.target": scope.get("path", "")},
+            traceparent=Headers(scope=scope).get("traceparent"),
+            server=True,
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attrs["http.status_code"] = message["status"]
+                # Da citare nelle segnalazioni degli utenti per ritrovare la traccia.
+                MutableHeaders(scope=message).append("X-Trace-Id", root.trace_id)
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as exc:
+            root.error = type(exc).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            # Nome finale con il template della route, come per le metriche.
+            route_path = getattr(scope.get("route"), "path", None)
+            if route_path:
+                root.name = f"{method} {route_path}"
+                root.attrs["http.route"] = route_path
+            if root.attrs.get("http.status_code", 500) >= 500:
+                root.error = root.error or "HTTP 5xx"
+            finish_span(root)
@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import logging
+import signal
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from .ai_metrics import track_ai_calls
+from .config import settings
+from .conversations import turns_to_summarize
+from .database import SessionLocal, engine
+from .jobs import (
+    claim_jobs,
+    complete_job,
+    default_worker_id,
+    fail_job,
+    get_job_handler,
+    job_handler,
+    job_payload,
+)
+from .models import BodyPhoto, ChatConversation, DailySummary, Job, Routine, User
+from .ollama_client import analyze_body_photo, analyze_food_image, summarize_chat_history
+from .query_monitor import report_queries, track_queries
+from .scheduler import run_summary_scheduler
+from .services import (
+    ai_preferences_from_user,
+    build_daily_summary,
+    log_ai_interaction,
+    optimize_routine,
+    smart_routine_requested,
+    upload_path_from_url,
+)
+from .tracing import shutdown_tracing, trace
+
+
+logger = logging.getLogger(__name__)
+
+
+def _load_user(db: Session, payload: dict) -> User:
+    user = db.get(User, payload.get("user_id"))
+    if not user:
+        raise LookupError(f"Utente {payload.get('user_id')} non trovato")
+    return user
+
+
+@job_handler("daily_summary")
+async def handle_daily_summary(db: Session, job: Job, payload: dict) -> dict:
+    user = _load_user(db, payload)
+    day = date.fromisoformat(payload["day"])
+    summary = await build_daily_summary(db, user, day)
+    stored = db.query(DailySummary).filter(DailySummary.user_id == user.id, DailySummary.day == day).first()
+    if summary["is_closed"] and (stored is None or stored.advice is None):
+        # Resoconto AI non generato: il job fallisce e la coda lo ritenta con backoff.
+        raise RuntimeError("Resoconto AI della giornata non disponibile")
+    return {"advice": summary.get("advice")}
+
+
+@job_handler("smart_routine")
+async def handle_smart_routine(db: Session, job: Job, payload: dict) -> dict:
+    user = _load_user(db, payload)
+    routine = db.query(Routine).filter(Routine.user_id == user.id).first()
+    ai_preferences = ai_preferences_from_user(user) or {}
+    if not routine or not smart_routine_requested(routine, ai_preferences):
+        return {"ai_applied": False, "ai_note": None}
+
+    ai_applied, ai_note = await optimize_routine(db, user, routine, ai_preferences)
+    db.commit()
+    return {"ai_applied": ai_applied, "ai_note": ai_note}
+
+
+@job_handler("image_analysis")
+async def handle_image_analysis(db: Session, job: Job, payload: dict) -> dict:
+    user = _load_user(db, payload)
+    file_path = Path(payload["file_path"])
+    ai_preferences = ai_preferences_from_user(user) or {}
+    hint = payload.get("hint") or ""
+
+    image_bytes = file_path.read_bytes()
+    input_payload = {
+        "hint": hint,
+        "file_name": payload.get("file_name"),
+        "content_type": payload.get("content_type"),
+        "size_bytes": len(image_bytes),
+    }
+    try:
+        result = await analyze_food_image(image_bytes, hint, preferences=ai_preferences)
+    except Exception as exc:
+        log_ai_interaction(
+            db,
+            user.id,
+            kind="image_analysis",
+            model=ai_preferences.get("vision_model"),
+            input_payload=input_payload,
+            output_payload=None,
+            meta={"job_id": job.id},
+            error=exc,
+        )
+        raise
+    log_ai_interaction(
+        db,
+        user.id,
+        kind="image_analysis",
+        model=ai_preferences.get("vision_model"),
+        input_payload=input_payload,
+        output_payload=result,
+        meta={"fallback_used": result.get("fallback_used"), "job_id": job.id},
+    )
+    file_path.unlink(missing_ok=True)
+
+    return {
+        "meal_type": result["meal_type"],
+        "food_name": result["food_name"],
+        "calories": result["calories"],
+        "proteins": result["proteins"],
+        "carbs": result["carbs"],
+        "fats": result["fats"],
+        "notes": result["notes"],
+        "confidence": result["confidence"],
+    }
+
+
+@job_handler("body_photo_analysis")
+async def handle_body_photo_analysis(db: Session, job: Job, payload: dict) -> dict:
+    photo = db.get(BodyPhoto, payload.get("photo_id"))
+    if not photo:
+        raise LookupError(f"Foto {payload.get('photo_id')} non trovata")
+
+    photo.analysis_status = "processing"
+    db.commit()
+
+    ai_preferences = ai_preferences_from_user(photo.user) or {}
+    try:
+        image_bytes = upload_path_from_url(photo.image_path).read_bytes()
+        analysis = await analyze_body_photo(image_bytes, kind=photo.kind, preferences=ai_preferences)
+    except Exception as exc:
+        db.rollback()
+        log_ai_interaction(
+            db,
+            photo.user_id,
+            kind="body_photo_analysis",
+            model=ai_preferences.get("vision_model"),
+            input_payload={"kind": photo.kind},
+            output_payload=None,
+            meta={"photo_id": photo.id, "job_id": job.id},
+            error=exc,
+        )
+        last_attempt = job.attempts >= job.max_attempts
+        photo.analysis_status = "failed" if last_attempt else "pending"
+        if last_attempt:
+            photo.ai_summary = "Analisi AI non disponibile per questa foto."
+        db.commit()
+        raise
+
+    photo.ai_summary = analysis.get("summary")
+    photo.ai_payload = analysis.get("raw")
+    photo.analysis_status = "done"
+    db.commit()
+
+    log_ai_interaction(
+        db,
+        photo.user_id,
+        kind="body_photo_analysis",
+        model=ai_preferences.get("vision_model"),
+        input_payload={"kind": photo.kind},
+        output_payload=analysis,
+        meta={"photo_id": photo.id, "job_id": job.id},
+    )
+    return {"photo_id": photo.id, "summary": photo.ai_summary}
+
+
+@job_handler("chat_summary")
+async def handle_chat_summary(db: Session, job: Job, payload: dict) -> dict:
+    conversation = db.get(ChatConversation, payload.get("conversation_id"))
+    if not conversation:
+        raise LookupError(f"Conversazione {payload.get('conversation_id')} non trovata")
+
+    turns = turns_to_summarize(db, conversation)
+    if not turns:
+        return {"summarized_until_id": conversation.summarized_until_id}
+
+    ai_preferences = ai_preferences_from_user(conversation.user) or {}
+    summary_input = {
+        "previous_summary": conversation.summary,
+        "messages": [{"role": turn.role, "content": turn.content} for turn in turns],
+    }
+    try:
+        summary = await summarize_chat_history(summary_input, preferences=ai_preferences)
+    except Exception as exc:
+        log_ai_interaction(
+            db,
+            conversation.user_id,
+            kind="chat_summary",
+            model=ai_preferences.get("text_model"),
+            input_payload=summary_input,
+            output_payload=None,
+            meta={"conversation_id": conversation.id, "job_id": job.id},
+            error=exc,
+        )
+        raise
+    conversation.summary = summary.strip()
+    conversation.summarized_until_id = turns[-1].id
+    db.commit()
+
+    log_ai_interaction(
+        db,
+        conversation.user_id,
+        kind="chat_summary",
+        model=ai_preferences.get("text_model"),
+        input_payload=summary_input,
+        output_payload={"summary": conversation.summary},
+        meta={"conversation_id": conversation.id, "job_id": job.id},
+    )
+    return {"summarized_until_id": conversation.summarized_until_id}
+
+
+class Worker:
+    def __init__(
+        self,
+        concurrency: int,
+        poll_interval: float,
+        kinds: list[str] | None = None,
+        worker_id: str | None = None,
+    ):
+        self.concurrency = max(concurrency, 1)
+        self.poll_interval = poll_interval
+        self.kinds = kinds
+        self.worker_id = worker_id or default_worker_id()
+        self._stopping = asyncio.Event()
+        self._active: set[asyncio.Task] = set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _claim(self, limit: int) -> list[int]:
+        db = SessionLocal()
+        try:
+            return [job.id for job in claim_jobs(db, self.worker_id, limit, self.kinds)]
+        except Exception:
+            logger.exception("Impossibile leggere la coda dei job")
+            db.rollback()
+            return []
+        finally:
+            db.close()
+
+    async def _execute(self, job_id: int) -> None:
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            if job is None:
+                return
+            handler = get_job_handler(job.kind)
+            if handler is None:
+                job.attempts = job.max_attempts
+                fail_job(db, job, f"Tipo di job sconosciuto: {job.kind}")
+                return
+
+            payload = job_payload(job)
+            with track_queries() as query_stats:
+                try:
+                    # Con il traceparent salvato da enqueue_job il job continua la traccia della richiesta.
+                    with track_ai_calls(), trace(
+                        f"job {job.kind}",
+                        traceparent=payload.get("traceparent"),
+                        **{"job.id": job.id, "job.kind": job.kind, "job.attempt": job.attempts},
+                    ):
+                        result = await asyncio.wait_for(
+                            handler(db, job, payload),
+                            timeout=settings.job_visibility_timeout,
+                        )
+                except Exception as exc:
+                    db.rollback()
+                    logger.warning("Job %s (%s) fallito al tentativo %s: %r", job.id, job.kind, job.attempts, exc)
+                    fail_job(db, job, repr(exc))
+                    return
+                finally:
+                    report_queries(query_stats, f"job:{job.kind}")
+                complete_job(db, job, result)
+        finally:
+            db.close()
+
+    async def run(self) -> None:
+        logger.info("Worker %s avviato (concorrenza %s)", self.worker_id, self.concurrency)
+        while not self._stopping.is_set():
+            free_slots = self.concurrency - len(self._active)
+            claimed = self._claim(free_slots) if free_slots > 0 else []
+            for job_id in claimed:
+                task = asyncio.create_task(self._execute(job_id))
+                self._active.add(task)
+                task.add_done_callback(self._active.discard)
+
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Lasciamo terminare i job in corso prima di uscire.
+        await asyncio.gather(*self._active, return_exceptions=True)
+        logger.info("Worker %s arrestato", self.worker_id)
+
+
+async def run_worker(args: argparse.Namespace) -> None:
+    worker = Worker(
+        concurrency=args.concurrency,
+        poll_interval=args.poll_interval,
+        kinds=args.kinds.split(",") if args.kinds else None,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    tasks = [asyncio.create_task(worker.run())]
+    scheduler_task = None
+    if settings.summary_scheduler_enabled and not args.no_scheduler:
+        scheduler_task = asyncio.create_task(run_summary_scheduler(settings.summary_scheduler_interval))
+
+    await asyncio.gather(*tasks)
+    if scheduler_task:
+        scheduler_task.cancel()
+        await asyncio.gather(scheduler_task, return_exceptions=True)
+    shutdown_tracing()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dietly background job worker")
+    parser.add_argument("--concurrency", type=int, default=settings.job_worker_concurrency)
+    parser.add_argument("--poll-interval", type=float, default=settings.job_poll_interval)
+    parser.add_argument("--kinds", default="", help="Tipi di job da processare, separati da virgola")
+    parser.add_argument("--no-scheduler", action="store_true", help="Non pianificare i riepiloghi di fine giornata")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if engine.dialect.name == "sqlite" and settings.job_worker_processes > 1:
+        logger.warning(
+            "SQLite non supporta SELECT ... FOR UPDATE SKIP LOCKED: con JOB_WORKER_PROCESSES=%s piu' worker "
+            "possono eseguire lo stesso job. Usa un solo processo worker oppure MySQL/PostgreSQL.",
+            settings.job_worker_processes,
+        )
+    asyncio.run(run_worker(args))
+
+
+if __name__ == "__main__":
+    main()
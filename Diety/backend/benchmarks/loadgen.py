@@ -0,0 +1,132 @@
+import asyncio
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# (metodo, path, kwargs per httpx) per l'i-esima richiesta.
+RequestFactory = Callable[[int], tuple[str, str, dict]]
+
+
+def _latency_summary(values: list[float]) -> dict:
+    return {
+        "mean": round(statistics.fmean(values), 2) if values else 0.0,
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values, default=0.0), 2),
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@dataclass
+class LoadResult:
+    duration: float
+    latencies_ms: list[float] = field(default_factory=list)
+    statuses: dict[int, int] = field(default_factory=dict)
+    routes: dict[str, list[float]] = field(default_factory=dict)
+    errors: int = 0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies_ms)
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration if self.duration else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "throughput_rps": round(self.throughput, 1),
+            "latency_ms": _latency_summary(self.latencies_ms),
+            "routes": {
+                route: {"requests": len(values), **_latency_summary(values)}
+                for route, values in sorted(self.routes.items())
+            },
+        }
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    request_factory: RequestFactory,
+    concurrency: int,
+    duration: float,
+) -> LoadResult:
+    # Carico a ciclo chiuso: `concurrency` utenti virtuali, ognuno invia la richiesta successiva appena riceve la risposta.
+    deadline = time.perf_counter() + duration
+    result = LoadResult(duration=duration)
+    counter = 0
+
+    async def virtual_user() -> None:
+        nonlocal counter
+        while time.perf_counter() < deadline:
+            index = counter
+            counter += 1
+            method, path, kwargs = request_factory(index)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+            except httpx.HTTPError:
+                result.errors += 1
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            result.latencies_ms.append(elapsed_ms)
+            result.routes.setdefault(f"{method} {path.split('?')[0]}", []).append(elapsed_ms)
+            result.statuses[response.status_code] = result.statuses.get(response.status_code, 0) + 1
+            if response.status_code >= 500:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(max(concurrency, 1))))
+    result.duration = time.perf_counter() - started
+    return result
+
+
+async def wait_until_ready(base_url: str, path: str = "/health/live", timeout: float = 60) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get(path)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{base_url}{path} non risponde entro {timeout}s")
+
+
+def start_process(module: str, *args: str, env: dict | None = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", module, *args],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
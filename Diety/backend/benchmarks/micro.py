@@ -0,0 +1,275 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from app.models import Meal
+from app.ollama_client import (
+    CALORIES_KEYS,
+    OllamaServiceError,
+    _extract_analysis_fields,
+    _extract_json_block,
+    _find_value_by_keys,
+    _safe_float,
+)
+from app.services import aggregate_macros, estimate_daily_needs_from_profile
+
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+FIXTURES = json.loads((BENCHMARKS_DIR / "fixtures" / "model_outputs.json").read_text())
+BASELINE_FILE = BENCHMARKS_DIR / "baseline_micro.json"
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    func: Callable[[], object]
+    # Dimensione dell'input per i controlli di complessita' (stessa famiglia = stesso prefisso prima di "[").
+    size: int | None = None
+
+
+def _meals(count: int) -> list[Meal]:
+    rng = random.Random(count)
+    start = datetime(2026, 1, 1, 7)
+    return [
+        Meal(
+            user_id=1,
+            meal_type="snack",
+            food_name="Spuntino",
+            consumed_at=start + timedelta(minutes=index),
+            calories=rng.uniform(50, 900),
+            proteins=rng.uniform(0, 40),
+            carbs=rng.choice([None, rng.uniform(0, 120)]),
+            fats=rng.uniform(0, 35),
+        )
+        for index in range(count)
+    ]
+
+
+PROFILES = [
+    {
+        "weight_kg": 72,
+        "height_cm": 178,
+        "age_years": 34,
+        "sex": "uomo",
+        "activity_level": "moderate",
+        "goals": "Perdere 5 kg mantenendo la massa muscolare",
+    },
+    {
+        "weight_kg": 58,
+        "height_cm": 163,
+        "age_years": 41,
+        "sex": "donna",
+        "activity_level": "light",
+        "goals": "Mantenimento",
+    },
+    {"weight_kg": None, "height_cm": None, "age_years": None, "sex": "", "activity_level": None, "goals": None},
+    {
+        "weight_kg": 95,
+        "height_cm": 190,
+        "age_years": 23,
+        "sex": "male",
+        "activity_level": "very_active",
+        "goals": "Aumentare massa, allenamento 5 volte a settimana",
+    },
+]
+
+
+SAFE_FLOAT_INPUTS = [
+    620,
+    14.5,
+    "620 kcal",
+    "12,5 g",
+    "circa 30-35 g",
+    {"value": "410"},
+    {"amount": {"estimate": "22 g"}},
+    None,
+    "n/d",
+    "",
+]
+
+
+def _safe_float_batch() -> None:
+    for value in SAFE_FLOAT_INPUTS:
+        _safe_float(value)
+
+
+def _extract_json_or_error(text: str) -> Callable[[], object]:
+    def run() -> object:
+        try:
+            return _extract_json_block(text)
+        except OllamaServiceError:
+            return None
+
+    return run
+
+
+def build_benchmarks() -> list[Benchmark]:
+    parsed = {name: _extract_json_block(text) for name, text in FIXTURES.items() if name != "no_json_text"}
+    benchmarks = []
+    for count in (10, 100, 1000):
+        meals = _meals(count)
+        benchmarks.append(Benchmark(f"aggregate_macros[{count}]", lambda meals=meals: aggregate_macros(meals), count))
+    for index, profile in enumerate(PROFILES):
+        benchmarks.append(
+            Benchmark(
+                f"estimate_daily_needs_from_profile[{index}]",
+                lambda profile=profile: estimate_daily_needs_from_profile(profile),
+            )
+        )
+    benchmarks.append(Benchmark("_safe_float[mixed]", _safe_float_batch))
+    for name, payload in parsed.items():
+        benchmarks.append(
+            Benchmark(f"_extract_analysis_fields[{name}]", lambda payload=payload: _extract_analysis_fields(payload))
+        )
+        benchmarks.append(
+            Benchmark(
+                f"_find_value_by_keys[{name}]",
+                lambda payload=payload: _find_value_by_keys(payload, CALORIES_KEYS),
+            )
+        )
+    for name, text in FIXTURES.items():
+        benchmarks.append(Benchmark(f"_extract_json_block[{name}]", _extract_json_or_error(text)))
+    # Stesso fixture ripetuto N volte in una lista: la ricerca deve crescere in modo lineare.
+    for count in (10, 100, 1000):
+        payload = {"items": [parsed["meal_nested_it"]] * count}
+        benchmarks.append(
+            Benchmark(
+                f"_find_value_by_keys_miss[{count}]",
+                lambda payload=payload: _find_value_by_keys(payload, {"chiaveassente"}),
+                count,
+            )
+        )
+    return benchmarks
+
+
+def _calibrated_timer(func: Callable[[], object], min_time: float) -> tuple[timeit.Timer, int]:
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    # Iterazioni per un campione di circa `min_time` secondi.
+    return timer, max(1, int(number * min_time / elapsed))
+
+
+def _calibration_workload() -> None:
+    # Carico fisso di Python puro: i tempi salvati sono relativi a questo, confrontabili tra macchine diverse.
+    total = 0
+    for index in range(2000):
+        total += index * index % 7
+    json.loads(json.dumps({"values": list(range(50))}))
+
+
+def run(benchmarks: list[Benchmark], repeat: int, min_time: float, rounds: int) -> dict:
+    calibration, calibration_number = _calibrated_timer(_calibration_workload, min_time)
+    timers = {benchmark.name: _calibrated_timer(benchmark.func, min_time) for benchmark in benchmarks}
+    best_us: dict[str, float] = {}
+    best_relative: dict[str, float] = {}
+    best_calibration = float("inf")
+    # Piu' giri alternati e calibrazione misurata accanto a ogni benchmark: le variazioni di velocita'
+    # della macchina (frequenza, vicini rumorosi) pesano allo stesso modo su entrambi i tempi.
+    for _ in range(max(rounds, 1)):
+        for benchmark in benchmarks:
+            calibration_us = min(calibration.repeat(repeat, calibration_number)) / calibration_number * 1_000_000
+            timer, number = timers[benchmark.name]
+            # Il minimo e' il campione meno disturbato da altri processi (come consigliato da timeit).
+            per_call = min(timer.repeat(repeat, number)) / number * 1_000_000
+            best_calibration = min(best_calibration, calibration_us)
+            best_us[benchmark.name] = min(best_us.get(benchmark.name, per_call), per_call)
+            relative = per_call / calibration_us
+            best_relative[benchmark.name] = min(best_relative.get(benchmark.name, relative), relative)
+
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = {
+            "us": round(best_us[benchmark.name], 3),
+            "relative": round(best_relative[benchmark.name], 5),
+        }
+        print(f"{benchmark.name:<60} {best_us[benchmark.name]:>12.3f} us", flush=True)
+    return {
+        "python": platform.python_version(),
+        "calibration_us": round(best_calibration, 3),
+        "results": results,
+    }
+
+
+def check_regressions(report: dict, baseline: dict, tolerance: float) -> dict[str, str]:
+    failures = {}
+    for name, result in report["results"].items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        limit = reference["relative"] * (1 + tolerance)
+        if result["relative"] > limit:
+            change = (result["relative"] / reference["relative"] - 1) * 100
+            failures[name] = f"{name}: +{change:.0f}% rispetto alla baseline (tolleranza {tolerance:.0%})"
+    return failures
+
+
+def check_complexity(report: dict, benchmarks: list[Benchmark], max_growth: float) -> list[str]:
+    # Tempo per elemento tra la taglia piu' piccola e la piu' grande: se cresce molto, l'algoritmo non e' lineare.
+    families: dict[str, list[Benchmark]] = {}
+    for benchmark in benchmarks:
+        if benchmark.size and benchmark.name in report["results"]:
+            families.setdefault(benchmark.name.split("[", 1)[0], []).append(benchmark)
+    failures = []
+    for family, members in families.items():
+        if len(members) < 2:
+            continue
+        members.sort(key=lambda item: item.size)
+        smallest, largest = members[0], members[-1]
+        per_item_small = report["results"][smallest.name]["us"] / smallest.size
+        per_item_large = report["results"][largest.name]["us"] / largest.size
+        growth = per_item_large / per_item_small
+        if growth > max_growth:
+            failures.append(
+                f"{family}: tempo per elemento x{growth:.1f} da {smallest.size} a {largest.size} elementi"
+            )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark delle funzioni pure di services e ollama_client")
+    parser.add_argument("--filter", default="", help="Esegue solo i benchmark che contengono questo testo")
+    parser.add_argument("--repeat", type=int, default=3, help="Campioni per giro")
+    parser.add_argument("--rounds", type=int, default=3, help="Giri alternati su tutti i benchmark")
+    parser.add_argument("--min-time", type=float, default=0.03, help="Secondi per campione")
+    parser.add_argument("--check", action="store_true", help="Fallisce se un benchmark regredisce rispetto alla baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Regressione relativa ammessa (0.5 = +50%%)")
+    parser.add_argument("--max-growth", type=float, default=3.0, help="Crescita ammessa del tempo per elemento")
+    parser.add_argument("--update-baseline", action="store_true", help=f"Riscrive {BASELINE_FILE.name}")
+    parser.add_argument("--output", help="Salva il report in JSON")
+    args = parser.parse_args()
+
+    benchmarks = [benchmark for benchmark in build_benchmarks() if args.filter in benchmark.name]
+    report = run(benchmarks, args.repeat, args.min_time, args.rounds)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.update_baseline:
+        BASELINE_FILE.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline aggiornata: {BASELINE_FILE}")
+        return
+
+    failures = check_complexity(report, benchmarks, args.max_growth)
+    if args.check:
+        baseline = json.loads(BASELINE_FILE.read_text())
+        regressions = check_regressions(report, baseline, args.tolerance)
+        if regressions:
+            # Conferma con il doppio dei giri: su macchine condivise un singolo picco non basta a fallire.
+            suspects = [benchmark for benchmark in benchmarks if benchmark.name in regressions]
+            print(f"Ripeto {len(suspects)} benchmark sopra la soglia...", flush=True)
+            retry = run(suspects, args.repeat, args.min_time, args.rounds * 2)
+            regressions = check_regressions(retry, baseline, args.tolerance)
+        failures += list(regressions.values())
+    for failure in failures:
+        print(f"REGRESSIONE {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class MockConfig:
+    models: list[str] = field(default_factory=lambda: ["mistral:latest", "llava:latest"])
+    latency_ms: float = 150
+    jitter_ms: float = 50
+    tokens_per_second: float = 40
+    prompt_tokens_per_second: float = 800
+    output_tokens: int = 120
+    # Primo utilizzo di un modello: simula il caricamento in memoria (load_duration).
+    load_ms: float = 0
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 300
+    # JSON circondato da testo libero (percorso di fallback di _extract_json_block).
+    wrapped_json_rate: float = 0.0
+    # Nessun JSON nella risposta: l'app deve ricadere sui default o restituire errore.
+    non_json_rate: float = 0.0
+    seed: int | None = None
+
+
+FOOD_NAMES = ["Pasta al pomodoro", "Insalata di pollo", "Risotto ai funghi", "Salmone con verdure", "Yogurt e frutta"]
+SENTENCE = (
+    "Ottimo equilibrio tra proteine e carboidrati, ricordati di bere acqua e di inserire verdure "
+    "nel prossimo pasto per aumentare le fibre."
+)
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _prompt_text(body: dict) -> str:
+    if "messages" in body:
+        return "\n".join(str(message.get("content", "")) for message in body.get("messages") or [])
+    return str(body.get("prompt", ""))
+
+
+def _structured_output(rng: random.Random) -> dict:
+    # Unione dei campi letti dai vari prompt JSON (pasto, fabbisogno, routine, foto corporee).
+    calories = rng.randint(250, 900)
+    return {
+        "food_name": rng.choice(FOOD_NAMES),
+        "meal_type": rng.choice(["breakfast", "lunch", "dinner", "snack"]),
+        "calories": calories,
+        "proteins": round(calories * rng.uniform(0.03, 0.08), 1),
+        "carbs": round(calories * rng.uniform(0.08, 0.14), 1),
+        "fats": round(calories * rng.uniform(0.02, 0.05), 1),
+        "notes": SENTENCE,
+        "confidence": round(rng.uniform(0.5, 0.95), 2),
+        "needs": {"calories": 2100, "proteins": 120, "carbs": 250, "fats": 70, "note": "Stima dal profilo"},
+        "guidance": SENTENCE,
+        "advice": "\n".join([SENTENCE] * 3),
+        "summary": "Postura corretta, tono muscolare in miglioramento.",
+        "body_fat_estimate": "18-20%",
+        "muscle_tone": "medio",
+        "posture": "buona",
+        "breakfast_time": "07:30",
+        "lunch_time": "13:00",
+        "dinner_time": "20:00",
+        "day_end_time": "22:30",
+        "calorie_target": 2100,
+        "protein_target": 120,
+        "carbs_target": 250,
+        "fats_target": 70,
+        "note": "Routine ottimizzata.",
+    }
+
+
+def _free_text(tokens: int) -> str:
+    words = SENTENCE.split()
+    return " ".join(words[index % len(words)] for index in range(max(tokens, 1)))
+
+
+def _render_output(body: dict, config: MockConfig, rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < config.non_json_rate:
+        return _free_text(config.output_tokens)
+    if body.get("format") != "json":
+        return _free_text(config.output_tokens)
+    payload = json.dumps(_structured_output(rng), ensure_ascii=False)
+    if roll < config.non_json_rate + config.wrapped_json_rate:
+        return f"Ecco l'analisi richiesta:\n```json\n{payload}\n```\nSpero sia utile!"
+    return payload
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Ollama")
+    rng = random.Random(config.seed)
+    loaded: set[str] = set()
+    stats = {"requests": 0, "errors": 0, "timeouts": 0}
+
+    async def _respond(body: dict, endpoint: str) -> JSONResponse:
+        stats["requests"] += 1
+        roll = rng.random()
+        if roll < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": "mock: errore iniettato"}, status_code=500)
+        if roll < config.error_rate + config.timeout_rate:
+            stats["timeouts"] += 1
+            await asyncio.sleep(config.hang_seconds)
+
+        started = time.perf_counter_ns()
+        model = str(body.get("model") or "")
+        load_ms = 0.0
+        if model not in loaded:
+            loaded.add(model)
+            load_ms = config.load_ms
+
+        output = _render_output(body, config, rng)
+        prompt_tokens = _estimate_tokens(_prompt_text(body))
+        output_tokens = max(config.output_tokens, _estimate_tokens(output))
+        prompt_ms = prompt_tokens / config.prompt_tokens_per_second * 1000
+        eval_ms = output_tokens / config.tokens_per_second * 1000
+        wait_ms = config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)
+        await asyncio.sleep(max(load_ms + prompt_ms + eval_ms + wait_ms, 0) / 1000)
+
+        timings = {
+            "model": model,
+            "done": True,
+            "total_duration": time.perf_counter_ns() - started,
+            "load_duration": int(load_ms * 1_000_000),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_ms * 1_000_000),
+            "eval_count": output_tokens,
+            "eval_duration": int(eval_ms * 1_000_000),
+        }
+        if endpoint == "chat":
+            return JSONResponse({"message": {"role": "assistant", "content": output}, **timings})
+        return JSONResponse({"response": output, **timings})
+
+    @app.get("/api/tags")
+    async def tags() -> dict:
+        return {"models": [{"name": name, "model": name} for name in config.models]}
+
+    @app.get("/api/ps")
+    async def running() -> dict:
+        return {"models": [{"name": name, "model": name} for name in sorted(loaded)]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request) -> JSONResponse:
+        return await _respond(await request.json(), "generate")
+
+    @app.post("/api/chat")
+    async def chat(request: Request) -> JSONResponse:
+        return await _respond(await request.json(), "chat")
+
+    @app.get("/mock/stats")
+    async def mock_stats() -> dict:
+        return stats
+
+    return app
+
+
+def main() -> None:
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="Server Ollama finto per benchmark e test di carico")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--models", default=",".join(defaults.models))
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=defaults.prompt_tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--load-ms", type=float, default=defaults.load_ms)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--timeout-rate", type=float, default=defaults.timeout_rate)
+    parser.add_argument("--hang-seconds", type=float, default=defaults.hang_seconds)
+    parser.add_argument("--wrapped-json-rate", type=float, default=defaults.wrapped_json_rate)
+    parser.add_argument("--non-json-rate", type=float, default=defaults.non_json_rate)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        models=[name.strip() for name in args.models.split(",") if name.strip()],
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        output_tokens=args.output_tokens,
+        load_ms=args.load_ms,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        wrapped_json_rate=args.wrapped_json_rate,
+        non_json_rate=args.non_json_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
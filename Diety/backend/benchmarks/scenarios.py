@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+import httpx
+
+from .loadgen import BACKEND_DIR, RequestFactory, run_load, start_process, stop_process, wait_until_ready
+from .seed import sample_image
+
+
+@dataclass(frozen=True)
+class Scenario:
+    description: str
+    concurrency: int
+    duration: float
+    # Prepara lo stato per utente (es. conversazioni) e restituisce la factory delle richieste.
+    build: Callable[[httpx.AsyncClient, list[dict], random.Random], Awaitable[RequestFactory]]
+
+
+def _auth(user: dict) -> dict:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+async def _dashboard(client: httpx.AsyncClient, users: list[dict], rng: random.Random) -> RequestFactory:
+    # Un client che tiene aperta la home: dashboard ogni pochi secondi, acqua e timeline a rotazione.
+    paths = itertools.cycle(["/api/dashboard", "/api/dashboard", "/api/water", "/api/summary/timeline"])
+
+    def next_request(index: int) -> tuple[str, str, dict]:
+        return "GET", next(paths), {"headers": _auth(users[index % len(users)])}
+
+    return next_request
+
+
+async def _meal_logging(client: httpx.AsyncClient, users: list[dict], rng: random.Random) -> RequestFactory:
+    foods = ["Pasta al pomodoro", "Insalata di pollo", "Yogurt e frutta", "Panino integrale", "Zuppa di legumi"]
+
+    def next_request(index: int) -> tuple[str, str, dict]:
+        headers = _auth(users[index % len(users)])
+        if index % 3 == 2:
+            return "GET", f"/api/meals?day={date.today().isoformat()}", {"headers": headers}
+        calories = rng.randint(150, 850)
+        meal = {
+            "meal_type": rng.choice(["breakfast", "lunch", "dinner", "snack"]),
+            "food_name": rng.choice(foods),
+            "calories": calories,
+            "proteins": round(calories * 0.05, 1),
+            "carbs": round(calories * 0.11, 1),
+            "fats": round(calories * 0.03, 1),
+        }
+        return "POST", "/api/meals", {"headers": headers, "json": meal}
+
+    return next_request
+
+
+async def _image_burst(client: httpx.AsyncClient, users: list[dict], rng: random.Random) -> RequestFactory:
+    # Poche immagini pre-generate: la dimensione conta (upload, base64), il contenuto no.
+    images = [sample_image(rng.randint(80_000, 400_000), rng) for _ in range(4)]
+
+    def next_request(index: int) -> tuple[str, str, dict]:
+        files = {"image": ("pasto.jpg", images[index % len(images)], "image/jpeg")}
+        return (
+            "POST",
+            "/api/meals/analyze-image",
+            {"headers": _auth(users[index % len(users)]), "files": files, "data": {"hint": "pranzo"}},
+        )
+
+    return next_request
+
+
+async def _chat(client: httpx.AsyncClient, users: list[dict], rng: random.Random) -> RequestFactory:
+    messages = [
+        "Cosa posso mangiare a cena per restare nei macro?",
+        "Ho saltato il pranzo, come recupero?",
+        "Mi consigli uno spuntino proteico?",
+        "Quanta acqua dovrei bere ancora oggi?",
+    ]
+    # Una conversazione per utente, come un client reale che continua la stessa chat.
+    conversations = {}
+    for user in users:
+        response = await client.post("/api/chat", json={"message": messages[0]}, headers=_auth(user))
+        if response.status_code == 200:
+            conversations[user["id"]] = response.json().get("conversation_id")
+
+    def next_request(index: int) -> tuple[str, str, dict]:
+        user = users[index % len(users)]
+        body = {"message": rng.choice(messages), "conversation_id": conversations.get(user["id"])}
+        return "POST", "/api/chat", {"headers": _auth(user), "json": body}
+
+    return next_request
+
+
+# Concorrenze predefinite sotto DB_POOL_SIZE + DB_MAX_OVERFLOW (15): oltre, le richieste che attendono Ollama
+# tengono occupate le connessioni e le altre aspettano nel threadpool un checkout fino al pool timeout (503).
+SCENARIOS = {
+    "dashboard": Scenario("Polling della dashboard", concurrency=12, duration=20, build=_dashboard),
+    "meals": Scenario("Registrazione e lettura pasti", concurrency=12, duration=20, build=_meal_logging),
+    "image": Scenario("Burst di analisi immagini", concurrency=12, duration=10, build=_image_burst),
+    "chat": Scenario("Chat con conversazione persistente", concurrency=8, duration=20, build=_chat),
+}
+
+
+async def run_scenarios(args: argparse.Namespace, base_url: str, users: list[dict]) -> dict:
+    rng = random.Random(args.seed)
+    users = users[: args.max_users] if args.max_users else users
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    report = {}
+    for name in names:
+        scenario = SCENARIOS[name]
+        concurrency = args.concurrency or scenario.concurrency
+        duration = args.duration or scenario.duration
+        # Client nuovo per scenario: niente connessioni keep-alive gia' chiuse dal server tra uno scenario e l'altro.
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            next_request = await scenario.build(client, users, rng)
+            result = await run_load(client, next_request, concurrency, duration)
+        report[name] = {"description": scenario.description, "concurrency": concurrency, **result.as_dict()}
+        latency = report[name]["latency_ms"]
+        print(
+            f"{name:<10} rps={report[name]['throughput_rps']:<8} p50={latency['p50']}ms "
+            f"p95={latency['p95']}ms p99={latency['p99']}ms errors={report[name]['errors']}",
+            flush=True,
+        )
+    return report
+
+
+async def run_local(args: argparse.Namespace) -> dict:
+    # Stack completo usa e getta: Ollama finto, SQLite temporaneo popolato, app.serve.
+    workdir = tempfile.mkdtemp(prefix="dietly-bench-")
+    mock_port, app_port = args.mock_port, args.port
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{workdir}/dietly.db",
+        UPLOAD_DIR=f"{workdir}/uploads",
+        OLLAMA_BASE_URL=f"http://127.0.0.1:{mock_port}",
+        OLLAMA_HEALTH_INTERVAL="0",
+        # Pochi utenti di prova generano molte richieste a testa: il rate limit falserebbe le latenze.
+        RATE_LIMIT_ENABLED="false",
+    )
+    users_file = Path(workdir) / "users.json"
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.seed", "--users", str(args.seed_users), "--output", str(users_file)],
+        cwd=BACKEND_DIR,
+        env=env,
+        check=True,
+    )
+    mock = start_process("benchmarks.mock_ollama", "--port", str(mock_port), *args.mock_args.split(), env=env)
+    server = start_process("app.serve", "--port", str(app_port), "--workers", str(args.workers), env=env)
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{mock_port}", "/api/tags")
+        await wait_until_ready(f"http://127.0.0.1:{app_port}")
+        users = json.loads(users_file.read_text())
+        return await run_scenarios(args, f"http://127.0.0.1:{app_port}", users)
+    finally:
+        stop_process(server)
+        stop_process(mock)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scenari di carico con percentili di latenza")
+    parser.add_argument("--scenario", default="all", help=f"all oppure elenco tra: {', '.join(SCENARIOS)}")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users-file", default="benchmarks/out/users.json", help="Output di benchmarks.seed")
+    parser.add_argument("--max-users", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=0, help="Sostituisce quella dello scenario")
+    parser.add_argument("--duration", type=float, default=0, help="Secondi; sostituisce quella dello scenario")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Salva il report in JSON")
+    parser.add_argument("--local", action="store_true", help="Avvia mock Ollama, database e server temporanei")
+    parser.add_argument("--workers", type=int, default=1, help="Con --local: worker di app.serve")
+    parser.add_argument("--port", type=int, default=18200, help="Con --local: porta di app.serve")
+    parser.add_argument("--mock-port", type=int, default=11500, help="Con --local: porta del mock Ollama")
+    parser.add_argument("--mock-args", default="", help="Con --local: opzioni per benchmarks.mock_ollama")
+    parser.add_argument("--seed-users", type=int, default=50, help="Con --local: utenti da creare")
+    args = parser.parse_args()
+
+    if args.local:
+        report = asyncio.run(run_local(args))
+    else:
+        users = json.loads(Path(args.users_file).read_text())
+        report = asyncio.run(run_scenarios(args, args.base_url, users))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
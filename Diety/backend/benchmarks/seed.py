@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+from app.auth import create_access_token, hash_password
+from app.config import settings
+from app.database import SessionLocal
+from app.migrations import migrate
+from app.models import AISettings, BodyPhoto, Meal, Routine, User, WaterIntake
+
+
+MEAL_SLOTS = [
+    ("breakfast", time(7, 45), ["Yogurt greco e frutti di bosco", "Porridge di avena", "Pane integrale e marmellata"]),
+    ("lunch", time(13, 0), ["Pasta al pomodoro", "Insalata di pollo", "Riso con verdure"]),
+    ("snack", time(16, 30), ["Mela", "Frutta secca", "Barretta proteica"]),
+    ("dinner", time(20, 0), ["Salmone con patate", "Frittata di zucchine", "Zuppa di legumi"]),
+]
+
+
+def sample_image(size_bytes: int, rng: random.Random | None = None) -> bytes:
+    # Intestazione e chiusura JPEG attorno a byte casuali: l'app non decodifica le immagini, ne controlla solo il tipo.
+    rng = rng or random.Random()
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(max(size_bytes - 6, 0)) + b"\xff\xd9"
+
+
+def _meals_for_day(rng: random.Random, user_id: int, day: datetime, meals_per_day: int) -> list[Meal]:
+    meals = []
+    for index in range(meals_per_day):
+        meal_type, at, names = MEAL_SLOTS[index % len(MEAL_SLOTS)]
+        calories = rng.randint(150, 850)
+        meals.append(
+            Meal(
+                user_id=user_id,
+                meal_type=meal_type,
+                food_name=rng.choice(names),
+                consumed_at=datetime.combine(day.date(), at) + timedelta(minutes=rng.randint(-30, 30) + index),
+                calories=calories,
+                proteins=round(calories * rng.uniform(0.03, 0.08), 1),
+                carbs=round(calories * rng.uniform(0.08, 0.14), 1),
+                fats=round(calories * rng.uniform(0.02, 0.05), 1),
+                source=rng.choice(["manual", "manual", "ai"]),
+            )
+        )
+    return meals
+
+
+def _photos_for_user(rng: random.Random, user_id: int, count: int, image_bytes: int, now: datetime) -> list[BodyPhoto]:
+    user_dir = Path(settings.upload_dir) / "body" / str(user_id)
+    user_dir.mkdir(parents=True, exist_ok=True)
+    photos = []
+    for index in range(count):
+        file_path = user_dir / f"{uuid.uuid4().hex}.jpg"
+        file_path.write_bytes(sample_image(image_bytes, rng))
+        relative_path = file_path.relative_to(Path(settings.upload_dir)).as_posix()
+        photos.append(
+            BodyPhoto(
+                user_id=user_id,
+                kind=rng.choice(["front", "side", "back"]),
+                image_path=f"/static/uploads/{relative_path}",
+                captured_at=now - timedelta(days=7 * (count - index)),
+                ai_summary="Postura corretta, tono muscolare in miglioramento.",
+                analysis_status="done",
+            )
+        )
+    return photos
+
+
+def seed(args: argparse.Namespace) -> list[dict]:
+    rng = random.Random(args.seed)
+    # bcrypt e' lento di proposito: un solo hash condiviso da tutti gli utenti di prova.
+    password_hash = hash_password(args.password)
+    now = datetime.now().replace(microsecond=0)
+    users = []
+
+    db = SessionLocal()
+    try:
+        for index in range(args.users):
+            email = f"{args.email_prefix}{index}@dietly.it"
+            user = db.query(User).filter(User.email == email).first()
+            if user is None:
+                user = User(email=email, full_name=f"Utente Benchmark {index}", password_hash=password_hash)
+                db.add(user)
+                db.flush()
+                db.add(
+                    Routine(user_id=user.id, calorie_target=2000, protein_target=120, carbs_target=230, fats_target=70)
+                )
+                db.add(
+                    AISettings(
+                        user_id=user.id,
+                        age_years=rng.randint(20, 60),
+                        sex=rng.choice(["male", "female"]),
+                        height_cm=rng.randint(155, 195),
+                        weight_kg=rng.randint(50, 100),
+                        activity_level="moderate",
+                        goals="Perdere peso mantenendo la massa muscolare",
+                    )
+                )
+
+                rows = []
+                for offset in range(args.days):
+                    day = now - timedelta(days=offset)
+                    rows.extend(_meals_for_day(rng, user.id, day, args.meals_per_day))
+                    rows.extend(
+                        WaterIntake(
+                            user_id=user.id,
+                            amount_ml=rng.choice([200, 250, 330, 500]),
+                            consumed_at=datetime.combine(day.date(), time(min(8 + 2 * slot, 23), rng.randint(0, 59))),
+                        )
+                        for slot in range(args.water_per_day)
+                    )
+                rows.extend(_photos_for_user(rng, user.id, args.photos_per_user, args.image_bytes, now))
+                db.add_all(rows)
+                if index % 20 == 19:
+                    db.commit()
+            users.append({"id": user.id, "email": email, "token": create_access_token(str(user.id))})
+        db.commit()
+    finally:
+        db.close()
+    return users
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Popola il database con utenti, pasti, acqua e foto di prova")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--meals-per-day", type=int, default=4)
+    parser.add_argument("--water-per-day", type=int, default=6)
+    parser.add_argument("--photos-per-user", type=int, default=4)
+    parser.add_argument("--image-bytes", type=int, default=150_000)
+    parser.add_argument("--email-prefix", default="bench")
+    parser.add_argument("--password", default="benchmark-1")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmarks/out/users.json", help="Utenti e token per gli scenari")
+    args = parser.parse_args()
+
+    migrate()
+    os.makedirs(settings.upload_dir, exist_ok=True)
+    users = seed(args)
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(users, indent=2))
+    print(f"{len(users)} utenti pronti in {output} (database: {settings.database_url.split('@')[-1]})")
+
+
+if __name__ == "__main__":
+    main()
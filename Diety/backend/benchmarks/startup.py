@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Eseguito in un processo nuovo ad ogni giro: misura un vero avvio a freddo.
+BOOT_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def boot():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        pass
+
+asyncio.run(boot())
+finished = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "lifespan_ms": (finished - imported) * 1000}))
+"""
+
+
+def _run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", BOOT_SCRIPT],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _importtime(env: dict, code: str) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        rows.append((int(cumulative), name[1:].rstrip()))
+    return rows
+
+
+def _import_profile(env: dict, top: int) -> list[tuple[int, str]]:
+    # Esclude i moduli che l'interprete carica comunque (site, .pth dell'ambiente).
+    preloaded = {name.strip() for _, name in _importtime(env, "pass")}
+    rows = _importtime(env, "import app.main")
+    # Solo gli import diretti di app.main (un livello di indentazione): gli altri sono gia' nel cumulativo.
+    direct = [
+        (cumulative, name)
+        for cumulative, name in rows
+        if name.startswith("  ") and not name.startswith("   ") and name.strip() not in preloaded
+    ]
+    return sorted(direct, reverse=True)[:top]
+
+
+def _summary(values: list[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "median": round(statistics.median(ordered), 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "min": round(ordered[0], 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Misura l'avvio a freddo di app.main")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--schema-mode", default="skip", choices=["skip", "check", "migrate"])
+    parser.add_argument("--importtime", type=int, default=0, help="Mostra i N import piu' lenti (-X importtime)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DB_SCHEMA_ON_STARTUP=args.schema_mode, OLLAMA_HEALTH_INTERVAL="0")
+    env.setdefault("DATABASE_URL", "sqlite://")
+
+    samples = [_run_once(env) for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "schema_mode": args.schema_mode,
+        "import_ms": _summary([sample["import_ms"] for sample in samples]),
+        "lifespan_ms": _summary([sample["lifespan_ms"] for sample in samples]),
+        "total_ms": _summary([sample["import_ms"] + sample["lifespan_ms"] for sample in samples]),
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.importtime:
+        print("\nImport piu' lenti (cumulativo, ms):")
+        for cumulative, name in _import_profile(env, args.importtime):
+            print(f"{cumulative / 1000:8.1f}  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
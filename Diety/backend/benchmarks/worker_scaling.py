@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import httpx
+
+from .loadgen import run_load, start_process, stop_process, wait_until_ready
+
+
+async def _prepare_user(base_url: str) -> str:
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        response = await client.post(
+            "/api/auth/register",
+            json={"email": "loadtest@dietly.it", "full_name": "Load Test", "password": "load-test-1"},
+        )
+        if response.status_code != 201:
+            response = await client.post(
+                "/api/auth/login", json={"email": "loadtest@dietly.it", "password": "load-test-1"}
+            )
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for index in range(5):
+            await client.post(
+                "/api/meals",
+                json={"meal_type": "lunch", "food_name": f"pasta {index}", "calories": 600, "proteins": 20},
+                headers=headers,
+            )
+        return response.json()["access_token"]
+
+
+async def _measure(base_url: str, token: str, paths: list[str], concurrency: int, duration: float) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    cycle = itertools.cycle(paths)
+
+    def next_request(index: int) -> tuple[str, str, dict]:
+        return "GET", next(cycle), {"headers": headers}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        # Riscaldamento: connessioni aperte, import pigri e cache dei worker gia' pronti.
+        await run_load(client, next_request, concurrency, min(duration, 2))
+        result = await run_load(client, next_request, concurrency, duration)
+    return result.as_dict()
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    database_dir = tempfile.mkdtemp(prefix="dietly-load-")
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{database_dir}/dietly.db")
+    env.setdefault("UPLOAD_DIR", database_dir)
+    env["OLLAMA_HEALTH_INTERVAL"] = "0"
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    token = None
+    rows = []
+    for workers in [int(value) for value in args.workers.split(",")]:
+        process = start_process(
+            "app.serve", "--workers", str(workers), "--port", str(args.port), "--max-requests", "0", env=env
+        )
+        try:
+            await wait_until_ready(base_url)
+            if token is None:
+                token = await _prepare_user(base_url)
+            report = await _measure(base_url, token, paths, args.concurrency, args.duration)
+        finally:
+            stop_process(process)
+        rows.append({"workers": workers, **report})
+        print(
+            f"workers={workers:<3} rps={report['throughput_rps']:<8} "
+            f"p50={report['latency_ms']['p50']}ms p95={report['latency_ms']['p95']}ms "
+            f"p99={report['latency_ms']['p99']}ms errors={report['errors']}",
+            flush=True,
+        )
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput di app.serve al variare del numero di worker")
+    parser.add_argument("--workers", default="1,2,4", help="Numeri di worker da provare, separati da virgola")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--paths", default="/api/meals,/api/summary/needs,/api/water")
+    parser.add_argument("--output", help="Salva i risultati in JSON")
+    args = parser.parse_args()
+
+    rows = asyncio.run(main_async(args))
+    if rows:
+        baseline = rows[0]["throughput_rps"] or 1
+        for row in rows:
+            row["speedup"] = round(row["throughput_rps"] / baseline, 2)
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -505,8 +505,7 @@ async function saveRoutine(event) {
       showFlash("Routine aggiornata.");
     }
     await loadRoutine();
-    await loadNeeds();
-    await loadSummary(false);
+    await loadDayOverview();
     await loadTimeline({ force: true });
   } catch (error) {
     showFlash(error.message, "error");
@@ -590,9 +589,7 @@ async function saveMeal(event) {
     showFlash(isEdit ? "Pasto aggiornato." : "Pasto registrato.");
     resetMealFormToCreate();
 
-    await loadMeals();
-    await loadNeeds();
-    await loadSummary(false);
+    await loadDayOverview();
     await loadTimeline({ force: true });
   } catch (error) {
     showFlash(error.message, "error");
@@ -636,8 +633,7 @@ async function deleteMeal(mealId) {
       resetMealFormToCreate();
     }
 
-    await loadMeals();
-    await loadSummary(false);
+    await loadDayOverview();
   } catch (error) {
     showFlash(error.message, "error");
   }
@@ -684,9 +680,7 @@ function renderMeals(meals) {
   });
 }
 
-async function loadMeals() {
-  const day = state.selectedDay;
-  const data = await api(`/api/meals?day=${encodeURIComponent(day)}`);
+function applyMealsData(data) {
   renderTotals(data.totals);
   renderMeals(data.meals);
   state.mealsSnapshot = {
@@ -783,6 +777,7 @@ function sanitizeChatSession(session) {
   return {
     id: String(session.id),
     title: (session.title || "Nuova chat").slice(0, 80),
+    conversation_id: session.conversation_id || null,
     updated_at: session.updated_at || new Date().toISOString(),
     messages: Array.isArray(session.messages)
       ? session.messages
@@ -1155,19 +1150,23 @@ async function sendChatMessage(event) {
   startAiTask();
   try {
     const sendingSession = getChatSessionById(activeSessionId) || ensureActiveChatSession();
-    const history = sendingSession.messages
-      .filter((item) => item.role === "assistant" || item.role === "user")
-      .slice(-8);
+    const body = { message };
+    if (sendingSession.conversation_id) {
+      body.conversation_id = sendingSession.conversation_id;
+    } else {
+      // Prima richiesta di una chat locale: il server importa lo storico e da qui in poi lo conserva.
+      body.history = sendingSession.messages
+        .slice(0, -1)
+        .filter((item) => item.role === "assistant" || item.role === "user");
+    }
 
     const response = await api("/api/chat", {
       method: "POST",
-      body: {
-        message,
-        history,
-      },
+      body,
     });
 
     const targetSession = getChatSessionById(activeSessionId) || ensureActiveChatSession();
+    targetSession.conversation_id = response.conversation_id;
     targetSession.messages.push({ role: "assistant", content: response.reply });
     targetSession.updated_at = new Date().toISOString();
     saveChatHistory();
@@ -1271,18 +1270,6 @@ function renderTimeline(data) {
   $("timelineHint").textContent = data.guidance || "";
 }
 
-async function loadNeeds() {
-  const day = state.selectedDay;
-  startAiTask();
-  try {
-    const data = await api(`/api/summary/needs?day=${encodeURIComponent(day)}`);
-    state.needs = data;
-    renderNeeds();
-  } finally {
-    endAiTask();
-  }
-}
-
 async function loadWater() {
   const day = state.selectedDay;
   const data = await api(`/api/water?day=${encodeURIComponent(day)}`);
@@ -1385,11 +1372,26 @@ async function loadSummary(refresh = false) {
   }
 }
 
+async function loadDayOverview() {
+  const day = state.selectedDay;
+  startAiTask();
+  try {
+    const data = await api(
+      `/api/dashboard?day=${encodeURIComponent(day)}&sections=meals,needs,summary,water`
+    );
+    applyMealsData(data.meals);
+    state.needs = data.needs;
+    state.water = data.water;
+    renderNeeds();
+    renderSummary(data.summary);
+  } finally {
+    endAiTask();
+  }
+}
+
 async function refreshDayData() {
   try {
-    await loadMeals();
-    await loadNeeds();
-    await Promise.all([loadSummary(false), loadWater()]);
+    await loadDayOverview();
     await loadTimeline();
   } catch (error) {
     showFlash(error.message, "error");
@@ -103,6 +103,16 @@ function payloadFromForm() {
   };
 }
 
+const BODY_PHOTO_POLL_MS = 4000;
+let bodyPhotoPollTimer = null;
+
+function bodyPhotoStatusText(item) {
+  if (item.analysis_status === "pending" || item.analysis_status === "processing") {
+    return "Analisi AI in corso...";
+  }
+  return item.ai_summary || "Analisi AI non disponibile.";
+}
+
 function renderBodyGallery(items) {
   const gallery = $("bodyPhotoGallery");
   if (!gallery) return;
@@ -123,7 +133,7 @@ function renderBodyGallery(items) {
       <div class="photo-meta">
         <strong>${item.kind === "front" ? "Fronte intero" : "Retro intero"}</strong>
         <span>${new Date(item.captured_at).toLocaleDateString("it-IT")}</span>
-        <span>${item.ai_summary || "Analisi AI in corso o non disponibile."}</span>
+        <span>${bodyPhotoStatusText(item)}</span>
       </div>
     `;
     gallery.appendChild(card);
@@ -133,6 +143,14 @@ function renderBodyGallery(items) {
 async function loadBodyPhotos() {
   const data = await api("/api/body-photos");
   renderBodyGallery(data);
+
+  clearTimeout(bodyPhotoPollTimer);
+  const pending = (data || []).some(
+    (item) => item.analysis_status === "pending" || item.analysis_status === "processing"
+  );
+  if (pending) {
+    bodyPhotoPollTimer = setTimeout(() => loadBodyPhotos().catch(() => {}), BODY_PHOTO_POLL_MS);
+  }
 }
 
 async function uploadBodyPhoto(event) {
@@ -150,7 +168,7 @@ async function uploadBodyPhoto(event) {
 
   try {
     await api("/api/body-photos", { method: "POST", body: formData, isForm: true });
-    showFlash("Foto caricata con successo.");
+    showFlash("Foto caricata: l'analisi AI e' in corso.");
     fileInput.value = "";
     await loadBodyPhotos();
   } catch (error) {
@@ -0,0 +1,55 @@
+import os
+
+# Impostati prima di importare app.config: database SQLite in memoria e nessun Ollama raggiungibile.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("OLLAMA_BASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("OLLAMA_HEALTH_INTERVAL", "0")
+
+import pytest  # noqa: E402
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def user(db):
+    entry = User(email="utente@example.com", full_name="Utente Test", password_hash="x")
+    db.add(entry)
+    db.commit()
+    return entry
+
+
+@pytest.fixture
+def client(db, user, monkeypatch, tmp_path):
+    from fastapi import Depends
+    from fastapi.testclient import TestClient
+
+    from app.config import settings
+    from app.database import get_db
+    from app.deps import get_current_user
+    from app.main import app
+
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "job_files_dir", str(tmp_path / "job-files"))
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+    user_id = user.id
+
+    def current_user(session=Depends(get_db)):
+        return session.get(User, user_id)
+
+    app.dependency_overrides[get_current_user] = current_user
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
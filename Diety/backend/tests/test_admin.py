@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import settings
+from app.models import AIInteraction
+
+
+@pytest.fixture
+def admin(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "segreto")
+    return {"X-Admin-Token": "segreto"}
+
+
+def _interaction(db, user, latency_ms: float, **fields) -> None:
+    values = {
+        "user_id": user.id,
+        "kind": "day_insights",
+        "model": "mistral:latest",
+        "call_count": 1,
+        "failover_ms": 0.0,
+        "http_ms": latency_ms,
+        "eval_count": 100,
+        "eval_duration_ms": 1000.0,
+        **fields,
+    }
+    db.add(AIInteraction(**values))
+
+
+def test_ai_stats_requires_a_window(client, admin):
+    assert client.get("/api/admin/ai-stats", headers=admin).status_code == 422
+
+
+def test_ai_stats_aggregates_percentiles_and_errors(client, admin, db, user):
+    for latency in range(1, 21):
+        _interaction(db, user, latency * 100.0)
+    _interaction(db, user, 90_000.0, error="Ollama non raggiungibile", eval_count=None, eval_duration_ms=None)
+    _interaction(db, user, 5.0, created_at=datetime.utcnow() - timedelta(hours=48))
+    _interaction(db, user, 300.0, kind="dietly_chat", model=None)
+    db.commit()
+
+    response = client.get("/api/admin/ai-stats?hours=24", headers=admin)
+    assert response.status_code == 200
+    groups = {(group["model"], group["kind"]): group for group in response.json()["groups"]}
+
+    insights = groups[("mistral:latest", "day_insights")]
+    assert insights["interactions"] == 21
+    assert insights["errors"] == 1
+    assert insights["error_rate"] == round(1 / 21, 4)
+    assert insights["latency_p50_ms"] == 1000.0
+    assert insights["latency_p95_ms"] == 1900.0
+    assert insights["tokens_per_second_p50"] == 100.0
+    assert insights["tokens_per_second"] == 100.0
+
+    chat = groups[("default", "dietly_chat")]
+    assert chat["interactions"] == 1 and chat["errors"] == 0
+    assert chat["latency_p95_ms"] == 300.0
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.jobs import claim_jobs
+from app.models import BodyPhoto, Job
+
+
+def _upload(client, kind="front"):
+    response = client.post(
+        "/api/body-photos", data={"kind": kind}, files={"image": ("foto.jpg", b"\xff\xd8fake", "image/jpeg")}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def _age(db, photo_id: int, seconds: int) -> None:
+    photo = db.get(BodyPhoto, photo_id)
+    photo.captured_at = datetime.utcnow() - timedelta(seconds=seconds)
+    db.commit()
+
+
+def test_upload_commits_photo_and_job_together(client, db):
+    photo = _upload(client)
+    job = db.query(Job).filter(Job.dedup_key == f"body_photo_analysis:{photo['id']}").one()
+    assert photo["analysis_status"] == "pending"
+    assert job.kind == "body_photo_analysis"
+
+
+def test_upload_rolls_back_photo_when_enqueue_fails(client, db, monkeypatch):
+    from app.routers import body_photos
+
+    def broken_enqueue(*args, **kwargs):
+        raise RuntimeError("coda non disponibile")
+
+    monkeypatch.setattr(body_photos, "enqueue_job", broken_enqueue)
+    with pytest.raises(RuntimeError):
+        _upload(client)
+    assert db.query(BodyPhoto).count() == 0
+
+
+def test_unclaimed_analysis_expires_after_timeout(client, db):
+    photo = _upload(client)
+    assert client.get(f"/api/body-photos/{photo['id']}").json()["analysis_status"] == "pending"
+
+    _age(db, photo["id"], 3600)
+    assert client.get(f"/api/body-photos/{photo['id']}").json()["analysis_status"] == "failed"
+
+
+def test_claimed_analysis_is_not_expired(client, db):
+    photo = _upload(client)
+    claim_jobs(db, "worker-a", limit=1)
+    db.get(BodyPhoto, photo["id"]).analysis_status = "pending"
+    _age(db, photo["id"], 3600)
+    assert client.get("/api/body-photos").json()[0]["analysis_status"] == "pending"
+
+
+def test_events_stream_reports_missing_photo_as_error_event(client, db):
+    photo = _upload(client)
+    db.get(BodyPhoto, photo["id"]).analysis_status = "done"
+    db.commit()
+
+    body = client.get(f"/api/body-photos/{photo['id']}/events").text
+    assert body.startswith("event: status")
+
+    assert client.get("/api/body-photos/999/events").status_code == 404
+
+
+def test_events_stream_ends_with_error_event_when_photo_disappears(client, monkeypatch):
+    from app.routers import body_photos
+
+    photo = _upload(client)
+    find_photo = body_photos._find_user_photo
+    calls = []
+
+    def disappearing_photo(db, user_id, photo_id):
+        calls.append(photo_id)
+        # Richiesta iniziale e primo controllo dello stream trovano la foto, poi viene eliminata.
+        return find_photo(db, user_id, photo_id) if len(calls) <= 2 else None
+
+    monkeypatch.setattr(body_photos, "_find_user_photo", disappearing_photo)
+    monkeypatch.setattr(body_photos, "SSE_POLL_SECONDS", 0)
+
+    response = client.get(f"/api/body-photos/{photo['id']}/events")
+    assert response.status_code == 200
+    assert response.text == ': pending\n\nevent: error\ndata: {"detail": "Foto non trovata"}\n\n'
+
+
+def _analyzed_photos(client, db, kinds):
+    photos = [_upload(client, kind) for kind in kinds]
+    for photo in photos:
+        db.get(BodyPhoto, photo["id"]).analysis_status = "done"
+    db.commit()
+    return photos
+
+
+def test_compare_by_ids_rejects_photos_of_another_kind(client, db):
+    front, back = _analyzed_photos(client, db, ["front", "back"])
+    response = client.get(f"/api/body-photos/compare?kind=front&latest_id={back['id']}&previous_id={front['id']}")
+    assert response.status_code == 400
+
+
+def test_stored_comparison_is_keyed_on_language_and_system_prompt(client, db, user, monkeypatch):
+    from app import services
+    from app.models import AISettings
+
+    calls = []
+
+    async def fake_compare(payload, preferences=None):
+        calls.append(preferences.get("response_language"))
+        return f"confronto {preferences.get('response_language')}"
+
+    monkeypatch.setattr(services, "compare_body_photos", fake_compare)
+    _analyzed_photos(client, db, ["front", "front"])
+    settings_row = AISettings(user_id=user.id, response_language="it")
+    db.add(settings_row)
+    db.commit()
+
+    first = client.get("/api/body-photos/compare?kind=front").json()
+    assert (first["comparison"], first["cached"]) == ("confronto it", False)
+    assert client.get("/api/body-photos/compare?kind=front").json()["cached"] is True
+
+    settings_row.response_language = "en"
+    db.commit()
+    english = client.get("/api/body-photos/compare?kind=front").json()
+    assert (english["comparison"], english["cached"]) == ("confronto en", False)
+
+    settings_row.system_prompt = "Sii conciso."
+    db.commit()
+    assert client.get("/api/body-photos/compare?kind=front").json()["cached"] is False
+    assert calls == ["it", "en", "en"]
@@ -0,0 +1,48 @@
+import pytest
+
+from app import cache
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+
+def test_entries_expire_after_ttl(clock):
+    entries = TTLCache(ttl_seconds=10)
+    entries.set("a", 1)
+    clock.now += 9
+    assert entries.get("a") == 1
+    clock.now += 2
+    assert entries.get("a") is None
+
+
+def test_evicts_least_recently_used_beyond_max_entries(clock):
+    entries = TTLCache(ttl_seconds=10, max_entries=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    assert entries.get("a") == 1
+    entries.set("c", 3)
+    assert entries.get("b") is None
+    assert entries.get("a") == 1
+    assert entries.get("c") == 3
+
+
+def test_pop_and_falsy_values(clock):
+    entries = TTLCache(ttl_seconds=10)
+    entries.set("zero", 0)
+    assert entries.get("zero") == 0
+    entries.pop("zero")
+    entries.pop("missing")
+    assert entries.get("zero") is None
@@ -0,0 +1,35 @@
+import pytest
+
+from app.models import ChatConversation, ChatTurn
+from app.ollama_client import OllamaServiceError
+from app.routers import chat
+
+
+@pytest.fixture
+def ollama_down(monkeypatch):
+    async def failing_chat(context, preferences=None, affinity=None):
+        raise OllamaServiceError("Ollama non raggiungibile")
+
+    monkeypatch.setattr(chat, "generate_chat_response", failing_chat)
+
+
+def test_failed_first_message_leaves_no_conversation(client, db, ollama_down):
+    response = client.post(
+        "/api/chat",
+        json={"message": "Cosa ceno?", "history": [{"role": "user", "content": "Ciao"}]},
+    )
+    assert response.status_code == 503
+    db.expire_all()
+    assert db.query(ChatConversation).count() == 0
+    assert db.query(ChatTurn).count() == 0
+
+
+def test_failed_message_keeps_an_existing_conversation(client, db, user, ollama_down):
+    conversation = ChatConversation(user_id=user.id, title="Cene")
+    db.add(conversation)
+    db.commit()
+
+    response = client.post("/api/chat", json={"message": "Cosa ceno?", "conversation_id": conversation.id})
+    assert response.status_code == 503
+    db.expire_all()
+    assert db.query(ChatConversation).count() == 1
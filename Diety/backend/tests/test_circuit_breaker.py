@@ -0,0 +1,139 @@
+import pytest
+
+from app import circuit_breaker
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from app.ollama_pool import OllamaBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def _breaker(**options) -> CircuitBreaker:
+    return CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=30, **options)
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == CLOSED
+    assert breaker.try_acquire()
+
+
+def test_opens_at_failure_rate(clock):
+    breaker = _breaker()
+    breaker.record(True)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.try_acquire()
+
+
+def test_half_open_after_open_seconds_allows_one_probe(clock):
+    breaker = _breaker(half_open_calls=1)
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 29
+    assert not breaker.can_attempt()
+
+    clock.now += 1
+    assert breaker.try_acquire()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.try_acquire()
+
+
+def test_half_open_success_closes(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    assert breaker.try_acquire()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert len(breaker.outcomes) == 0
+
+
+def test_half_open_failure_reopens(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    assert breaker.try_acquire()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    clock.now += 10
+    assert not breaker.can_attempt()
+
+
+def test_release_frees_half_open_probe(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    assert breaker.try_acquire()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.try_acquire()
+
+
+def test_slow_successes_count_as_failures_only_when_enabled(clock):
+    breaker = _breaker(slow_call_seconds=120)
+    for _ in range(4):
+        breaker.record(True, duration=150)
+    assert breaker.state == OPEN
+
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(True, duration=150)
+    assert breaker.state == CLOSED
+
+
+def test_default_settings_do_not_penalise_slow_vision_calls(clock):
+    # Una chiamata visione su CPU che riesce in 121-180s non deve aprire il breaker.
+    breaker = OllamaBackend(base_url="http://ollama:11434").breaker("llava:latest")
+    for _ in range(breaker.window):
+        breaker.record(True, duration=170)
+    assert breaker.state == CLOSED
+
+
+def test_permit_is_closed_only_once(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    permit = breaker.try_acquire()
+    assert permit
+    breaker.record(False, permit=permit)
+    clock.now += 30
+    probe = breaker.try_acquire()
+    assert probe
+    # Un secondo release/record dello stesso permesso non libera lo slot della sonda attuale.
+    breaker.release(permit)
+    breaker.record(True, permit=permit)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.try_acquire()
+
+
+def test_stale_permit_does_not_free_a_probe_slot(clock):
+    breaker = _breaker()
+    stale = breaker.try_acquire()
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    assert breaker.try_acquire()
+    breaker.release(stale)
+    assert not breaker.try_acquire()
@@ -0,0 +1,16 @@
+import pytest
+from pydantic import ValidationError
+
+from app.config import Settings
+
+
+def test_db_schema_on_startup_rejects_unknown_values():
+    assert Settings(db_schema_on_startup="migrate").db_schema_on_startup == "migrate"
+    with pytest.raises(ValidationError):
+        Settings(db_schema_on_startup="chek")
+
+
+def test_db_repeated_query_mode_rejects_unknown_values():
+    assert Settings(db_repeated_query_mode="raise").db_repeated_query_mode == "raise"
+    with pytest.raises(ValidationError):
+        Settings(db_repeated_query_mode="error")
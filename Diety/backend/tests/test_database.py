@@ -0,0 +1,124 @@
+import logging
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import make_url
+from sqlalchemy.pool import StaticPool
+
+from app import database
+from app.config import settings
+
+
+POOL_OPTIONS = {"pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping"}
+
+
+def test_sqlite_in_memory_shares_a_single_connection():
+    options = database._engine_options(make_url("sqlite://"))
+    assert options["poolclass"] is StaticPool
+    assert options["connect_args"] == {"check_same_thread": False}
+    assert not POOL_OPTIONS & options.keys()
+
+
+def test_sqlite_file_gets_the_full_pool_options(monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_timeout", 7)
+    options = database._engine_options(make_url("sqlite:////tmp/dietly.db"))
+    assert POOL_OPTIONS <= options.keys()
+    assert options["pool_timeout"] == 7
+    assert options["connect_args"] == {"check_same_thread": False}
+    assert "poolclass" not in options
+
+
+@pytest.mark.parametrize("url", ["mysql+pymysql://u:p@db/dietly", "postgresql+psycopg://u:p@db/dietly"])
+def test_server_databases_get_the_pool_options(url, monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_size", 3)
+    monkeypatch.setattr(settings, "db_pool_recycle", 60)
+    options = database._engine_options(make_url(url))
+    assert options.keys() == POOL_OPTIONS
+    assert options["pool_size"] == 3
+    assert options["pool_recycle"] == 60
+
+
+def _fake_engine(dialect: str, max_connections: int):
+    queries = []
+
+    class Connection:
+        def execute(self, statement):
+            queries.append(str(statement))
+            return SimpleNamespace(first=lambda: ("max_connections", str(max_connections)))
+
+    @contextmanager
+    def connect():
+        yield Connection()
+
+    return SimpleNamespace(dialect=SimpleNamespace(name=dialect), connect=connect), queries
+
+
+@pytest.fixture
+def sizing(monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_size", 5)
+    monkeypatch.setattr(settings, "db_max_overflow", 10)
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    monkeypatch.setattr(settings, "job_worker_processes", 1)
+    monkeypatch.setattr(settings, "rate_limit_backend", "memory")
+    monkeypatch.setattr(settings, "rate_limit_db_pool_size", 2)
+
+    def use(dialect: str, max_connections: int) -> list[str]:
+        engine, queries = _fake_engine(dialect, max_connections)
+        monkeypatch.setattr(database, "engine", engine)
+        return queries
+
+    return use
+
+
+@pytest.mark.parametrize(
+    ("dialect", "query"),
+    [("mysql", "SHOW VARIABLES LIKE 'max_connections'"), ("postgresql", "current_setting('max_connections')")],
+)
+def test_pool_sizing_warns_above_max_connections(sizing, dialect, query, caplog):
+    queries = sizing(dialect, max_connections=50)
+    with caplog.at_level(logging.WARNING, logger="app.database"):
+        database.validate_pool_sizing()
+    assert query in queries[0]
+    # (5 + 10) connessioni x (4 web + 1 job worker) = 75 > 50.
+    assert "fino a 75 connessioni" in caplog.text
+
+
+def test_pool_sizing_counts_the_rate_limit_pool(sizing, monkeypatch, caplog):
+    sizing("mysql", max_connections=80)
+    with caplog.at_level(logging.WARNING, logger="app.database"):
+        database.validate_pool_sizing()
+    assert not caplog.records
+
+    monkeypatch.setattr(settings, "rate_limit_backend", "database")
+    with caplog.at_level(logging.WARNING, logger="app.database"):
+        database.validate_pool_sizing()
+    # (5 + 10 + 2 per i bucket) x 5 processi = 85 > 80.
+    assert "fino a 85 connessioni" in caplog.text
+
+
+def test_rate_limit_engine_has_its_own_small_pool(monkeypatch, tmp_path):
+    assert database.create_rate_limit_engine() is database.engine
+
+    monkeypatch.setattr(settings, "rate_limit_db_pool_size", 3)
+    monkeypatch.setattr(database, "database_url", make_url(f"sqlite:///{tmp_path / 'dietly.db'}"))
+    rate_limit_engine = database.create_rate_limit_engine()
+    try:
+        assert rate_limit_engine is not database.engine
+        assert rate_limit_engine.pool.size() == 3
+        assert rate_limit_engine.pool._max_overflow == 0
+    finally:
+        rate_limit_engine.dispose()
+
+
+def test_pool_sizing_within_max_connections_does_not_warn(sizing, caplog):
+    sizing("mysql", max_connections=151)
+    with caplog.at_level(logging.WARNING, logger="app.database"):
+        database.validate_pool_sizing()
+    assert not caplog.records
+
+
+def test_pool_sizing_skips_sqlite(sizing):
+    queries = sizing("sqlite", max_connections=1)
+    database.validate_pool_sizing()
+    assert queries == []
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from app import health
+from app.config import settings
+
+
+@pytest.fixture
+def checks(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    health._results.pop("ready")
+    health._ollama_results.pop("ollama")
+
+    async def ollama_down() -> dict:
+        return {"ok": False, "backends": {"http://127.0.0.1:9": False}, "missing_models": []}
+
+    monkeypatch.setattr(health, "_check_ollama", ollama_down)
+    yield
+    health._results.pop("ready")
+
+
+def test_ollama_down_is_degraded_by_default(checks, client):
+    result = asyncio.run(health._readiness())
+    assert result["status"] == "degraded"
+    assert client.get("/health/ready").status_code == 200
+
+
+def test_ollama_down_is_unavailable_when_required(checks, client, monkeypatch):
+    monkeypatch.setattr(settings, "health_require_ollama", True)
+    assert asyncio.run(health._readiness())["status"] == "unavailable"
+    assert client.get("/health/ready").status_code == 503
+
+
+def test_database_probe_is_skipped_while_the_previous_one_runs(client):
+    assert health._check_database() == {"ok": True}
+    with health._database_probe:
+        assert health._check_database() == {"ok": False, "error": "busy"}
+    assert health._check_database() == {"ok": True}
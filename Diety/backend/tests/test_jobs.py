@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import jobs, services
+from app.jobs import DONE, FAILED, QUEUED, RUNNING, claim_jobs, complete_job, enqueue_job, fail_job
+from app.models import AISettings, Routine
+
+
+def test_enqueue_deduplicates_until_job_finishes(db, user):
+    first = enqueue_job(db, "daily_summary", {"user_id": user.id}, user_id=user.id, dedup_key="daily:1")
+    second = enqueue_job(db, "daily_summary", {"user_id": user.id}, user_id=user.id, dedup_key="daily:1")
+    assert first.id == second.id
+
+    [claimed] = claim_jobs(db, "worker-a", limit=5)
+    complete_job(db, claimed, {"ok": True})
+    assert claimed.status == DONE
+    third = enqueue_job(db, "daily_summary", {"user_id": user.id}, user_id=user.id, dedup_key="daily:1")
+    assert third.id != first.id
+
+
+def test_claim_skips_future_and_running_jobs(db, user):
+    enqueue_job(db, "a", user_id=user.id, run_after=datetime.utcnow() + timedelta(minutes=5))
+    ready = enqueue_job(db, "a", user_id=user.id)
+
+    claimed = claim_jobs(db, "worker-a", limit=5)
+    assert [job.id for job in claimed] == [ready.id]
+    assert claimed[0].status == RUNNING and claimed[0].attempts == 1
+    assert claim_jobs(db, "worker-b", limit=5) == []
+
+
+def test_failed_job_is_requeued_with_backoff(db, user, monkeypatch):
+    monkeypatch.setattr(jobs.settings, "job_retry_base_seconds", 10)
+    job = enqueue_job(db, "a", user_id=user.id, max_attempts=3)
+    [claimed] = claim_jobs(db, "worker-a", limit=1)
+    before = datetime.utcnow()
+    fail_job(db, claimed, "boom")
+
+    assert job.status == QUEUED
+    assert job.run_after >= before + timedelta(seconds=8)
+    assert claim_jobs(db, "worker-a", limit=1) == []
+
+
+def test_exhausted_job_fails_and_discards_its_file(db, user, monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs.settings, "job_files_dir", str(tmp_path))
+    image = tmp_path / "meal-analysis" / "1" / "pasto.jpg"
+    image.parent.mkdir(parents=True)
+    image.write_bytes(b"img")
+    enqueue_job(db, "image_analysis", {"file_path": str(image)}, user_id=user.id, dedup_key="img", max_attempts=1)
+
+    [claimed] = claim_jobs(db, "worker-a", limit=1)
+    fail_job(db, claimed, "boom")
+    assert claimed.status == FAILED and claimed.dedup_key is None
+    assert not image.exists()
+
+
+def test_discard_ignores_files_outside_job_files_dir(db, user, monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs.settings, "job_files_dir", str(tmp_path / "job-files"))
+    photo = tmp_path / "uploads" / "foto.jpg"
+    photo.parent.mkdir()
+    photo.write_bytes(b"img")
+    job = enqueue_job(db, "image_analysis", {"file_path": str(photo)}, user_id=user.id)
+    jobs.discard_job_file(job)
+    assert photo.exists()
+
+
+def test_visibility_timeout_hands_job_to_another_worker(db, user):
+    job = enqueue_job(db, "a", user_id=user.id, max_attempts=2)
+    claim_jobs(db, "worker-a", limit=1)
+    job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+    [claimed] = claim_jobs(db, "worker-b", limit=1)
+    assert claimed.locked_by == "worker-b" and claimed.attempts == 2
+
+    job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert claim_jobs(db, "worker-c", limit=1) == []
+    assert job.status == FAILED
+
+
+def test_smart_routine_job_raises_when_ai_fails(db, user, monkeypatch):
+    from app.worker import handle_smart_routine
+
+    db.add(AISettings(user_id=user.id, smart_routine_enabled=True, goals="dimagrire"))
+    db.add(Routine(user_id=user.id, calorie_target=2000))
+    db.commit()
+
+    async def failing_generate_smart_routine(payload, preferences=None):
+        raise RuntimeError("ollama giu'")
+
+    monkeypatch.setattr(services, "generate_smart_routine", failing_generate_smart_routine)
+    with pytest.raises(RuntimeError):
+        asyncio.run(handle_smart_routine(db, None, {"user_id": user.id}))
+
+
+def test_failed_summary_job_is_not_requeued_during_cooldown(db, user, monkeypatch):
+    from app.models import Meal
+    from app.scheduler import enqueue_due_summaries
+
+    yesterday = datetime.now() - timedelta(days=1)
+    db.add(Meal(user_id=user.id, meal_type="pranzo", food_name="Pasta", consumed_at=yesterday, calories=500))
+    db.commit()
+    assert enqueue_due_summaries(db, datetime.now()) == 1
+
+    # Ollama giu': il job esaurisce i tentativi senza salvare un consiglio.
+    [job] = claim_jobs(db, "worker-a", limit=5)
+    job.attempts = job.max_attempts
+    fail_job(db, job, "Ollama non raggiungibile")
+    assert job.status == FAILED
+
+    assert enqueue_due_summaries(db, datetime.now()) == 0
+    assert db.query(jobs.Job).count() == 1
+
+    monkeypatch.setattr(jobs.settings, "summary_scheduler_failure_cooldown", 0)
+    assert enqueue_due_summaries(db, datetime.now()) == 1
+
+
+def test_concurrent_duplicate_keeps_the_callers_changes(monkeypatch, tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database import Base
+    from app.models import Job, User
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'race.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    with Session() as setup:
+        setup.add(User(id=1, email="a@example.com", full_name="A", password_hash="x"))
+        setup.add(Routine(user_id=1, calorie_target=2000))
+        setup.commit()
+
+    def insert_duplicate():
+        # Un altro processo accoda lo stesso job dopo il controllo del dedup_key.
+        with Session() as other:
+            other.add(Job(kind="smart_routine", payload="{}", dedup_key="smart_routine:1", status=QUEUED))
+            other.commit()
+        return None
+
+    monkeypatch.setattr(jobs, "current_traceparent", insert_duplicate)
+    with Session() as db:
+        routine = db.query(Routine).one()
+        routine.calorie_target = 1800
+        job = enqueue_job(db, "smart_routine", {"user_id": 1}, user_id=1, dedup_key="smart_routine:1", commit=False)
+        db.commit()
+        assert job.payload == "{}"
+
+    with Session() as check:
+        assert check.query(Routine).one().calorie_target == 1800
+        assert check.query(Job).count() == 1
+    engine.dispose()
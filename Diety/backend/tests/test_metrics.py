@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+from app import metrics
+from app.config import settings
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_missing_and_none_labels_render_as_empty():
+    counter = Counter("test_calls_total", "Chiamate", ("model", "outcome"))
+    counter.inc(model=None, outcome="ok")
+    counter.inc(outcome="ok")
+    assert counter.render() == ['test_calls_total{model="",outcome="ok"} 2']
+
+
+def test_metrics_endpoint_requires_admin_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "")
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(settings, "admin_token", "segreto")
+    assert client.get("/metrics").status_code == 403
+    response = client.get("/metrics", headers={"X-Admin-Token": "segreto"})
+    assert response.status_code == 200
+    assert "dietly_http_requests_total" in response.text
+
+
+@pytest.fixture
+def multiprocess(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "metrics_multiprocess_dir", str(tmp_path))
+    registry = Registry()
+    counter = registry.register(Counter("test_requests_total", "Richieste", ("route",)))
+    gauge = registry.register(Gauge("test_in_flight", "In corso"))
+    histogram = registry.register(Histogram("test_latency_seconds", "Latenza", buckets=(1, 5)))
+    monkeypatch.setattr(metrics, "registry", registry)
+    return tmp_path, counter, gauge, histogram
+
+
+def _write_other_process(directory, pid: int, snapshot: dict) -> None:
+    (directory / f"{pid}.json").write_text(json.dumps(snapshot))
+
+
+def test_render_sums_snapshots_of_all_worker_processes(multiprocess, monkeypatch):
+    directory, counter, gauge, histogram = multiprocess
+    counter.inc(route="/a")
+    gauge.set(1)
+    histogram.observe(0.5)
+    other = {
+        "test_requests_total": [[["/a"], 2], [["/b"], 1]],
+        "test_in_flight": [[[], 3]],
+        "test_latency_seconds": [[[], [[0, 1, 0], 2.0, 1]]],
+    }
+    _write_other_process(directory, 101, other)
+    _write_other_process(directory, 102, other)
+    monkeypatch.setattr(metrics, "_process_alive", lambda pid: pid != 102)
+
+    text = metrics.registry.render()
+    assert 'test_requests_total{route="/a"} 5' in text
+    assert 'test_requests_total{route="/b"} 2' in text
+    # Gauge: il processo 102 e' terminato, non conta.
+    assert "test_in_flight 4" in text
+    assert 'test_latency_seconds_bucket{le="1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="5"} 3' in text
+    assert "test_latency_seconds_count 3" in text
+    assert os.path.exists(directory / f"{os.getpid()}.json")
+
+
+def test_render_skips_unreadable_snapshots(multiprocess):
+    directory, counter, _, _ = multiprocess
+    counter.inc(route="/a")
+    (directory / "103.json").write_text("{non json")
+    (directory / "note.txt").write_text("ignorato")
+    assert 'test_requests_total{route="/a"} 1' in metrics.registry.render()
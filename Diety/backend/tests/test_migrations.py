@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from app import migrations
+from app.database import Base
+from app.schema_snapshots import baseline
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table == "schema_migrations":
+            continue
+        schema[table] = {
+            "columns": {
+                column["name"]: (str(column["type"]), column["nullable"]) for column in inspector.get_columns(table)
+            },
+            "indexes": sorted(
+                (index["name"], tuple(index["column_names"]), bool(index["unique"]))
+                for index in inspector.get_indexes(table)
+            ),
+            "unique": sorted(
+                (constraint["name"], tuple(constraint["column_names"]))
+                for constraint in inspector.get_unique_constraints(table)
+            ),
+            "foreign_keys": sorted(
+                (tuple(key["constrained_columns"]), key["referred_table"]) for key in inspector.get_foreign_keys(table)
+            ),
+        }
+    return schema
+
+
+@pytest.fixture
+def file_engine(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dietly.db'}")
+    monkeypatch.setattr(migrations, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_migrations_build_the_same_schema_as_the_models(file_engine, tmp_path):
+    assert migrations.migrate() == [item.version for item in migrations._migrations]
+
+    reference = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    Base.metadata.create_all(bind=reference)
+    assert _schema(file_engine) == _schema(reference)
+    reference.dispose()
+
+
+def test_baseline_is_frozen_before_later_migrations():
+    assert "rate_limit_buckets" not in baseline.tables
+    assert "error" not in baseline.tables["ai_interactions"].c
+    comparisons = baseline.tables["body_photo_comparisons"]
+    assert "prompt_key" not in comparisons.c
+    assert {constraint.name for constraint in comparisons.constraints} >= {"uq_body_photo_comparison_photos_model"}
+
+
+def test_concurrent_sqlite_migrations_apply_each_version_once(file_engine, monkeypatch):
+    applied = []
+    first_started = threading.Event()
+    release_first = threading.Event()
+    apply_baseline = migrations._migrations[0].apply
+
+    def slow_baseline(connection):
+        # Il primo processo resta dentro la migrazione finche' il secondo non prova a prendere il lock.
+        first_started.set()
+        release_first.wait(timeout=5)
+        apply_baseline(connection)
+
+    patched = [migrations.Migration(1, "baseline", slow_baseline), *migrations._migrations[1:]]
+    monkeypatch.setattr(migrations, "_migrations", patched)
+
+    def run():
+        applied.append(migrations.migrate(lock_timeout=10))
+
+    first = threading.Thread(target=run)
+    first.start()
+    assert first_started.wait(timeout=5)
+    second = threading.Thread(target=run)
+    second.start()
+    second.join(timeout=0.5)
+    assert second.is_alive()
+    release_first.set()
+    first.join()
+    second.join()
+
+    assert sorted(applied, key=len) == [[], [item.version for item in migrations._migrations]]
+
+
+def test_added_columns_do_not_follow_later_model_changes(file_engine, monkeypatch):
+    from sqlalchemy import String
+
+    from app.models import AIInteraction
+
+    monkeypatch.setattr(AIInteraction.__table__.c.error, "type", String(10))
+    migrations.migrate()
+    columns = {column["name"]: column for column in inspect(file_engine).get_columns("ai_interactions")}
+    assert str(columns["error"]["type"]) == "TEXT"
@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+from app import ollama_client
+from app.ollama_client import GenerateResult
+
+
+@pytest.fixture
+def generate_calls(monkeypatch):
+    calls = []
+
+    async def fake_generate(payload, base_url=None, timeout=None, cycle=1, fallback=False):
+        calls.append({"cycle": cycle, "format": payload.get("format"), "prompt": payload["prompt"]})
+        if cycle == 1:
+            text = json.dumps(
+                {"needs": {"calories": 2000, "proteins": 120, "carbs": 220, "fats": 70}, "advice": "bozza"}
+            )
+        else:
+            text = f"versione {cycle}"
+        return GenerateResult(text=text, call=None)
+
+    monkeypatch.setattr(ollama_client, "_generate", fake_generate)
+    return calls
+
+
+def test_closed_day_advice_goes_through_reasoning_cycles(generate_calls):
+    insights = asyncio.run(
+        ollama_client.generate_day_insights({"day": "2024-01-01"}, preferences={"reasoning_cycles": 3})
+    )
+    assert insights["advice"] == "versione 3"
+    assert insights["needs"]["calories"] == 2000
+    assert [call["cycle"] for call in generate_calls] == [1, 2, 3]
+    assert generate_calls[1]["format"] is None
+    assert "bozza" in generate_calls[1]["prompt"]
+
+
+def test_open_day_insights_make_a_single_call(generate_calls):
+    insights = asyncio.run(
+        ollama_client.generate_day_insights(
+            {"day": "2024-01-01"}, preferences={"reasoning_cycles": 3}, include_advice=False
+        )
+    )
+    assert insights["advice"] == ""
+    assert len(generate_calls) == 1
+
+
+def test_chat_day_data_follows_the_stable_history():
+    payload = {
+        "user_profile": {"goals": "dimagrire"},
+        "targets": {"calories": 2000},
+        "totals": {"calories": 600},
+        "conversation_summary": "Parlato di colazioni.",
+        "history": [{"role": "user", "content": "Ciao"}, {"role": "assistant", "content": "Ciao!"}],
+        "message": "Cosa ceno?",
+    }
+    first = ollama_client._chat_messages(payload, None)
+    assert [message["role"] for message in first] == ["system", "system", "user", "assistant", "system", "user"]
+    assert first[-2]["content"].startswith("Dati di oggi")
+
+    # Dopo un nuovo pasto cambiano solo i messaggi in coda: persona, riassunto e storico restano un prefisso.
+    second = ollama_client._chat_messages({**payload, "totals": {"calories": 1200}}, None)
+    assert second[:4] == first[:4]
+    assert second[-2] != first[-2]
+
+
+def test_unexpected_error_releases_the_half_open_probe(monkeypatch):
+    import httpx
+
+    from app import ollama_pool
+    from app.circuit_breaker import HALF_OPEN
+
+    backend = ollama_pool.OllamaBackend(base_url="http://probe:11434")
+    pool = ollama_pool.OllamaBackendPool([backend])
+    monkeypatch.setattr(ollama_client, "pool_for", lambda base_url: pool)
+    breaker = backend.breaker("mistral")
+    breaker.state = HALF_OPEN
+
+    async def broken_post(self, url, json=None):
+        raise KeyError("bug nostro")
+
+    monkeypatch.setattr(httpx.AsyncClient, "post", broken_post)
+    with pytest.raises(KeyError):
+        asyncio.run(ollama_client._post("/api/generate", {"model": "mistral"}))
+    assert breaker.probes_in_flight == 0
+    assert breaker.try_acquire()
+
+
+def test_failover_time_is_recorded_on_the_successful_call(monkeypatch):
+    import httpx
+
+    from app import ollama_pool
+    from app.ai_metrics import track_ai_calls
+
+    first = ollama_pool.OllamaBackend(base_url="http://primo:11434")
+    second = ollama_pool.OllamaBackend(base_url="http://secondo:11434")
+    pool = ollama_pool.OllamaBackendPool([first, second])
+    monkeypatch.setattr(pool, "candidates", lambda model, affinity=None: [first, second])
+    monkeypatch.setattr(ollama_client, "pool_for", lambda base_url: pool)
+
+    async def post(self, url, json=None):
+        request = httpx.Request("POST", url)
+        if url.startswith(first.base_url):
+            await asyncio.sleep(0.02)
+            raise httpx.ConnectError("rifiutata", request=request)
+        return httpx.Response(200, json={"response": "ok"}, request=request)
+
+    monkeypatch.setattr(httpx.AsyncClient, "post", post)
+    with track_ai_calls() as calls:
+        asyncio.run(ollama_client._post("/api/generate", {"model": "mistral"}))
+    assert calls[0].backend == second.base_url
+    assert calls[0].failover_ms >= 20
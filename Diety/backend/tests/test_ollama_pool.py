@@ -0,0 +1,22 @@
+import pytest
+
+from app import ollama_pool
+from app.config import settings
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    monkeypatch.setattr(ollama_pool, "_default_pool", None)
+    monkeypatch.setattr(ollama_pool, "_custom_pools", ollama_pool.OrderedDict())
+    monkeypatch.setattr(settings, "ollama_base_url", "http://legacy:11434")
+    monkeypatch.setattr(settings, "ollama_base_urls", "http://host-a:11434,http://host-b:11434")
+
+
+def test_member_of_the_default_pool_uses_it(pools):
+    assert ollama_pool.pool_for("http://host-a:11434/") is ollama_pool.default_pool()
+
+
+def test_legacy_url_outside_the_pool_gets_its_own_pool(pools):
+    pool = ollama_pool.pool_for("http://legacy:11434")
+    assert pool is not ollama_pool.default_pool()
+    assert [backend.base_url for backend in pool.backends] == ["http://legacy:11434"]
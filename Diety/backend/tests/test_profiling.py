@@ -0,0 +1,46 @@
+import fastapi
+import fastapi.routing as routing
+import pytest
+
+from app import profiling
+from app.config import settings
+
+
+PATCHED = ("solve_dependencies", "serialize_response", "run_endpoint_function")
+
+
+@pytest.fixture
+def restore_routing(monkeypatch):
+    # Le sostituzioni di instrument_fastapi vengono annullate a fine test.
+    for name in PATCHED:
+        monkeypatch.setattr(routing, name, getattr(routing, name))
+    monkeypatch.setattr(routing, "_dietly_profiling", False, raising=False)
+
+
+def test_fastapi_is_not_patched_unless_profiling_is_enabled(client):
+    assert not settings.profiling_enabled
+    assert not getattr(routing, "_dietly_profiling", False)
+
+
+def test_instrumentation_skips_unverified_fastapi_versions(restore_routing, monkeypatch):
+    original = routing.solve_dependencies
+    monkeypatch.setattr(fastapi, "__version__", "0.200.0")
+    assert not profiling.instrument_fastapi()
+    assert routing.solve_dependencies is original
+
+
+def test_instrumented_request_reports_route_spans(restore_routing, client, monkeypatch):
+    assert profiling.instrument_fastapi()
+    monkeypatch.setattr(settings, "profiling_enabled", True)
+    monkeypatch.setattr(settings, "profiling_allow_header", True)
+
+    response = client.get("/api/water", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "validation" in response.headers["Server-Timing"]
+    assert "endpoint" in response.headers["Server-Timing"]
+
+
+def test_profile_header_is_ignored_when_profiling_is_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_allow_header", True)
+    response = client.get("/api/water", headers={"X-Profile": "1"})
+    assert "X-Profile-Id" not in response.headers
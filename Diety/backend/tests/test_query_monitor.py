@@ -0,0 +1,59 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from app import services
+from app.config import settings
+from app.models import AISettings, Routine, User
+from app.query_monitor import RepeatedQueryError, track_queries
+
+
+@pytest.fixture
+def raise_on_repeats(monkeypatch):
+    monkeypatch.setattr(settings, "db_repeated_query_mode", "raise")
+    monkeypatch.setattr(settings, "db_repeated_query_threshold", 10)
+    services._insights_cache._entries.clear()
+
+    async def fake_generate_day_insights(payload, preferences=None, include_advice=False):
+        return {"guidance": "Verdure a cena"}
+
+    monkeypatch.setattr(services, "generate_day_insights", fake_generate_day_insights)
+
+
+def _add_user(db, index: int) -> User:
+    user = User(email=f"utente{index}@example.com", full_name="Utente", password_hash="x")
+    db.add(user)
+    db.flush()
+    db.add(Routine(user_id=user.id, calorie_target=2000))
+    db.add(AISettings(user_id=user.id))
+    db.commit()
+    return user
+
+
+def test_timeline_lazy_loads_stay_below_the_threshold_per_request(db, raise_on_repeats):
+    user = _add_user(db, 0)
+
+    async def request():
+        with track_queries() as stats:
+            await services.build_timeline(db, user, date.today())
+        return stats
+
+    stats = asyncio.run(request())
+    # user.routine e user.ai_settings: un lazy load nella sessione della richiesta e uno in quella del task.
+    routine_loads = [count for statement, count in stats.statements.items() if "FROM routines" in statement]
+    assert routine_loads == [2]
+    assert max(stats.statements.values()) < settings.db_repeated_query_threshold
+
+
+def test_timeline_for_many_users_in_one_scope_raises(db, raise_on_repeats):
+    # Lo stesso schema in un ciclo su piu' utenti (es. un job batch) e' un N+1: la modalita' "raise" lo ferma.
+    users = [_add_user(db, index) for index in range(settings.db_repeated_query_threshold)]
+
+    async def batch():
+        with track_queries():
+            for user in users:
+                await services.build_timeline(db, user, date.today())
+
+    with pytest.raises(RepeatedQueryError):
+        asyncio.run(batch())
@@ -0,0 +1,136 @@
+import pytest
+
+from app import rate_limit, services
+from app.config import settings
+from app.models import AISettings, RateLimitBucket
+from app.rate_limit import Budget, DatabaseBuckets, MemoryBuckets
+
+
+BUDGET = Budget("ai", per_minute=60, burst=2)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+@pytest.mark.parametrize("buckets", [MemoryBuckets, DatabaseBuckets])
+def test_bucket_allows_burst_then_refills(db, clock, buckets):
+    store = buckets()
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) == pytest.approx(1.0)
+    # Un altro utente ha il proprio bucket.
+    assert store.take("ai:2", BUDGET) == 0
+
+    clock.now += 1
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) > 0
+
+    # Il bucket non supera la capacita' anche dopo una lunga pausa.
+    clock.now += 3600
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) > 0
+
+
+def test_database_buckets_share_state_across_instances(db, clock):
+    DatabaseBuckets().take("ai:1", BUDGET)
+    DatabaseBuckets().take("ai:1", BUDGET)
+    assert DatabaseBuckets().take("ai:1", BUDGET) > 0
+    assert db.query(RateLimitBucket).count() == 1
+
+
+def test_memory_buckets_drop_least_recent(clock):
+    store = MemoryBuckets(max_entries=2)
+    for key in ("ai:1", "ai:1", "ai:2", "ai:3"):
+        store.take(key, BUDGET)
+    # ai:1 e' stato scartato: riparte con il bucket pieno.
+    assert store.take("ai:1", BUDGET) == 0
+    assert store.take("ai:1", BUDGET) == 0
+
+
+def test_take_token_lets_requests_through_when_the_store_fails(monkeypatch):
+    class Broken:
+        def take(self, key, budget):
+            raise ConnectionError("store giu'")
+
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(rate_limit, "_backend", lambda: Broken())
+    assert rate_limit.take_token("ai", "1") == 0
+
+
+def test_sync_smart_routine_uses_the_ai_budget(client, db, user, monkeypatch):
+    db.add(AISettings(user_id=user.id, smart_routine_enabled=True))
+    db.commit()
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_backend", "memory")
+    monkeypatch.setattr(settings, "rate_limit_ai_burst", 1)
+    monkeypatch.setitem(rate_limit._backends, "memory", MemoryBuckets())
+
+    async def fake_optimize_routine(db, user, routine, preferences):
+        return True, "Ottimizzata"
+
+    monkeypatch.setattr("app.routers.routine.optimize_routine", fake_optimize_routine)
+
+    assert client.put("/api/routine", json={"calorie_target": 2000}).status_code == 200
+    response = client.put("/api/routine", json={"calorie_target": 2100})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    # In background l'ottimizzazione va in coda al worker: nessun token AI consumato.
+    assert client.put("/api/routine?background=true", json={"calorie_target": 2100}).status_code == 200
+
+
+@pytest.fixture
+def ai_budget(monkeypatch):
+    services._insights_cache._entries.clear()
+    calls = []
+
+    async def fake_generate_day_insights(payload, preferences=None, include_advice=False):
+        calls.append(payload["day"])
+        return {"needs": {"calories": 2000, "proteins": 120, "carbs": 220, "fats": 70}, "note": "AI"}
+
+    monkeypatch.setattr(services, "generate_day_insights", fake_generate_day_insights)
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "rate_limit_backend", "memory")
+    monkeypatch.setattr(settings, "rate_limit_ai_burst", 1)
+    monkeypatch.setitem(rate_limit._backends, "memory", MemoryBuckets())
+    yield calls
+    services._insights_cache._entries.clear()
+
+
+def test_summary_uses_the_ai_budget_only_on_a_cache_miss(client, ai_budget):
+    assert client.get("/api/summary/needs?day=2024-01-01").json()["source"] == "ai"
+    # Insight in cache: nessuna chiamata a Ollama e nessun token consumato.
+    assert client.get("/api/summary/needs?day=2024-01-01").status_code == 200
+    assert ai_budget == ["2024-01-01"]
+
+    response = client.get("/api/summary/needs?day=2024-01-02")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    assert ai_budget == ["2024-01-01"]
+
+
+def test_dashboard_over_the_ai_budget_falls_back_to_local_sections(client, ai_budget):
+    first = client.get("/api/dashboard?day=2024-01-01&sections=needs,meals")
+    assert first.json()["sections"] == {"needs": "ok", "meals": "ok"}
+
+    response = client.get("/api/dashboard?day=2024-01-02&sections=needs,meals")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["sections"] == {"needs": "rate_limited", "meals": "ok"}
+    assert body["needs"]["source"] == "stimato"
+    assert ai_budget == ["2024-01-01"]
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+from app import serve
+from app.config import settings
+
+
+class FakeConfig:
+    def __init__(self, app, **options):
+        self.app = app
+        self.options = options
+        self.workers = options["workers"]
+
+    def bind_socket(self):
+        return "socket"
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    calls = {"migrations": 0, "supervisors": []}
+
+    def supervisor(name):
+        class Supervisor:
+            def __init__(self, config, target, sockets):
+                calls["supervisors"].append((name, config, sockets))
+
+            def run(self):
+                pass
+
+        return Supervisor
+
+    def run_migrations():
+        calls["migrations"] += 1
+
+    monkeypatch.setattr(serve.uvicorn, "Config", FakeConfig)
+    monkeypatch.setattr(serve, "Multiprocess", supervisor("multiprocess"))
+    monkeypatch.setattr(serve, "ChangeReload", supervisor("reload"))
+    monkeypatch.setattr(serve, "_run_migrations", run_migrations)
+    monkeypatch.setattr(settings, "metrics_multiprocess_dir", str(tmp_path / "metrics"))
+    for name in ("DB_SCHEMA_ON_STARTUP", "WEB_CONCURRENCY", "METRICS_MULTIPROCESS_DIR"):
+        # setenv prima di delenv: alla fine del test monkeypatch toglie anche i valori scritti da main().
+        monkeypatch.setenv(name, "")
+        monkeypatch.delenv(name)
+
+    def run(*args: str) -> dict:
+        monkeypatch.setattr(sys, "argv", ["app.serve", *args])
+        serve.main()
+        return calls
+
+    return run
+
+
+def test_migrations_run_once_in_the_supervisor(server):
+    calls = server("--workers", "3")
+    assert calls["migrations"] == 1
+    [(name, config, sockets)] = calls["supervisors"]
+    assert name == "multiprocess"
+    assert config.workers == 3
+    assert sockets == ["socket"]
+    # I worker non toccano lo schema e dimensionano il pool sul numero reale di processi.
+    assert os.environ["DB_SCHEMA_ON_STARTUP"] == "skip"
+    assert os.environ["WEB_CONCURRENCY"] == "3"
+
+
+def test_skip_migrations(server):
+    calls = server("--skip-migrations", "--workers", "2")
+    assert calls["migrations"] == 0
+    assert os.environ["DB_SCHEMA_ON_STARTUP"] == "skip"
+
+
+def test_metrics_dir_is_emptied_of_previous_snapshots(server, tmp_path):
+    directory = tmp_path / "metrics"
+    directory.mkdir()
+    (directory / "1234.json").write_text("{}")
+    (directory / "1234.json.tmp").write_text("{")
+    (directory / "note.txt").write_text("resta")
+
+    server("--skip-migrations")
+    assert os.environ["METRICS_MULTIPROCESS_DIR"] == str(directory)
+    assert sorted(path.name for path in directory.iterdir()) == ["note.txt"]
+
+
+def test_reload_uses_a_single_reloading_process(server, tmp_path):
+    calls = server("--skip-migrations", "--reload")
+    [(name, config, _)] = calls["supervisors"]
+    assert name == "reload"
+    assert config.options["reload"] is True
+    assert "METRICS_MULTIPROCESS_DIR" not in os.environ
+    assert not (tmp_path / "metrics").exists()
@@ -0,0 +1,173 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+from app import services
+from app.models import AIInteraction, Meal
+
+
+@pytest.fixture(autouse=True)
+def clear_insights_cache():
+    services._insights_cache._entries.clear()
+
+
+@pytest.fixture
+def insights(monkeypatch):
+    state = {"calls": 0, "release": None}
+
+    async def fake_generate_day_insights(payload, preferences=None, include_advice=False):
+        state["calls"] += 1
+        if state["release"] is not None:
+            await state["release"].wait()
+        return {"needs": {"calories": 2000, "proteins": 120, "carbs": 220, "fats": 70}, "note": "AI"}
+
+    monkeypatch.setattr(services, "generate_day_insights", fake_generate_day_insights)
+    return state
+
+
+def _add_meal(db, user, calories: float) -> None:
+    db.add(
+        Meal(
+            user_id=user.id,
+            meal_type="pranzo",
+            food_name="Pasta",
+            consumed_at=datetime.combine(date.today(), datetime.min.time().replace(hour=13)),
+            calories=calories,
+        )
+    )
+    db.commit()
+
+
+def test_coalesce_key_changes_with_meals(db, user):
+    day = date.today()
+    before = services._coalesce_key("daily_needs", user, services.load_day_context(db, user, day))
+    _add_meal(db, user, 500)
+    after = services._coalesce_key("daily_needs", user, services.load_day_context(db, user, day))
+    assert before != after
+
+
+def test_coalesced_task_outlives_first_caller_session(db, user, insights):
+    day = date.today()
+    user_id = user.id
+
+    async def scenario():
+        insights["release"] = asyncio.Event()
+        first_db = services.SessionLocal()
+        first_user = first_db.get(type(user), user_id)
+        first = asyncio.create_task(services.build_daily_needs(first_db, first_user, day))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(services.build_daily_needs(db, user, day))
+        await asyncio.sleep(0.01)
+
+        # La prima richiesta viene annullata e la sua sessione chiusa prima che l'AI risponda.
+        first.cancel()
+        first_db.close()
+        insights["release"].set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    result = asyncio.run(scenario())
+    assert insights["calls"] == 1
+    assert result["source"] == "ai"
+    db.expire_all()
+    assert db.query(AIInteraction).filter(AIInteraction.kind == "day_insights").count() == 1
+
+
+def test_dashboard_timeout_falls_back_and_task_stores_with_own_session(db, user, insights, monkeypatch):
+    monkeypatch.setattr(services.settings, "dashboard_ai_timeout", 0.05)
+    day = date(2024, 1, 1)
+
+    async def scenario():
+        insights["release"] = asyncio.Event()
+        result = await services.build_dashboard(db, user, day, {"summary", "needs", "timeline"})
+        # La sessione della richiesta si chiude mentre il task condiviso e' ancora in corso.
+        db.close()
+        insights["release"].set()
+        for _ in range(100):
+            if not services._inflight._calls:
+                break
+            await asyncio.sleep(0.01)
+        return result
+
+    result = asyncio.run(scenario())
+    assert result["sections"] == {"summary": "timeout", "needs": "timeout", "timeline": "ok"}
+    assert result["summary"]["is_closed"] and result["summary"]["advice"] is None
+    assert result["needs"]["source"] == "stimato"
+    stored = db.query(services.DailySummary).filter_by(user_id=user.id, day=day).one()
+    assert stored.status == "closed"
+
+
+def test_failed_advice_is_not_stored_so_the_day_is_retried(db, user, monkeypatch):
+    day = date(2024, 1, 1)
+    responses = [RuntimeError("ollama giu'"), {"needs": {}, "advice": "Resoconto AI"}]
+
+    async def fake_generate_day_insights(payload, preferences=None, include_advice=False):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(services, "generate_day_insights", fake_generate_day_insights)
+
+    result = asyncio.run(services.build_daily_summary(db, user, day))
+    assert result["advice"] == services.FALLBACK_ADVICE
+    stored = db.query(services.DailySummary).filter_by(user_id=user.id, day=day).one()
+    assert stored.advice is None
+
+    result = asyncio.run(services.build_daily_summary(db, user, day))
+    assert result["advice"] == "Resoconto AI"
+    db.refresh(stored)
+    assert stored.advice == "Resoconto AI"
+
+
+def test_daily_summary_job_fails_while_advice_is_missing(db, user, monkeypatch):
+    from app.worker import handle_daily_summary
+
+    async def failing_generate_day_insights(payload, preferences=None, include_advice=False):
+        raise RuntimeError("ollama giu'")
+
+    monkeypatch.setattr(services, "generate_day_insights", failing_generate_day_insights)
+    with pytest.raises(RuntimeError):
+        asyncio.run(handle_daily_summary(db, None, {"user_id": user.id, "day": "2024-01-01"}))
+
+
+def test_failed_ollama_call_is_logged_with_its_error(db, user):
+    from app.ai_metrics import track_ai_calls
+
+    async def scenario():
+        with track_ai_calls():
+            # OLLAMA_BASE_URL punta a una porta chiusa (conftest): la chiamata fallisce subito.
+            with pytest.raises(Exception):
+                await services._generate_insights(user.id, {"day": "2024-01-01", "day_closed": True}, {}, ("k",))
+
+    asyncio.run(scenario())
+    entry = db.query(AIInteraction).filter(AIInteraction.kind == "day_insights").one()
+    assert entry.error
+    assert entry.call_count == 1
+    assert entry.output_payload is None
+
+
+def test_dashboard_database_work_runs_off_the_event_loop(db, user, insights, monkeypatch):
+    on_loop = []
+
+    def recording(func):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(func.__name__)
+            except RuntimeError:
+                pass
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for name in ("load_day_context", "_read_task_context", "_read_summary_state", "build_water_summary"):
+        monkeypatch.setattr(services, name, recording(getattr(services, name)))
+
+    result = asyncio.run(
+        services.build_dashboard(db, user, date.today(), set(services.DASHBOARD_SECTIONS))
+    )
+    assert set(result["sections"].values()) == {"ok"}
+    assert on_loop == []
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return calls, results, flight.in_flight("key")
+
+    calls, results, in_flight = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [1] * 5
+    assert not in_flight
+
+
+def test_cancelling_first_caller_does_not_cancel_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "ok"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_exception_reaches_every_waiter_and_clears_key():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        assert not flight.in_flight("key")
+        retry = await asyncio.gather(flight.do("key", failing), return_exceptions=True)
+        return calls, results + retry
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 2
+    assert all(isinstance(result, ValueError) for result in results)
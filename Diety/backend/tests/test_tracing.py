@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from app import tracing
+from app.config import settings
+from app.jobs import enqueue_job, job_payload
+
+
+class CollectingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def submit(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    exporter = CollectingExporter()
+    monkeypatch.setattr(settings, "tracing_exporter", "file")
+    monkeypatch.setattr(settings, "tracing_sample_rate", 1.0)
+    monkeypatch.setattr(tracing, "_exporters", {"file": exporter})
+    return exporter.spans
+
+
+def test_child_spans_nest_under_the_current_span(exported):
+    with tracing.trace("job", kind="daily_summary") as root:
+        with tracing.child_span("generate", {"cycle": 1}) as generate:
+            with tracing.child_span("ollama", {}) as call:
+                assert tracing.current_span() is call
+            assert tracing.current_span() is generate
+    assert tracing.current_span() is None
+
+    # Chiusi dal piu' interno: l'esportatore riceve prima i figli.
+    assert [span.name for span in exported] == ["ollama", "generate", "job"]
+    assert {span.trace_id for span in exported} == {root.trace_id}
+    assert root.parent_id is None
+    assert generate.parent_id == root.span_id
+    assert call.parent_id == generate.span_id
+    assert all(span.end_ns >= span.start_ns for span in exported)
+
+
+def test_error_is_recorded_on_the_failing_span(exported):
+    with pytest.raises(ValueError):
+        with tracing.trace("job"):
+            with tracing.child_span("parse", {}):
+                raise ValueError("json non valido")
+    assert [(span.name, span.error) for span in exported] == [("parse", "ValueError"), ("job", "ValueError")]
+
+
+def test_child_span_without_a_trace_is_a_no_op(exported):
+    with tracing.child_span("orfano", {}) as span:
+        assert span is None
+    assert exported == []
+
+
+def test_traceparent_continues_the_callers_trace(exported):
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    with tracing.trace("job", traceparent=f"00-{trace_id}-00f067aa0ba902b7-01") as span:
+        assert tracing.current_traceparent() == f"00-{trace_id}-{span.span_id}-01"
+    assert span.trace_id == trace_id
+    assert span.parent_id == "00f067aa0ba902b7"
+
+
+def test_unsampled_traceparent_is_not_recorded(exported):
+    with tracing.trace("job", traceparent="00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00") as span:
+        assert span is None
+    assert exported == []
+
+
+@pytest.mark.parametrize("header", ["garbage", "00-xyz-00f067aa0ba902b7-01", "01-4bf92f3577b34da6a3ce929d0e0e4736"])
+def test_malformed_traceparent_starts_a_new_trace(exported, header):
+    with tracing.trace("job", traceparent=header) as span:
+        assert span.parent_id is None
+        assert len(span.trace_id) == 32
+
+
+def test_tracing_disabled_records_nothing(exported, monkeypatch):
+    monkeypatch.setattr(settings, "tracing_exporter", "")
+    with tracing.trace("job") as span:
+        assert span is None
+        assert tracing.current_traceparent() is None
+
+
+def test_enqueued_job_carries_the_traceparent(exported, db):
+    with tracing.trace("request") as span:
+        job = enqueue_job(db, "daily_summary", {"day": "2024-01-01"})
+    assert job_payload(job) == {"day": "2024-01-01", "traceparent": f"00-{span.trace_id}-{span.span_id}-01"}
+
+    untraced = enqueue_job(db, "daily_summary", {"day": "2024-01-02"})
+    assert "traceparent" not in job_payload(untraced)
+
+
+def test_request_trace_id_is_returned_and_continued(exported, client):
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    response = client.get("/health/live", headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"})
+    assert response.headers["X-Trace-Id"] == trace_id
+    root = exported[-1]
+    assert root.server and root.parent_id == "00f067aa0ba902b7"
+    assert root.attrs["http.status_code"] == 200
+
+
+def test_file_exporter_writes_otlp_json_lines(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(settings, "tracing_file", str(path))
+    monkeypatch.setattr(settings, "tracing_export_interval", 0.05)
+    root = tracing.TraceSpan(
+        "GET /api/dashboard", "a" * 32, "b" * 16, None, 1_000, {"http.status_code": 200}, server=True
+    )
+    root.end_ns = 5_000
+    child = tracing.TraceSpan("ollama", "a" * 32, "c" * 16, "b" * 16, 2_000, {"model": "mistral", "cached": False})
+    child.end_ns = 4_000
+    child.error = "ConnectError"
+
+    exporter = tracing.SpanExporter(tracing._write_file)
+    exporter.submit(child)
+    exporter.submit(root)
+    exporter.shutdown()
+
+    # Una riga per lotto: i due span possono arrivare in uno o due lotti.
+    spans = {}
+    for line in path.read_text().splitlines():
+        [resource] = json.loads(line)["resourceSpans"]
+        resource_attrs = {item["key"]: item["value"] for item in resource["resource"]["attributes"]}
+        assert resource_attrs["service.name"] == {"stringValue": settings.tracing_service_name}
+        spans.update({span["name"]: span for span in resource["scopeSpans"][0]["spans"]})
+    assert spans.keys() == {"GET /api/dashboard", "ollama"}
+
+    server = spans["GET /api/dashboard"]
+    assert server["kind"] == 2
+    assert "parentSpanId" not in server
+    assert (server["startTimeUnixNano"], server["endTimeUnixNano"]) == ("1000", "5000")
+    assert server["attributes"] == [{"key": "http.status_code", "value": {"intValue": "200"}}]
+
+    internal = spans["ollama"]
+    assert internal["kind"] == 1
+    assert internal["parentSpanId"] == "b" * 16
+    assert internal["status"] == {"code": 2, "message": "ConnectError"}
+    assert {"key": "cached", "value": {"boolValue": False}} in internal["attributes"]